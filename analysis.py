@@ -0,0 +1,283 @@
+import os
+import time
+
+import numpy as np
+
+# time units in nanoseconds
+SECOND: int = 10**9
+HOUR:   int = 3600 * SECOND
+DAY:    int = 24 * HOUR
+WEEK:   int = 7 * DAY
+
+# hardcoded EST shift windows relative to midnight of the day a session (or
+# incident) starts in, covering a 48 hr range of shifts, and the shift each
+# window belongs to:
+#   Shift 1 is 9 AM to 5 PM, Shift 2 is 5 PM to 1 AM, Shift 3 is 1 AM to 9 AM
+SHIFT_EDGES = np.array([-15, -7, 1, 9, 17, 25, 33], dtype=np.int64) * HOUR
+SHIFT_OF_WINDOW = np.array([0, 1, 2, 0, 1, 2])
+N_SHIFTS: int = 3
+
+def to_epoch(times) -> np.ndarray:
+    """ Convert a sequence of datetimes (pd.Timestamp, datetime or datetime64)
+    to an int64 array of nanoseconds since the epoch. Naive times are taken
+    as wall clock time, i.e. no timezone conversion is done.
+    """
+    return np.array(times, dtype='datetime64[ns]').view(np.int64)
+
+def local_epoch(times, tz) -> np.ndarray:
+    """ Epochs (ns) of naive wall clock epochs (ns) read as times in timezone
+    tz, the way mktime() and strftime('%s') read them in a process running
+    in tz: times skipped when clocks go forward are moved forward by the
+    gap, i.e. read with the offset from before it, and times repeated when
+    clocks go back are taken as daylight saving time (mktime() does so in a
+    fresh process; later on it goes by the offset of its previous call)
+    """
+    # the rest of the module does without pandas
+    import pandas as pd
+
+    times = np.atleast_1d(np.asarray(times, dtype=np.int64))
+    wallclock = pd.DatetimeIndex(times.view('datetime64[ns]'))
+    local = wallclock.tz_localize(tz,
+                                  ambiguous=np.ones(len(times), dtype=bool),
+                                  nonexistent='NaT')
+    epochs = local.asi8.copy()
+    skipped = np.asarray(local.isna())
+    if skipped.any():
+        # the UTC offset a day before is the one before the gap
+        before = wallclock[skipped] - pd.Timedelta(1, 'D')
+        offset = before.tz_localize(tz, ambiguous=True).asi8 - before.asi8
+        epochs[skipped] = times[skipped] + offset
+    return epochs
+
+def local_zone():
+    """ Timezone of the process, the one mktime() and strftime('%s') read
+    times in: the name in the TZ environment variable or the /etc/localtime
+    link, else dateutil's tzlocal(). None if it is UTC (or any zone without
+    DST at offset 0), where the wall clock times are the epochs already.
+    """
+    if time.timezone == 0 and not time.daylight:
+        return None
+    from zoneinfo import ZoneInfo
+
+    name = os.environ.get('TZ', '').lstrip(':')
+    if not name:
+        path = os.path.realpath('/etc/localtime')
+        name = path.partition('zoneinfo/')[2]
+    try:
+        ZoneInfo(name)
+        return name
+    except (ValueError, OSError):
+        from dateutil.tz import tzlocal
+        return tzlocal()
+
+def week_zone(tz):
+    """ The timezone weeks are binned in for a tz argument: 'local' is the
+    process' timezone (local_zone()), None bins the wall clock times as they
+    are, anything else is a timezone pandas knows
+    """
+    return local_zone() if tz == 'local' else tz
+
+def floor_day(t: np.ndarray) -> np.ndarray:
+    """ Midnight of the day of each epoch time (ns)
+    """
+    return t - t % DAY
+
+def weekday(t: np.ndarray) -> np.ndarray:
+    """ Day of the week of each epoch time (ns), Monday is 0
+    """
+    # the epoch was a Thursday
+    return (t // DAY + 3) % 7
+
+def sequential_sum(values: np.ndarray, start: float = 0.0) -> float:
+    """ Sum values one after the other, like a python += loop does, so that
+    results match the per-event loops to the last bit
+    """
+    if len(values) == 0:
+        return start
+    return float(np.cumsum(np.concatenate(([start], values)))[-1])
+
+
+class SessionTotals():
+    """ Running totals of the sessions of a character analyzed in earlier runs
+    so that new sessions can be added to them without keeping the old ones:
+        firstLogin: epoch (ns) of the first login
+        lastLogout: epoch (ns) of the last logout
+        shiftHours: hours worked in shift 1, 2 and 3
+        weekSeconds: seconds worked per week, starting from the week of
+            firstLogin
+    """
+    def __init__(self, firstLogin: int, lastLogout: int, shiftHours,
+                 weekSeconds):
+        self.firstLogin: int = int(firstLogin)
+        self.lastLogout: int = int(lastLogout)
+        self.shiftHours: np.ndarray = np.asarray(shiftHours, dtype=float)
+        self.weekSeconds: np.ndarray = np.asarray(weekSeconds, dtype=np.int64)
+
+    def __repr__(self):
+        """
+        """
+        return (f'SessionTotals({self.firstLogin}, {self.lastLogout}, '
+                f'{self.shiftHours.tolist()}, {self.weekSeconds.tolist()})')
+
+
+class TimeEvents():
+    """ NumPy-backed container of a character's login, logout and incident
+    times, stored as int64 epoch (ns) arrays. Computes the per week and per
+    shift quantities reported in the overview with interval clipping and
+    searchsorted/bincount instead of looping over events.
+        logins: login times of paired sessions
+        logouts: logout times of paired sessions
+        incidentTimes: times of incidents the character is involved in
+        totals: SessionTotals of earlier sessions to add to, or None
+        tz: timezone the weeks are binned in, or None to bin the wall clock
+            times as they are (see week_zone())
+        weekBoundaries: epoch (ns) of the Monday midnights binning weeks
+
+    Weeks binned in a timezone give the same hours per week as the first
+    versions of the analysis did when run in that timezone, which read the
+    wall clock times with the process' local time through strftime('%s').
+    """
+    def __init__(self, logins, logouts, incidentTimes=(), totals=None,
+                 tz=None):
+        # only login/logout pairs are sessions; a trailing login without a
+        # logout (still logged in at the end of the timesheet) is dropped
+        nPairs = min(len(logins), len(logouts))
+        self.logins:  np.ndarray = to_epoch(logins[:nPairs])
+        self.logouts: np.ndarray = to_epoch(logouts[:nPairs])
+        self.incidentTimes: np.ndarray = to_epoch(incidentTimes)
+        self.totals: SessionTotals = totals
+        self.tz = tz = week_zone(tz)
+        self.weekBoundaries: np.ndarray = np.zeros(0, dtype=np.int64)
+
+        # weeks run from the first login ever to the last logout
+        firsttime = lasttime = None
+        if totals is not None:
+            firsttime, lasttime = totals.firstLogin, totals.lastLogout
+        elif len(logins) > 0:
+            firsttime = to_epoch(logins[:1])[0]
+        if len(logouts) > 0:
+            lasttime = to_epoch(logouts[-1:])[0]
+        if firsttime is not None and lasttime is not None:
+            self.weekBoundaries = week_boundaries(firsttime, lasttime, tz)
+
+    def __len__(self):
+        return len(self.logins)
+
+    @property
+    def nWeeks(self) -> int:
+        return max(len(self.weekBoundaries) - 1, 0)
+
+    def shiftWindowHours(self) -> np.ndarray:
+        """ Hours of each session falling in each of the shift windows around
+        its login day; shape (nSessions, 6)
+        """
+        start_of_day = floor_day(self.logins)[:, None]
+        shift_st = start_of_day + SHIFT_EDGES[None, :-1]
+        shift_et = start_of_day + SHIFT_EDGES[None, 1:]
+        t = (np.minimum(self.logouts[:, None], shift_et)
+             - np.maximum(self.logins[:, None], shift_st))
+        return np.maximum(t, 0) / HOUR
+
+    def hoursPerShift(self) -> np.ndarray:
+        """ Total hours worked in shift 1, 2 and 3
+        """
+        window_hours = self.shiftWindowHours()
+        totals = np.zeros(N_SHIFTS)
+        if self.totals is not None:
+            totals[:] = self.totals.shiftHours
+        for shift in range(N_SHIFTS):
+            # keep the session-by-session order of summation
+            totals[shift] = sequential_sum(
+                window_hours[:, SHIFT_OF_WINDOW == shift].ravel(),
+                totals[shift])
+        return totals
+
+    def hoursPerWeek(self) -> np.ndarray:
+        """ Hours worked in each week (Mon -> Sun)
+        """
+        logins, logouts = self.logins, self.logouts
+        if self.tz is not None:
+            logins = local_epoch(logins, self.tz)
+            logouts = local_epoch(logouts, self.tz)
+        # whole seconds, like the epoch values of strftime('%s')
+        seconds = covered_per_bin(logins // SECOND, logouts // SECOND,
+                                  self.weekBoundaries // SECOND)
+        if self.totals is not None:
+            nOld = min(len(self.totals.weekSeconds), len(seconds))
+            seconds[:nOld] += self.totals.weekSeconds[:nOld]
+        return seconds / 3600
+
+    def incidentsPerWeek(self) -> np.ndarray:
+        """ Number of incidents started in each week (Mon -> Sun)
+        """
+        times = self.incidentTimes
+        if self.tz is not None:
+            times = local_epoch(times, self.tz)
+        return count_per_bin(times, self.weekBoundaries).astype(float)
+
+    def incidentsPerShift(self) -> np.ndarray:
+        """ Number of incidents started in shift 1, 2 and 3
+        """
+        offset = self.incidentTimes - floor_day(self.incidentTimes)
+        window = count_per_bin(offset, SHIFT_EDGES)
+        return np.bincount(SHIFT_OF_WINDOW, weights=window,
+                           minlength=N_SHIFTS).astype(int)
+
+
+def week_boundaries(firsttime: int, lasttime: int, tz=None) -> np.ndarray:
+    """ Epoch (ns) Monday midnights from the week of firsttime until after
+    lasttime, defining a week as Monday to Sunday because that's what
+    datetime does. With a timezone tz, the first and last Monday are read in
+    it (see local_epoch()) and the boundaries are whole weeks apart from
+    there, as in the first versions of the analysis.
+    """
+    firstMonday, nWeeks = week_range(np.array([firsttime]),
+                                     np.array([lasttime]), tz)
+    return firstMonday[0] + np.arange(nWeeks[0] + 1, dtype=np.int64) * WEEK
+
+def week_range(firsttimes: np.ndarray, lasttimes: np.ndarray, tz=None):
+    """ Vectorized week bins for many (firsttime, lasttime) pairs. Returns the
+    epoch (ns) of the first Monday midnight and the number of whole weeks
+    binned after it; with a timezone tz, the Mondays are read in it as
+    week_boundaries() does
+    """
+    firsttimes = np.asarray(firsttimes, dtype=np.int64)
+    lasttimes = np.asarray(lasttimes, dtype=np.int64)
+    firstWeekday = weekday(firsttimes)
+    firstMonday = floor_day(firsttimes) - firstWeekday * DAY
+    # NOTE: the end is offset using the weekday of the *first* time, which
+    # keeps the number of weeks identical to earlier versions of the analysis
+    lastMonday = floor_day(lasttimes) + (7 - firstWeekday) * DAY
+    if tz is not None and len(firsttimes) > 0:
+        firstMonday = local_epoch(firstMonday, tz)
+        lastMonday = local_epoch(lastMonday, tz)
+    # number of boundaries np.arange(firstMonday, lastMonday, WEEK) would give
+    nBoundaries = -(-(lastMonday - firstMonday) // WEEK)
+    return firstMonday, np.maximum(nBoundaries - 1, 0)
+
+def covered_per_bin(starts: np.ndarray, ends: np.ndarray,
+                    boundaries: np.ndarray) -> np.ndarray:
+    """ Total length of the [start, end) intervals falling within each bin
+    [boundaries[j], boundaries[j+1]); time outside of the boundaries is dropped
+    """
+    # intervals ending before they start never contribute any time
+    keep = ends >= starts
+    starts = np.sort(starts[keep])
+    ends = np.sort(ends[keep])
+    # covered time before each boundary b is
+    #   sum_{start < b} (b - start) - sum_{end < b} (b - end)
+    nStarts = np.searchsorted(starts, boundaries, side='left')
+    nEnds = np.searchsorted(ends, boundaries, side='left')
+    sumStarts = np.concatenate(([0], np.cumsum(starts)))[nStarts]
+    sumEnds = np.concatenate(([0], np.cumsum(ends)))[nEnds]
+    covered = boundaries*nStarts - sumStarts - boundaries*nEnds + sumEnds
+    return np.diff(covered)
+
+def count_per_bin(times: np.ndarray, boundaries: np.ndarray) -> np.ndarray:
+    """ Number of times falling within each bin
+    [boundaries[j], boundaries[j+1])
+    """
+    nBins = max(len(boundaries) - 1, 0)
+    idx = np.searchsorted(boundaries, times, side='right') - 1
+    idx = idx[(idx >= 0) & (idx < nBins)]
+    return np.bincount(idx, minlength=nBins)
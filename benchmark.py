@@ -0,0 +1,162 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import matplotlib
+# no display needed to time the gantt chart
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+import parsers
+import synthetic
+
+# stages timed at every size, in pipeline order
+STAGES = ['readTimesheet', 'readRoster', 'readIncidents', 'parseTimesheet',
+          'parseRoster', 'parseIncidents', 'check_names',
+          'analyzeTimeEvents', 'createGanttChart']
+
+def run_stages(paths: dict, outDir: str, dpi: int) -> dict:
+    """ Seconds taken by each of STAGES on the synthetic exports in paths,
+    starting from an empty character dict
+    """
+    seconds = {}
+
+    @contextlib.contextmanager
+    def timed(stage):
+        # the parsers report name matching and missing data on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            t = time.perf_counter()
+            yield
+            seconds[stage] = time.perf_counter() - t
+
+    characters = {}
+    timesheet = parsers.Timesheet(characters, paths['xlsx', 'timesheet'])
+    roster = parsers.Roster(characters, paths['xlsx', 'roster'])
+    incidents = parsers.IncidentReport(characters, paths['xlsx', 'incidents'])
+    with timed('readTimesheet'):
+        timesheetDf = timesheet.readSheet()
+    with timed('readRoster'):
+        rosterDf = roster.readSheet()
+    with timed('readIncidents'):
+        incidentDf = incidents.readSheet()
+    with timed('parseTimesheet'):
+        timesheet.parseTimesheet(df=timesheetDf)
+    with timed('parseRoster'):
+        roster.parseRoster(rosterDf)
+    with timed('parseIncidents'):
+        incidents.parseIncidents(incidentDf)
+
+    # the old linear scan over the dict, for every name in the sheets
+    names = pd.unique(np.concatenate([
+        timesheetDf['Name'].dropna().to_numpy(dtype=object),
+        rosterDf['Name'].dropna().to_numpy(dtype=object)]))
+    with timed('check_names'):
+        for name in names:
+            parsers.check_names(name, characters, verbose=False)
+
+    with timed('analyzeTimeEvents'):
+        for char in characters.values():
+            char.analyzeTimeEvents()
+    with timed('createGanttChart'):
+        timesheet.createGanttChart(os.path.join(outDir, 'gantt_chart.png'),
+                                   ylim=(-0.1, len(characters) + 0.1),
+                                   dpi=dpi)
+        plt.close('all')
+    return seconds
+
+def benchmark(sizes: list, nDays: int, repeat: int = 3, dpi: int = 300,
+              seed: int = 0) -> dict:
+    """ Time STAGES on synthetic exports of each number of officers in sizes,
+    keeping the best of repeat runs. Returns the results as a JSON-able dict.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for nOfficers in sizes:
+            outDir = os.path.join(tmp, str(nOfficers))
+            paths = synthetic.generate(outDir, nOfficers, nDays, seed=seed)
+            runs = [run_stages(paths, outDir, dpi) for _ in range(repeat)]
+            best = {stage: min(run[stage] for run in runs)
+                    for stage in STAGES}
+            results.append({'officers': nOfficers, 'days': nDays,
+                            'rows': paths['rows'],
+                            'incidents': paths['incidents'],
+                            'seconds': best})
+            print(f'{nOfficers:>6} officers, {paths["rows"]:>8} rows: '
+                  f'{sum(best.values()):8.2f} s')
+    return {'commit': git_commit(), 'date': datetime.now().isoformat(),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'machine': platform.machine(),
+            'repeat': repeat, 'dpi': dpi, 'seed': seed, 'results': results}
+
+def git_commit() -> str:
+    """ Commit of the code being benchmarked, if it's a git checkout
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+def compare(new: dict, old: dict):
+    """ Print the time of every stage relative to an earlier run, per size
+    both runs have
+    """
+    oldResults = {(r['officers'], r['days']): r['seconds']
+                  for r in old['results']}
+    print(f'\nrelative to {old.get("commit") or "baseline"} '
+          f'(< 1 is faster)')
+    print(f'{"stage":>20}' + ''.join(f'{r["officers"]:>10}'
+                                      for r in new['results']))
+    for stage in STAGES:
+        line = f'{stage:>20}'
+        for r in new['results']:
+            before = oldResults.get((r['officers'], r['days']), {})
+            if before.get(stage):
+                line += f'{r["seconds"][stage] / before[stage]:>10.2f}'
+            else:
+                line += f'{"-":>10}'
+        print(line)
+
+
+# MAIN
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Time the parsing and analysis stages on synthetic PD '
+                    'exports of several sizes')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[25, 100, 400],
+                        help='numbers of officers to benchmark')
+    parser.add_argument('--days', type=int, default=30,
+                        help='length of the time period in days')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs per size; the fastest one is kept')
+    parser.add_argument('--dpi', type=int, default=300,
+                        help='resolution of the gantt chart')
+    parser.add_argument('--output', default='benchmark.json',
+                        help='file the results are saved to as JSON')
+    parser.add_argument('--compare', default=None, metavar='JSON',
+                        help='results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    results = benchmark(args.sizes, args.days, args.repeat, args.dpi)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\n{"stage":>20}' + ''.join(f'{r["officers"]:>10}'
+                                        for r in results['results']))
+    for stage in STAGES:
+        print(f'{stage:>20}' + ''.join(f'{r["seconds"][stage]:>10.3f}'
+                                        for r in results['results']))
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
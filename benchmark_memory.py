@@ -0,0 +1,112 @@
+import argparse
+import gc
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from character import ANOMALY_KINDS, Character
+
+class LegacyCharacter(object):
+    """ The character data as it used to be stored: attributes in __dict__,
+    events as lists of pd.Timestamp, incidents as [IncidentNr, datetime] lists
+    and anomalies as copies of the row values
+    """
+    def __init__(self, name: str, stateID: int = 0):
+        self.name = name
+        self.stateID = stateID
+        self.rank = self.position = self.callsign = ''
+        self.department = self.shift = ''
+        self.loggedIn = False
+        self.logins = []
+        self.logouts = []
+        self.strangeness = {kind: [] for kind in ANOMALY_KINDS}
+        self.loggedTime = self.shift1Time = self.shift2Time = 0
+        self.shift3Time = 0
+        self.hoursPerWeek = []
+        self.sessionTotals = None
+        self.incidents = []
+        self.shift1Incidents = self.shift2Incidents = 0
+        self.shift3Incidents = 0
+        self.incidentsPerWeek = []
+
+def synthetic_events(nCharacters: int, nSessions: int, nIncidents: int,
+                     nAnomalies: int, seed: int = 0):
+    """ Random sessions, incidents and anomaly rows (of a timesheet like
+    table) per character
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2023-01-02').value
+    year = 365 * 24 * 3600 * 10**9
+    nRows = nCharacters * nAnomalies
+    table = pd.DataFrame({
+        'Time': pd.to_datetime(start + rng.integers(0, year, nRows)),
+        'State ID': rng.integers(1000, 99999, nRows),
+        'Name': [f'Character {i % nCharacters}' for i in range(nRows)],
+        'Action': 'Check In'})
+    for i in range(nCharacters):
+        logins = np.sort(start + rng.integers(0, year, nSessions))
+        logouts = logins + rng.integers(10**11, 10**13, nSessions)
+        incidents = start + rng.integers(0, year, nIncidents)
+        rows = np.arange(i * nAnomalies, (i + 1) * nAnomalies)
+        yield (f'Character {i}', logins, logouts,
+               np.arange(nIncidents) + i * nIncidents, incidents, rows, table)
+
+def build_legacy(events) -> dict:
+    characters = {}
+    for name, logins, logouts, numbers, incidents, rows, table in events:
+        char = LegacyCharacter(name)
+        char.logins = list(pd.to_datetime(logins))
+        char.logouts = list(pd.to_datetime(logouts))
+        char.incidents = [[nr, datetime.fromtimestamp(t / 10**9)]
+                          for nr, t in zip(numbers.tolist(),
+                                           incidents.tolist())]
+        char.strangeness['crashes'] = (table.iloc[rows]
+                                       .to_numpy(dtype=object).tolist())
+        characters[name] = char
+    return characters
+
+def build_compact(events) -> dict:
+    characters = {}
+    for name, logins, logouts, numbers, incidents, rows, table in events:
+        char = Character(name)
+        char.logins.extend(logins)
+        char.logouts.extend(logouts)
+        char.incidents.extend(numbers, incidents)
+        char.strangeness.add('crashes', table, rows)
+        characters[name] = char
+    return characters
+
+def measure(build, events) -> int:
+    """ Bytes allocated by build(events) that are still held afterwards
+    """
+    gc.collect()
+    tracemalloc.start()
+    characters = build(events)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del characters
+    return current
+
+
+# MAIN
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Memory used by the character data, legacy lists vs '
+                    'the compact Character')
+    parser.add_argument('--characters', type=int, default=2000)
+    parser.add_argument('--sessions', type=int, default=300)
+    parser.add_argument('--incidents', type=int, default=100)
+    parser.add_argument('--anomalies', type=int, default=10)
+    args = parser.parse_args()
+
+    # generate the events first so only the character data gets measured
+    events = list(synthetic_events(args.characters, args.sessions,
+                                   args.incidents, args.anomalies))
+    legacy = measure(build_legacy, events)
+    compact = measure(build_compact, events)
+    print(f'{args.characters} characters, {args.sessions} sessions, '
+          f'{args.incidents} incidents and {args.anomalies} anomalies each')
+    print(f'{"legacy":>10}: {legacy / 2**20:10.1f} MiB')
+    print(f'{"compact":>10}: {compact / 2**20:10.1f} MiB')
+    print(f'{"reduction":>10}: {legacy / max(compact, 1):10.1f} x')
@@ -0,0 +1,313 @@
+import datetime
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# pyarrow is optional; without it parsed sheets are stored as numpy arrays
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'ONX_DataAnalysisCodes')
+DEFAULT_MAX_BYTES = 512 * 2**20
+# version of the stored sheets, part of the cache keys so entries of an
+# earlier format are never loaded (they get evicted in time)
+FORMAT_VERSION = 2
+
+def read_workbook(path, cache=None, **parseKwargs) -> pd.DataFrame:
+    """ Parse a sheet of an excel workbook. With a WorkbookCache, previously
+    parsed sheets are loaded from the cache instead of decoding the workbook.
+    """
+    if cache is None:
+        return pd.ExcelFile(path).parse(**parseKwargs)
+    return cache.read(path, **parseKwargs)
+
+
+class WorkbookCache():
+    """ On-disk cache of parsed workbook sheets so reruns on the same exports
+    skip the (slow) excel decoding:
+        cacheDir: directory the parsed sheets are stored in
+        maxBytes: size limit of the cache; least recently used sheets are
+            evicted first
+
+    Sheets are stored in Feather format if pyarrow is available, as numpy
+    arrays (.npz) otherwise. Entries are keyed by the content hash of the
+    workbook and the parse arguments; the hash of each path is remembered
+    together with its size and mtime so unchanged files aren't rehashed.
+    The index (index.json) also records the content hash of every entry, so
+    paths whose sheets were all evicted can be forgotten.
+    """
+    def __init__(self, cacheDir: str = DEFAULT_CACHE_DIR,
+                 maxBytes: int = DEFAULT_MAX_BYTES):
+        self.cacheDir: str = str(cacheDir)
+        self.maxBytes: int = maxBytes
+        self.hits: int = 0
+        self.misses: int = 0
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self._indexPath = os.path.join(self.cacheDir, 'index.json')
+
+    def __str__(self):
+        """
+        """
+        return f'Workbook cache in {self.cacheDir}'
+
+    def read(self, path, **parseKwargs) -> pd.DataFrame:
+        """ Return the parsed sheet of the workbook at path, decoding the
+        workbook and storing the result if it isn't cached yet
+        """
+        digest = self.contentHash(path)
+        key = _key(digest, parseKwargs)
+        entry = self._lookup(key)
+        if entry is not None:
+            try:
+                # mark as recently used
+                os.utime(entry)
+                df = _load(entry)
+            # another process sharing the cache evicted it since the lookup
+            except FileNotFoundError:
+                pass
+            else:
+                self.hits += 1
+                return df
+
+        self.misses += 1
+        df = pd.ExcelFile(path).parse(**parseKwargs)
+        self._store(key, df, digest)
+        return df
+
+    def contains(self, path, **parseKwargs) -> bool:
+        """ Whether the sheet is cached, i.e. read() won't decode the workbook
+        """
+        return self._lookup(self.key(path, **parseKwargs)) is not None
+
+    def key(self, path, **parseKwargs) -> str:
+        """ Cache key of a workbook sheet: the content hash of the workbook
+        and the arguments used to parse it
+        """
+        return _key(self.contentHash(path), parseKwargs)
+
+    def contentHash(self, path) -> str:
+        """ sha256 of the workbook, reused while its size and mtime stay the
+        same
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        index = self._loadIndex()
+        known = index['paths'].get(path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                sha.update(block)
+        index['paths'][path] = [stat.st_size, stat.st_mtime_ns,
+                                sha.hexdigest()]
+        self._saveIndex(index)
+        return sha.hexdigest()
+
+    def clear(self):
+        """ Remove all cached sheets
+        """
+        for entry in self._entries():
+            os.remove(entry)
+        self._saveIndex({'paths': {}, 'entries': {}})
+
+    def _lookup(self, key: str):
+        """ Path of the cache entry of key, None if there is none
+        """
+        for entry in (key + '.feather', key + '.npz'):
+            entry = os.path.join(self.cacheDir, entry)
+            if os.path.exists(entry):
+                return entry
+        return None
+
+    def _store(self, key: str, df: pd.DataFrame, digest: str):
+        """ Write a parsed sheet (of the workbook with content hash digest) to
+        the cache and evict old entries
+        """
+        # entries are written under a temporary name and then moved in place,
+        # so other processes sharing the cache never load a partial entry
+        tmp = os.path.join(self.cacheDir, f'{key}.{os.getpid()}.tmp')
+        stored = False
+        if pyarrow is not None:
+            entry = os.path.join(self.cacheDir, key + '.feather')
+            try:
+                df.to_feather(tmp)
+                stored = True
+            # columns with mixed types or non-string headers can't be stored
+            # by arrow
+            except (pyarrow.ArrowException, ValueError, TypeError):
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        if not stored:
+            # object columns (and the headers) are stored as the JSON of
+            # every value, so loading them doesn't need pickle
+            entry = os.path.join(self.cacheDir, key + '.npz')
+            columns, encoded = [], []
+            try:
+                header = np.array([_encode(col) for col in df.columns],
+                                  dtype=str)
+                for col in df.columns:
+                    values = df[col].to_numpy()
+                    encoded.append(values.dtype == object)
+                    if encoded[-1]:
+                        values = np.array([_encode(v) for v in values],
+                                          dtype=str)
+                    columns.append(values)
+            # values of other types aren't cached, the sheet is decoded again
+            # next time
+            except TypeError:
+                return
+            with open(tmp, 'wb') as f:
+                np.savez(f, columns=header,
+                         encoded=np.array(encoded, dtype=bool),
+                         **{f'c{i}': values
+                            for i, values in enumerate(columns)})
+        os.replace(tmp, entry)
+        index = self._loadIndex()
+        index['entries'][key] = digest
+        self._saveIndex(index)
+        self._evict()
+
+    def _evict(self):
+        """ Remove least recently used entries until the cache fits in
+        maxBytes
+        """
+        # several processes can share the cache (see pipeline.py), so entries
+        # may disappear while evicting
+        entries = []
+        for entry in self._entries():
+            try:
+                entries.append((os.stat(entry), entry))
+            except FileNotFoundError:
+                continue
+        entries.sort(key=lambda x: x[0].st_mtime_ns)
+        total = sum(stat.st_size for stat, entry in entries)
+        evicted = False
+        for stat, entry in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(entry)
+            except FileNotFoundError:
+                pass
+            total -= stat.st_size
+            evicted = True
+        if evicted:
+            self._pruneIndex()
+
+    def _pruneIndex(self):
+        """ Forget the entries that are gone from the cache, and the paths
+        none of the remaining entries were parsed from
+        """
+        index = self._loadIndex()
+        keys = {os.path.basename(entry).rsplit('.', 1)[0]
+                for entry in self._entries()}
+        index['entries'] = {key: digest for key, digest
+                            in index['entries'].items() if key in keys}
+        digests = set(index['entries'].values())
+        index['paths'] = {path: known for path, known
+                          in index['paths'].items() if known[2] in digests}
+        self._saveIndex(index)
+
+    def _entries(self) -> list:
+        return [os.path.join(self.cacheDir, f)
+                for f in os.listdir(self.cacheDir)
+                if f.endswith(('.feather', '.npz'))]
+
+    def _loadIndex(self) -> dict:
+        """ The index: 'paths' maps workbook paths to their size, mtime and
+        content hash, 'entries' maps cache keys to the content hash of the
+        workbook they were parsed from
+        """
+        try:
+            with open(self._indexPath) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        # an index of an earlier version only had the paths; its hashes
+        # are simply computed again
+        if set(index) != {'paths', 'entries'}:
+            index = {'paths': {}, 'entries': {}}
+        return index
+
+    def _saveIndex(self, index: dict):
+        tmp = f'{self._indexPath}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self._indexPath)
+
+
+def _key(digest: str, parseKwargs: dict) -> str:
+    """ Cache key of the sheet parsed with parseKwargs from the workbook with
+    content hash digest
+    """
+    args = json.dumps(parseKwargs, sort_keys=True, default=str)
+    return hashlib.sha256(f'{FORMAT_VERSION}:{digest}{args}'.encode()
+                          ).hexdigest()
+
+def _load(entry: str) -> pd.DataFrame:
+    """ Load a cached sheet
+    """
+    if entry.endswith('.npz'):
+        with np.load(entry, allow_pickle=False) as data:
+            columns = [_decode(col) for col in data['columns'].tolist()]
+            values = {}
+            for i, (col, encoded) in enumerate(zip(columns, data['encoded'])):
+                values[col] = data[f'c{i}']
+                if encoded:
+                    decoded = np.empty(len(values[col]), dtype=object)
+                    decoded[:] = [_decode(v) for v in values[col].tolist()]
+                    values[col] = decoded
+            return pd.DataFrame(values, columns=columns)
+
+    df = pd.read_feather(entry)
+    # arrow stores missing values of text columns as nulls; give them back
+    # as NaN like the excel reader does
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
+
+# types of sheet values JSON has none for, by the tag they are stored with;
+# subclasses first
+_VALUE_TYPES = {'Timestamp': pd.Timestamp, 'datetime': datetime.datetime,
+                'date': datetime.date, 'time': datetime.time,
+                'Timedelta': pd.Timedelta, 'timedelta': datetime.timedelta}
+_PARSERS = {'Timestamp': pd.Timestamp,
+            'datetime': datetime.datetime.fromisoformat,
+            'date': datetime.date.fromisoformat,
+            'time': datetime.time.fromisoformat,
+            'Timedelta': pd.Timedelta,
+            'timedelta': lambda s: pd.Timedelta(s).to_pytimedelta()}
+
+def _encode(value) -> str:
+    """ JSON of a value of an object column, with the type of dates and
+    times tagged so _decode() gives back the same value; TypeError for
+    values of other types
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return json.dumps(value)
+    if value is pd.NaT:
+        return json.dumps({'NaT': None})
+    for tag, kind in _VALUE_TYPES.items():
+        if isinstance(value, kind):
+            if tag == 'timedelta':
+                return json.dumps({tag: pd.Timedelta(value).isoformat()})
+            return json.dumps({tag: value.isoformat()})
+    raise TypeError(f'Can\'t cache values of type {type(value).__name__}')
+
+def _decode(text: str):
+    """ Value of a JSON string of _encode()
+    """
+    value = json.loads(text)
+    if not isinstance(value, dict):
+        return value
+    (tag, iso), = value.items()
+    return pd.NaT if tag == 'NaT' else _PARSERS[tag](iso)
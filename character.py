@@ -1,10 +1,210 @@
-
-from datetime import datetime, timedelta
+from collections.abc import Mapping
 import numpy as np
 import pandas as pd
 
+from analysis import TimeEvents
+import profiling
+
+# kinds of timesheet rows stashed in Character.strangeness
+ANOMALY_KINDS = ('crashes', 'pre', 'post', 'other')
+
+class GrowableArray():
+    """ Append-only numpy array with amortized O(1) appends; the storage
+    doubles when it runs full, so characters don't keep a python object per
+    event
+        values: view of the stored values
+    """
+    __slots__ = ('_data', '_size')
+
+    def __init__(self, values=(), dtype=np.int64):
+        # empty arrays share no storage until the first append
+        self._data: np.ndarray = np.empty(0, dtype=dtype)
+        self._size: int = 0
+        if len(values):
+            self.extend(values)
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        """
+        """
+        return f'{type(self).__name__}({self.values.tolist()})'
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def append(self, value):
+        self.extend([value])
+
+    def extend(self, values):
+        values = self._convert(values)
+        if values.dtype != self._data.dtype and \
+                not np.can_cast(values.dtype, self._data.dtype, 'safe'):
+            # e.g. incident numbers that aren't integers
+            self._data = self._data.astype(np.result_type(self._data,
+                                                          values))
+        size = self._size + len(values)
+        if size > len(self._data):
+            data = np.empty(max(size, 2*len(self._data), 4),
+                            dtype=self._data.dtype)
+            data[:self._size] = self.values
+            self._data = data
+        self._data[self._size:size] = values
+        self._size = size
+
+    def _convert(self, values) -> np.ndarray:
+        values = np.asarray(values)
+        # plain python objects, e.g. strings, are kept as objects
+        if values.dtype.kind in 'USV':
+            values = values.astype(object)
+        return values
+
+
+class EpochArray(GrowableArray):
+    """ Growable array of times stored as int64 epoch (ns). Reads like the
+    list of pd.Timestamp it replaces: indexing and iterating give Timestamps,
+    slices give lists of Timestamps
+        epochs: int64 view of the stored times
+    """
+    __slots__ = ()
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [pd.Timestamp(t) for t in self.values[i].tolist()]
+        return pd.Timestamp(int(self.values[i]))
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __array__(self, dtype=None, copy=None):
+        times = self.values.view('datetime64[ns]')
+        return times if dtype is None else times.astype(dtype)
+
+    def __repr__(self):
+        """
+        """
+        return f'EpochArray({[str(t) for t in self]})'
+
+    @property
+    def epochs(self) -> np.ndarray:
+        return self.values
+
+    def _convert(self, values) -> np.ndarray:
+        values = np.asarray(values)
+        # integers are already epoch (ns); anything else is a datetime
+        if values.dtype.kind in 'iu':
+            return values.astype(np.int64, copy=False)
+        return np.array(values, dtype='datetime64[ns]').view(np.int64)
+
+
+class IncidentList():
+    """ Incidents a character is involved in, stored as an array of incident
+    numbers and an EpochArray of the times they were started. Reads like the
+    list of [IncidentNr, datetime] it replaces
+        numbers: incident numbers
+        times: times the incidents were started
+    """
+    __slots__ = ('numbers', 'times')
+
+    def __init__(self):
+        self.numbers: GrowableArray = GrowableArray()
+        self.times:   EpochArray    = EpochArray()
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(len(self))[i]]
+        number = self.numbers.values[i]
+        if isinstance(number, np.generic):
+            number = number.item()
+        return [number, self.times[i]]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __repr__(self):
+        """
+        """
+        return f'IncidentList({list(self)})'
+
+    def append(self, incident):
+        """ Add a single [IncidentNr, datetime] incident
+        """
+        self.extend([incident[0]], [incident[1]])
+
+    def extend(self, numbers, times):
+        """ Add many incidents at once
+        """
+        self.numbers.extend(numbers)
+        self.times.extend(times)
+
+
+class Anomalies(Mapping):
+    """ Timesheet rows of a character that don't match nicely, per kind
+    (see ANOMALY_KINDS). Rows are kept as row positions into the table they
+    came from rather than copies of their values; looking up a kind gives the
+    list of row values
+        sources: tables the rows point into
+    """
+    __slots__ = ('sources', '_rows', '_source')
+
+    def __init__(self):
+        self.sources: list = []
+        self._rows:   dict = {kind: GrowableArray() for kind in ANOMALY_KINDS}
+        self._source: dict = {kind: GrowableArray(dtype=np.int32)
+                              for kind in ANOMALY_KINDS}
+
+    def __getitem__(self, kind) -> list:
+        rows = self._rows[kind].values
+        sources = self._source[kind].values
+        values = []
+        # rows are added table by table, so handle a run of rows of the same
+        # table at once
+        runs = np.flatnonzero(np.diff(sources, prepend=-1, append=-1))
+        for start, stop in zip(runs[:-1], runs[1:]):
+            table = self.sources[sources[start]]
+            values.extend(table.iloc[rows[start:stop]]
+                               .to_numpy(dtype=object).tolist())
+        return values
+
+    def __iter__(self):
+        return iter(ANOMALY_KINDS)
+
+    def __len__(self):
+        return len(ANOMALY_KINDS)
+
+    def __repr__(self):
+        """
+        """
+        return f'Anomalies({ {kind: self.count(kind) for kind in self} })'
+
+    def add(self, kind: str, table: pd.DataFrame, rows):
+        """ Stash the rows at positions rows of table as anomalies of kind
+        """
+        # tables are compared by identity; most characters only ever point
+        # into a single timesheet
+        for i, source in enumerate(self.sources):
+            if source is table:
+                break
+        else:
+            i = len(self.sources)
+            self.sources.append(table)
+        rows = np.asarray(rows, dtype=np.int64)
+        self._rows[kind].extend(rows)
+        self._source[kind].extend(np.full(len(rows), i, dtype=np.int32))
+
+    def count(self, kind: str) -> int:
+        """ Number of rows stashed of kind, without looking them up
+        """
+        return len(self._rows[kind])
+
+
 class Character(object):
-    """ The character object within which each character will have 
+    """ The character object within which each character will have
     associated data stored within class attributes:
         name: character name
         stateID: assigned character StateID
@@ -14,18 +214,33 @@ class Character(object):
         callsign: current department of character in roster
         shift: current shift of character in roster
 
-        logins: list of login events
-        logouts: list of logout events
-        strangeness: collection of timesheet events that don't match nicely
+        logins: EpochArray of login events
+        logouts: EpochArray of logout events
+        strangeness: Anomalies; timesheet events that don't match nicely
         loggedTime: total hours logged
 
         loggedIn: boolean toggle for timesheet analysis
+        sessionTotals: analysis.SessionTotals of sessions from earlier runs
+            (incremental timesheet ingestion), None otherwise
+
+        incidents: IncidentList of incidents the character is involved in
+
+    Attributes are __slots__ and events are stored as int64 arrays to keep
+    the memory use down for large departments.
     """
+    __slots__ = ('name', 'stateID',
+                 'rank', 'position', 'callsign', 'department', 'shift',
+                 'loggedIn', 'logins', 'logouts', 'strangeness',
+                 'loggedTime', 'shift1Time', 'shift2Time', 'shift3Time',
+                 'hoursPerWeek', 'sessionTotals',
+                 'incidents', 'shift1Incidents', 'shift2Incidents',
+                 'shift3Incidents', 'incidentsPerWeek')
+
     def __init__(self, name: str, stateID: int = 0):
         # basic character information
         self.name: str    = name
         self.stateID: int = stateID
-        
+
         # roster data
         self.rank:      str = ''
         self.position:  str = ''
@@ -33,23 +248,21 @@ class Character(object):
         self.department:str = ''
         self.shift:     str = ''
         #self.status:    str = ''
-        
+
         # timesheet data
         self.loggedIn: bool = False
-        self.logins  : list = []
-        self.logouts : list = []
-        self.strangeness: dict = {'crashes': [],
-                                  'pre'    : [],
-                                  'post'   : [],
-                                  'other'  : []}
+        self.logins  : EpochArray = EpochArray()
+        self.logouts : EpochArray = EpochArray()
+        self.strangeness: Anomalies = Anomalies()
         self.loggedTime: float = 0  # units: hours
         self.shift1Time: float = 0  # units: hours
         self.shift2Time: float = 0  # units: hours
         self.shift3Time: float = 0  # units: hours
         self.hoursPerWeek = []      # will be an array of hours
-        
+        self.sessionTotals = None   # totals carried over from earlier runs
+
         # PD incidents data
-        self.incidents: list = []
+        self.incidents: IncidentList = IncidentList()
         self.shift1Incidents: float = 0  # units: hours
         self.shift2Incidents: float = 0  # units: hours
         self.shift3Incidents: float = 0  # units: hours
@@ -65,101 +278,56 @@ class Character(object):
         """
         return f'Character(\'{self.name}\', {self.stateID})'
 
-    def analyzeTimeEvents(self):
+    def sessionText(self) -> str:
+        """ Text of the clocked time and the paired sessions, as listed by
+        Timesheet.getCharacterData
+        """
+        nSessions = min(len(self.logins), len(self.logouts))
+        lines = [f'{self.name} - clocked time: '
+                 f'{str(self.loggedTime).rjust(17)}\n\n']
+        lines.extend(f'in: {login}  -  out: {logout}\n'
+                     for login, logout in zip(self.logins[:nSessions],
+                                              self.logouts[:nSessions]))
+        return ''.join(lines)
+
+    @profiling.staged()
+    def analyzeTimeEvents(self, calendar=None, tz='local'):
         """ Use gathered login/out events from a timesheet to analyze hours
         worked per week, per shift, etc. Update class attribute values to stash
-        results associated with each character. 
+        results associated with each character.
+
+        With a shiftcalendar.ShiftCalendar the shifts and weeks of the
+        calendar are used instead of the EST shift windows. Otherwise the EST
+        weeks are binned in timezone tz, the process' timezone by default
+        (see analysis.week_zone()).
         """
         # do a check for actual data before running through the code
-        if len(self.logins) == 0:
+        if len(self.logins) == 0 and self.sessionTotals is None:
             print(f'No timesheet data has been collected for {self.name}.')
             return
 
-        # get the first and last times the character signed on
-        firsttime = self.logins[0]
-        lasttime = self.logouts[-1]
-
-        # define variables needed to calculate hours/incidents per week
-        # defining a week as Monday to Sunday because that's what datetime does 
-        # get midnight of the first Monday
-        m = firsttime.date() - timedelta(days = firsttime.weekday())
-        firstMonday = int(datetime.combine(m, 
-                                           datetime.min.time()).strftime('%s'))
-        # get midnight of the last Monday
-        m = lasttime.date() + timedelta(days = 7-firsttime.weekday())
-        lastMonday = int(datetime.combine(m,
-                                          datetime.min.time()).strftime('%s'))
-        # numpy array of week times in epoch time values
-        weekBoundaries = np.arange(firstMonday,lastMonday, 604800)
-        nWeeks = len(weekBoundaries) - 1
-        self.hoursPerWeek = np.zeros(nWeeks)
-
-        # define variables needed to calculate hours within shifts
-        # hardcoded shift values, covers a 48 hr range of shifts to be used 
-        # later
-        boundaries = [pd.Timedelta(i,'h') for i in [-15,-7,1,9,17,25,33]]
-        nShifts = len(boundaries)-1
-        unit = pd.Timedelta(1,'h')
-
-        # loop over all shifts (aka a pair of login and logout events)
-        for i in range(0, min(len(self.logins),len(self.logouts))):
-            # handling time worked per EST shift times
-            # followed code from:
-            # https://stackoverflow.com/questions/73997481/calculate-working-hours-time-python-pandas-hours-worked-total-hours-worked
-            start_of_day = self.logins[i].normalize()
-            work_time = [0] * nShifts
-            for j, (lb, ub) in enumerate(zip(boundaries[:-1],boundaries[1:])):
-                shift_st = start_of_day + lb
-                shift_et = start_of_day + ub
-                t = (min(self.logouts[i], shift_et) - max(self.logins[i], shift_st)) / unit
-                work_time[j] = max(0,t)
-
-            # add this login/logout event to shift counters
-            self.shift1Time += work_time[0] # Shift 1 is 9 AM to 5 PM
-            self.shift2Time += work_time[1] # shift 2 is 5 AM to 1 AM
-            self.shift3Time += work_time[2] # shift 3 is 1 AM to 9 AM
-            self.shift1Time += work_time[3] # Shift 1 is 9 AM to 5 PM
-            self.shift2Time += work_time[4] # Shift 2 is 5 PM to 1 AM
-            self.shift3Time += work_time[5] # shift 3 is 1 AM to 9 AM
-        
-            # handling time worked per EST weeks (Mon -> Sun)
-            work_time = np.zeros(nWeeks)
-            for j, (lb, ub) in enumerate(zip(weekBoundaries[:-1],
-                                             weekBoundaries[1:])):
-                t = min(int(self.logouts[i].strftime('%s')),ub) - max(int(self.logins[i].strftime('%s')),lb)
-                work_time[j] = max(0,t)
-
-            self.hoursPerWeek += work_time
-        self.hoursPerWeek /= 3600
-        
-        # loop over all incidents
-        self.incidentsPerWeek = np.zeros(nWeeks)
-        for i in range(len(self.incidents)):
-            # get epoch time of the incident report
-            reportTime = self.incidents[i][1].timestamp()
-            # loop over weeks to get incidents per week values
-            for j, (lb, ub) in enumerate(zip(weekBoundaries[:-1],
-                                             weekBoundaries[1:])):
-                # check if the reportTime is between the bounds
-                if reportTime >= lb and reportTime < ub:
-                    self.incidentsPerWeek[j] += 1
-
-            # handling incidents started per EST shift times
-            start_of_day = datetime.combine(self.incidents[i][1].date(),
-                                            datetime.min.time()) 
-            work_time = [0] * nShifts
-            for j, (lb, ub) in enumerate(zip(boundaries[:-1],boundaries[1:])):
-                shift_st = (start_of_day + lb).timestamp()
-                shift_et = (start_of_day + ub).timestamp()
-                if reportTime >= shift_st and reportTime < shift_et:
-                    work_time[j] += 1
-
-            # add this incident to shift counters
-            self.shift1Incidents += work_time[0] # Shift 1 is 9 AM to 5 PM
-            self.shift2Incidents += work_time[1] # shift 2 is 5 AM to 1 AM
-            self.shift3Incidents += work_time[2] # shift 3 is 1 AM to 9 AM
-            self.shift1Incidents += work_time[3] # Shift 1 is 9 AM to 5 PM
-            self.shift2Incidents += work_time[4] # Shift 2 is 5 PM to 1 AM
-            self.shift3Incidents += work_time[5] # shift 3 is 1 AM to 9 AM
-       
+        if calendar is not None:
+            # department imports nothing from here, but keep it lazy anyway
+            from department import analyze_department
+            analyze_department({self.name: self}, update_characters=True,
+                               verbose=False, calendar=calendar,
+                               calendar_weeks=True)
+            return
+
+        # the array engine does the binning in weeks and shifts
+        events = TimeEvents(self.logins.epochs, self.logouts.epochs,
+                            self.incidents.times.epochs, self.sessionTotals,
+                            tz)
+
+        # handling time worked per EST shift times
+        (self.shift1Time,
+         self.shift2Time,
+         self.shift3Time) = events.hoursPerShift().tolist()
+        # handling time worked per EST weeks (Mon -> Sun)
+        self.hoursPerWeek = events.hoursPerWeek()
 
+        # handling incidents per EST weeks and incidents started per EST shift
+        self.incidentsPerWeek = events.incidentsPerWeek()
+        (self.shift1Incidents,
+         self.shift2Incidents,
+         self.shift3Incidents) = events.incidentsPerShift().tolist()
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from department import analyze_department
+from duty import DutyIndex
+from names import NameResolver, normalize_name
+from pipeline import ingest
+
+# queries whose answers only depend on the snapshot, so they can be cached
+# until the next reload; on_duty only for times that don't depend on when
+# they are asked (see cacheable_request())
+CACHED_QUERIES = ('overview', 'character', 'on_duty')
+# times pd.Timestamp reads relative to the clock
+RELATIVE_TIMES = ('now', 'today')
+
+class Snapshot():
+    """ Parsed exports the daemon answers queries from. Built from scratch on
+    every reload and swapped in as a whole, so a query never sees half of a
+    reload. (An incremental.Checkpoint isn't used for reloads: it keeps only
+    the totals of the earlier sessions, which the duty index and the
+    session lists need in full, and the changed timesheet has to be decoded
+    whole anyway, which is most of a reload.)
+        characters: the character dict
+        timesheet: the parsed Timesheet
+        overview: the overview table (see department.analyze_department)
+        index: duty.DutyIndex of the sessions
+        generation: number of the reload that built the snapshot
+        loaded: time.time() the snapshot was built at
+    """
+    def __init__(self, characters: dict, timesheet, overview: pd.DataFrame,
+                 generation: int = 0):
+        self.characters: dict = characters
+        self.timesheet = timesheet
+        self.overview: pd.DataFrame = overview
+        self.index: DutyIndex = DutyIndex.fromTimesheet(timesheet)
+        self.generation: int = generation
+        self.loaded: float = time.time()
+        # overview rows by name, as dicts of plain python values (NaN ->
+        # None); floats keep their full precision, like every other answer
+        rows = overview.astype(object).where(overview.notna(), None) \
+                       .to_dict(orient='records')
+        self._rows: dict = {row['Name']: row for row in rows}
+        # case insensitive lookup of names typed by hand, with a read only
+        # resolver (no alias table) over the lower case names for
+        # misspellings
+        self._lower: dict = {name.lower(): name for name in characters}
+        self._resolver = NameResolver(self._lower, verbose=False)
+
+    def __str__(self):
+        """
+        """
+        return (f'Snapshot {self.generation} of {len(self.characters)} '
+                f'characters and {len(self.index)} sessions')
+
+    def find(self, name: str):
+        """ Character dict name of a name as typed, None if there is no such
+        character
+        """
+        if name in self.characters:
+            return name
+        return self._lower.get(
+            self._resolver.resolve(normalize_name(name).lower()))
+
+    def status(self) -> dict:
+        """ What the snapshot holds
+        """
+        return {'generation': self.generation,
+                'loaded': pd.Timestamp(self.loaded, unit='s').isoformat(),
+                'characters': len(self.characters),
+                'sessions': len(self.index),
+                'firsttime': str(self.timesheet.firsttime),
+                'lasttime': str(self.timesheet.lasttime)}
+
+    def overviewRows(self, limit: int = None) -> dict:
+        """ The overview table (sorted by time worked) and the overview
+        string of Timesheet.getCharacterData('Overview')
+        """
+        rows = list(self._rows.values())
+        if limit is not None:
+            rows = rows[:limit]
+        return {'rows': rows,
+                'text': self.timesheet.getCharacterData('Overview')}
+
+    def character(self, name: str, sessions: bool = False) -> dict:
+        """ Overview row, state and counts of the character named (about)
+        name; with sessions, also the list of [login, logout] times
+        """
+        found = self.find(name)
+        if found is None:
+            raise LookupError(f'No character named {name}')
+        char = self.characters[found]
+        nSessions = min(len(char.logins), len(char.logouts))
+        answer = {'name': found, 'stateID': int(char.stateID),
+                  'rank': char.rank, 'department': char.department,
+                  'hours': float(char.loggedTime),
+                  'loggedIn': bool(char.loggedIn),
+                  'sessions': nSessions, 'incidents': len(char.incidents),
+                  'overview': self._rows.get(found),
+                  'text': char.sessionText()}
+        if sessions:
+            answer['times'] = [
+                [str(login), str(logout)] for login, logout in
+                zip(char.logins[:nSessions], char.logouts[:nSessions])]
+        return answer
+
+    def onDuty(self, time) -> dict:
+        """ Characters on duty at time
+        """
+        names = self.index.onDutyAt(time)
+        return {'time': str(pd.Timestamp(time)), 'headcount': len(names),
+                'names': names}
+
+
+class AnalysisDaemon():
+    """ Long running service holding the parsed exports in memory and
+    answering queries from it over a local socket, so a bot doesn't have to
+    reparse the workbooks for every question:
+        timesheetPath, rosterPath, incidentPath: the exports; roster and
+            incidents are optional
+        cache: cache.WorkbookCache; on a reload only the exports that changed
+            are decoded again
+        aliases: names.AliasTable the names are resolved with; what it
+            learns carries over to the next reload, like it does between
+            runs of parsePDCSVs.py overview --aliases, and is saved after
+            every reload and on shutdown
+        poll: seconds between checks of the exports for changes
+        cacheSize: number of answers kept; the answers are dropped on reload.
+            Status answers are never kept, their counters change with
+            every request, nor are on_duty answers for 'now' or 'today'.
+
+    The exports are watched by their size and mtime. A change is only picked
+    up once it has been stable for a poll, so a half written export isn't
+    loaded; if parsing fails anyway, the old snapshot stays in use. Parsing
+    runs in a thread, so queries are answered while reloading.
+
+    The protocol is one JSON object per line each way. Requests have a
+    'query' of:
+        status: generation, load time, number of characters and sessions
+        overview: the overview rows (optionally the first 'limit') and text
+        character: the character 'name' (misspellings are matched); with
+            'sessions': true also their login/logout times
+        on_duty: who was on duty at 'time' and how many
+    Answers have an 'error' instead if the query couldn't be answered.
+    """
+    def __init__(self, timesheetPath, rosterPath=None, incidentPath=None,
+                 cache=None, aliases=None, poll: float = 5.0,
+                 cacheSize: int = 4096):
+        self.paths: list = [None if path is None else str(path) for path in
+                            (timesheetPath, rosterPath, incidentPath)]
+        self.cache = cache
+        self.aliases = aliases
+        self.poll: float = poll
+        self.cacheSize: int = cacheSize
+        self.snapshot: Snapshot = None
+        self.requests: int = 0
+        # request line -> encoded answer line, least recently used first
+        self._answers = OrderedDict()
+        # size and mtime of the exports of the current snapshot, and of a
+        # change waiting to settle
+        self._signature = None
+        self._pending = None
+        self._reloading = asyncio.Lock()
+
+    def __str__(self):
+        """
+        """
+        return f'Analysis daemon of {self.paths[0]}'
+
+    def signature(self) -> tuple:
+        """ (size, mtime) of every export, None for missing ones
+        """
+        signature = []
+        for path in self.paths:
+            try:
+                stat = os.stat(path) if path is not None else None
+            except OSError:
+                stat = None
+            signature.append(None if stat is None
+                             else (stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
+    def build(self) -> Snapshot:
+        """ Parse and analyze the exports into a new Snapshot
+        """
+        characters = {}
+        resolver = NameResolver(characters, verbose=False,
+                                aliases=self.aliases)
+        # decoded in this process; forking a pool from a threaded server
+        # isn't safe
+        timesheets, _, _ = ingest(characters, [self.paths[0]], self.paths[1],
+                                  self.paths[2], resolver, self.cache,
+                                  workers=1)
+        overview = analyze_department(characters, update_characters=True,
+                                      verbose=False)
+        generation = 0 if self.snapshot is None \
+                     else self.snapshot.generation + 1
+        return Snapshot(characters, timesheets[0], overview, generation)
+
+    async def reload(self) -> bool:
+        """ Rebuild the snapshot in a thread and swap it in. Returns whether
+        it worked; on failure the old snapshot stays.
+        """
+        async with self._reloading:
+            signature = self.signature()
+            loop = asyncio.get_running_loop()
+            try:
+                snapshot = await loop.run_in_executor(None, self.build)
+            except Exception as error:
+                print(f'Reload failed, keeping generation '
+                      f'{getattr(self.snapshot, "generation", None)}: '
+                      f'{error!r}', flush=True)
+                # retry once the exports change again
+                self._signature = signature
+                return False
+            self.snapshot = snapshot
+            self._signature = signature
+            self._answers.clear()
+            self.saveAliases()
+            print(f'Loaded {snapshot}', flush=True)
+            return True
+
+    def saveAliases(self):
+        """ Save the names the alias table learned, if it has a file
+        """
+        if self.aliases is not None and self.aliases.path:
+            self.aliases.save()
+
+    async def watch(self):
+        """ Reload whenever the exports changed and then stayed the same for
+        a poll
+        """
+        while True:
+            await asyncio.sleep(self.poll)
+            signature = self.signature()
+            if signature == self._signature:
+                self._pending = None
+            elif signature == self._pending:
+                self._pending = None
+                await self.reload()
+            else:
+                self._pending = signature
+
+    def answer(self, line: bytes) -> bytes:
+        """ Encoded answer line to a request line, from the cache if the same
+        request was answered since the last reload
+        """
+        self.requests += 1
+        key = line.strip()
+        answer = self._answers.get(key)
+        if answer is not None:
+            self._answers.move_to_end(key)
+            return answer
+        try:
+            request = json.loads(key)
+            result = self.handle(request)
+            cacheable = cacheable_request(request)
+        except Exception as error:
+            result, cacheable = {'error': str(error)}, False
+        answer = (json.dumps(result) + '\n').encode()
+        if cacheable:
+            self._answers[key] = answer
+            if len(self._answers) > self.cacheSize:
+                self._answers.popitem(last=False)
+        return answer
+
+    def handle(self, request: dict) -> dict:
+        """ Answer a decoded request from the current snapshot
+        """
+        snapshot = self.snapshot
+        if snapshot is None:
+            raise RuntimeError('Still loading')
+        query = request.get('query')
+        if query == 'status':
+            return {**snapshot.status(), 'requests': self.requests,
+                    'cached': len(self._answers)}
+        if query == 'overview':
+            return snapshot.overviewRows(request.get('limit'))
+        if query == 'character':
+            return snapshot.character(_field(request, 'name'),
+                                      bool(request.get('sessions')))
+        if query == 'on_duty':
+            return snapshot.onDuty(_field(request, 'time'))
+        raise ValueError(f'Unknown query {query}')
+
+    async def serveClient(self, reader, writer):
+        """ Answer the requests of a connection, one per line, until the
+        client hangs up
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(self.answer(line))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, socketPath=None, host: str = '127.0.0.1',
+                    port: int = None):
+        """ Load the exports, then serve queries on the unix socket at
+        socketPath, or on host:port, until cancelled
+        """
+        await self.reload()
+        if self.snapshot is None:
+            raise RuntimeError('Could not load the exports')
+        self._pending = None
+        if socketPath is not None:
+            # a socket left behind by an earlier run
+            if os.path.exists(socketPath):
+                os.remove(socketPath)
+            server = await asyncio.start_unix_server(self.serveClient,
+                                                     socketPath)
+            print(f'Serving on {socketPath}', flush=True)
+        else:
+            server = await asyncio.start_server(self.serveClient, host, port)
+            print(f'Serving on {host}:{port}', flush=True)
+        watcher = asyncio.ensure_future(self.watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+            self.saveAliases()
+            if socketPath is not None and os.path.exists(socketPath):
+                os.remove(socketPath)
+
+
+def cacheable_request(request: dict) -> bool:
+    """ Whether the answer to a request can be kept until the next reload
+    """
+    query = request.get('query')
+    if query == 'on_duty' and request.get('time') in RELATIVE_TIMES:
+        return False
+    return query in CACHED_QUERIES
+
+def _field(request: dict, field: str):
+    """ A field the query needs
+    """
+    if field not in request:
+        raise ValueError(f'{request.get("query")} queries need a {field}')
+    return request[field]
+
+def request(query: dict, socketPath=None, host: str = '127.0.0.1',
+            port: int = None, timeout: float = 10.) -> dict:
+    """ Send a single query to a running AnalysisDaemon and return its
+    answer, e.g. request({'query': 'character', 'name': 'Xena Duke'},
+    'pd.sock')
+    """
+    if socketPath is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        address = socketPath
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        address = (host, port)
+    with sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        sock.sendall((json.dumps(query) + '\n').encode())
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
@@ -0,0 +1,430 @@
+import numpy as np
+import pandas as pd
+
+from analysis import (SECOND, HOUR, WEEK, SHIFT_EDGES, SHIFT_OF_WINDOW,
+                      N_SHIFTS, floor_day, local_epoch, week_range,
+                      week_zone)
+import profiling
+
+# columns of the overview table, in the order they are written out
+OVERVIEW_COLUMNS = ['Name', 'CID', 'Department', 'Rank',
+                    'Time Worked (hrs)',
+                    'Shift 1 (hrs)', 'Shift 2 (hrs)', 'Shift 3 (hrs)',
+                    'Worked per Week (hrs)', 'Stdev (hrs)',
+                    'Total Incidents',
+                    'Shift 1 Inc', 'Shift 2 Inc', 'Shift 3 Inc',
+                    'Average per Week (Inc)', 'Stdev (Inc)']
+# the shifts of the overview columns
+SHIFT_NAMES = ['Shift 1', 'Shift 2', 'Shift 3']
+# stacked onto per character arrays so there is always one to concatenate
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+def session_table(characters: dict) -> pd.DataFrame:
+    """ Stack the paired login/logout events of every character into a single
+    table with columns:
+        char: index of the character in the characters dict
+        start: login epoch time (ns)
+        end: logout epoch time (ns)
+    """
+    chars = list(characters.values())
+    nPairs = np.array([min(len(char.logins), len(char.logouts))
+                       for char in chars], dtype=np.int64)
+    logins = [char.logins.epochs[:n] for char, n in zip(chars, nPairs)]
+    logouts = [char.logouts.epochs[:n] for char, n in zip(chars, nPairs)]
+    return pd.DataFrame({'char': np.repeat(np.arange(len(chars)), nPairs),
+                         'start': np.concatenate(logins + [_EMPTY]),
+                         'end': np.concatenate(logouts + [_EMPTY])})
+
+def incident_table(characters: dict) -> pd.DataFrame:
+    """ Stack the incidents of every character into a single table with
+    columns:
+        char: index of the character in the characters dict
+        incident: incident number
+        time: epoch time (ns) the incident was started
+    """
+    chars = list(characters.values())
+    nIncidents = np.array([len(char.incidents) for char in chars],
+                          dtype=np.int64)
+    numbers = [char.incidents.numbers.values for char in chars]
+    times = [char.incidents.times.epochs for char in chars]
+    return pd.DataFrame({'char': np.repeat(np.arange(len(chars)), nIncidents),
+                         'incident': np.concatenate(numbers + [_EMPTY]),
+                         'time': np.concatenate(times + [_EMPTY])})
+
+def overview_columns(shifts: list = SHIFT_NAMES,
+                     calendar_shifts: list = None) -> list:
+    """ Columns of the overview table for the given shift names;
+    OVERVIEW_COLUMNS for the default shifts. With calendar_shifts, the
+    columns of a shift calendar reported next to them (see
+    calendar_columns()) are added at the end.
+    """
+    columns = (OVERVIEW_COLUMNS[:5] + [f'{shift} (hrs)' for shift in shifts]
+               + OVERVIEW_COLUMNS[8:11] + [f'{shift} Inc' for shift in shifts]
+               + OVERVIEW_COLUMNS[14:])
+    if calendar_shifts is not None:
+        columns += (['Calendar Worked (hrs)']
+                    + [f'{shift} (cal hrs)' for shift in calendar_shifts]
+                    + ['Calendar per Week (hrs)', 'Calendar Stdev (hrs)']
+                    + [f'{shift} (cal Inc)' for shift in calendar_shifts])
+    return columns
+
+@profiling.staged()
+def analyze_department(characters: dict,
+                       update_characters: bool = False,
+                       verbose: bool = True,
+                       calendar=None,
+                       calendar_weeks: bool = False,
+                       tz='local') -> pd.DataFrame:
+    """ Compute the overview table of every character in one pass over the
+    stacked session and incident tables rather than one analyzeTimeEvents()
+    call per character. Gives the same numbers as Character.analyzeTimeEvents.
+
+    With a shiftcalendar.ShiftCalendar, time and incidents are also binned
+    in the shifts and weeks of the calendar and reported in the calendar
+    columns of calendar_columns(), next to the EST figures. With
+    calendar_weeks set, the calendar figures replace the EST ones instead:
+    the weeks of a character then run from the week of their first login
+    through the week of their last logout, and in a DST timezone the time
+    worked is the real time elapsed, so it still is the sum of the shifts.
+
+    The EST weeks are binned in timezone tz, the process' timezone by
+    default like the first versions of the analysis did (see
+    analysis.week_zone()); None bins the wall clock times as they are.
+
+    Returns a DataFrame with overview_columns(), sorted by time worked. If
+    update_characters is set, the per character results (shift times, hours
+    and incidents per week, ...) are also stored on the Character objects.
+    """
+    chars = list(characters.values())
+    nChars = len(chars)
+    if calendar is None or not calendar_weeks:
+        worked = time_worked(characters, tz)
+        hoursPerWeek = worked['weekSeconds'] / 3600
+        hours = np.array([char.loggedTime for char in chars], dtype=float)
+        shifts = SHIFT_NAMES
+        binned = None
+    else:
+        worked = calendar_worked(characters, calendar)
+        hoursPerWeek = worked['hoursPerWeek']
+        hours = worked['hours']
+        shifts = calendar.shifts
+        binned = calendar
+    analyzed, nWeeks = worked['analyzed'], worked['nWeeks']
+    shiftHours = worked['shiftHours']
+    if verbose:
+        for i in np.flatnonzero(~analyzed):
+            print(f'No timesheet data has been collected for {chars[i].name}.')
+
+    # incidents per week and incidents started per shift
+    incidents = incident_table(characters)
+    totalIncidents = np.bincount(incidents['char'].to_numpy(),
+                                 minlength=nChars)
+    incidentsPerWeek, shiftIncidents = _count_incidents(
+        incidents, worked, hoursPerWeek.shape[1], len(shifts), binned,
+        worked.get('tz'))
+
+    # weekly mean/stdev leave out the first and last (partial) week
+    hoursMean, hoursStd = _inner_week_stats(hoursPerWeek, nWeeks)
+    incMean, incStd = _inner_week_stats(incidentsPerWeek, nWeeks)
+
+    # the calendar figures go next to the EST ones unless they replace them
+    extra, calendarShifts = {}, None
+    if calendar is not None and not calendar_weeks:
+        extra = calendar_columns(characters, calendar, incidents)
+        calendarShifts = calendar.shifts
+
+    overview = pd.DataFrame({
+        'Name': [char.name for char in chars],
+        'CID': [char.stateID for char in chars],
+        'Department': [char.department for char in chars],
+        'Rank': [char.rank for char in chars],
+        'Time Worked (hrs)': hours,
+        **{f'{name} (hrs)': shiftHours[:, j]
+           for j, name in enumerate(shifts)},
+        'Worked per Week (hrs)': hoursMean,
+        'Stdev (hrs)': hoursStd,
+        'Total Incidents': totalIncidents,
+        **{f'{name} Inc': shiftIncidents[:, j]
+           for j, name in enumerate(shifts)},
+        'Average per Week (Inc)': incMean,
+        'Stdev (Inc)': incStd,
+        **extra,
+    }, columns=overview_columns(shifts, calendarShifts))
+
+    if update_characters:
+        for i in np.flatnonzero(analyzed):
+            char = chars[i]
+            # the Character objects keep (up to) three shifts
+            (char.shift1Time,
+             char.shift2Time,
+             char.shift3Time) = (shiftHours[i].tolist() + [0, 0, 0])[:3]
+            (char.shift1Incidents,
+             char.shift2Incidents,
+             char.shift3Incidents) = (shiftIncidents[i].tolist()
+                                      + [0, 0, 0])[:3]
+            char.hoursPerWeek = hoursPerWeek[i, :nWeeks[i]]
+            char.incidentsPerWeek = incidentsPerWeek[i, :nWeeks[i]]
+
+    # sort the characters by max time
+    return overview.sort_values('Time Worked (hrs)', ascending=False,
+                                kind='stable', ignore_index=True)
+
+def calendar_columns(characters: dict, calendar,
+                     incidents: pd.DataFrame = None) -> dict:
+    """ Overview columns of the time and incidents of every character binned
+    in a shiftcalendar.ShiftCalendar, to report next to the EST figures:
+        Calendar Worked (hrs): real time elapsed, the sum of the shifts
+        <shift> (cal hrs): hours worked per calendar shift
+        Calendar per Week (hrs), Calendar Stdev (hrs): weekly mean/stdev
+            over the calendar weeks
+        <shift> (cal Inc): incidents started per calendar shift
+    incidents: incident_table() of the characters, if already stacked
+    """
+    if incidents is None:
+        incidents = incident_table(characters)
+    worked = calendar_worked(characters, calendar)
+    hoursPerWeek = worked['hoursPerWeek']
+    _, shiftIncidents = _count_incidents(incidents, worked,
+                                         hoursPerWeek.shape[1],
+                                         len(calendar.shifts), calendar)
+    hoursMean, hoursStd = _inner_week_stats(hoursPerWeek, worked['nWeeks'])
+    return {'Calendar Worked (hrs)': worked['hours'],
+            **{f'{name} (cal hrs)': worked['shiftHours'][:, j]
+               for j, name in enumerate(calendar.shifts)},
+            'Calendar per Week (hrs)': hoursMean,
+            'Calendar Stdev (hrs)': hoursStd,
+            **{f'{name} (cal Inc)': shiftIncidents[:, j]
+               for j, name in enumerate(calendar.shifts)}}
+
+def time_worked(characters: dict, tz='local') -> dict:
+    """ Time worked by every character, from the stacked session table plus
+    any SessionTotals carried over from earlier runs, with the weeks binned
+    in timezone tz (see analysis.week_zone()). Returns a dict of arrays
+    indexed like the characters dict, and the timezone:
+        analyzed: whether the character has timesheet data
+        firstMonday: epoch (ns) of the Monday the week bins start at, read
+            in tz
+        nWeeks: number of week bins used for the overview
+        nWeeksWorked: number of week bins up to the last week worked in,
+            which can be one more than nWeeks
+        shiftHours: hours worked in shift 1, 2 and 3; shape (nChars, 3)
+        weekSeconds: seconds worked per week bin; shape (nChars, maxWeeks)
+        tz: the timezone of the week bins, or None
+    """
+    tz = week_zone(tz)
+    chars = list(characters.values())
+    nChars = len(chars)
+    sessions = session_table(characters)
+    totals = [char.sessionTotals for char in chars]
+    hasTotals = np.array([t is not None for t in totals], dtype=bool)
+
+    # characters without timesheet data don't get analyzed
+    nLogins = np.array([len(char.logins) for char in chars], dtype=np.int64)
+    nLogouts = np.array([len(char.logouts) for char in chars], dtype=np.int64)
+    analyzed = (nLogins > 0) | hasTotals
+
+    # week bins per character start at the Monday before their first login
+    # and end after their last logout
+    firsttimes = np.zeros(nChars, dtype=np.int64)
+    lasttimes = np.zeros(nChars, dtype=np.int64)
+    hasFirst = nLogins > 0
+    firsttimes[hasFirst] = [chars[i].logins.epochs[0]
+                            for i in np.flatnonzero(hasFirst)]
+    hasLast = nLogouts > 0
+    lasttimes[hasLast] = [chars[i].logouts.epochs[-1]
+                          for i in np.flatnonzero(hasLast)]
+    for i in np.flatnonzero(hasTotals):
+        firsttimes[i] = totals[i].firstLogin
+        if not hasLast[i]:
+            lasttimes[i] = totals[i].lastLogout
+    hasWeeks = (hasFirst & hasLast) | hasTotals
+    firstMonday, nWeeks = week_range(firsttimes, lasttimes, tz)
+    nWeeks[~hasWeeks] = 0
+
+    # time worked per EST shift: clip every session against the shift
+    # windows around its login day, then sum per character and shift
+    charIdx = sessions['char'].to_numpy()
+    start = sessions['start'].to_numpy()
+    end = sessions['end'].to_numpy()
+    start_of_day = floor_day(start)[:, None]
+    window_hours = np.maximum(
+        np.minimum(end[:, None], start_of_day + SHIFT_EDGES[None, 1:])
+        - np.maximum(start[:, None], start_of_day + SHIFT_EDGES[None, :-1]),
+        0) / HOUR
+    shiftHours = np.zeros((nChars, N_SHIFTS))
+    for i in np.flatnonzero(hasTotals):
+        shiftHours[i] = totals[i].shiftHours
+    for shift in range(N_SHIFTS):
+        # np.add.at adds in array order, i.e. session by session per
+        # character, on top of the carried over totals
+        windows = window_hours[:, SHIFT_OF_WINDOW == shift]
+        column = shiftHours[:, shift].copy()
+        np.add.at(column, np.repeat(charIdx, windows.shape[1]),
+                  windows.ravel())
+        shiftHours[:, shift] = column
+
+    # the weeks are binned on the time line of tz, the shifts above on the
+    # wall clock
+    if tz is not None:
+        start = local_epoch(start, tz)
+        end = local_epoch(end, tz)
+
+    # the overview week bins can end before the week of the last logout;
+    # keep the time worked in that week as well so the bins can be carried
+    # over to a later (incremental) run without losing it
+    nWeeksWorked = nWeeks.copy()
+    worked = hasWeeks[charIdx] & (end >= start)
+    np.maximum.at(nWeeksWorked, charIdx[worked],
+                  (end[worked] - firstMonday[charIdx[worked]]) // WEEK + 1)
+    for i in np.flatnonzero(hasTotals):
+        nWeeksWorked[i] = max(nWeeksWorked[i], len(totals[i].weekSeconds))
+    maxWeeks = max(int(nWeeksWorked.max(initial=0)), 1)
+
+    # time worked per EST week (Mon -> Sun): split sessions at the week
+    # boundaries of their character, in whole seconds
+    weekSeconds = _week_seconds(charIdx, start // SECOND, end // SECOND,
+                                firstMonday // SECOND, nWeeksWorked, maxWeeks)
+    for i in np.flatnonzero(hasTotals):
+        nOld = len(totals[i].weekSeconds)
+        weekSeconds[i, :nOld] += totals[i].weekSeconds
+
+    return {'analyzed': analyzed, 'firstMonday': firstMonday,
+            'nWeeks': nWeeks, 'nWeeksWorked': nWeeksWorked,
+            'shiftHours': shiftHours, 'weekSeconds': weekSeconds, 'tz': tz}
+
+def calendar_worked(characters: dict, calendar) -> dict:
+    """ Time worked by every character, binned in the shifts and weeks of a
+    shiftcalendar.ShiftCalendar. Returns a dict of arrays indexed like the
+    characters dict:
+        analyzed: whether the character has timesheet data
+        firstWeek: calendar week of the first login
+        hours: hours logged, with the sessions counted at their real length
+            on the calendar's time line (they differ from the wall clock
+            length across a DST change), so they are the sum of the shifts
+        nWeeks: number of weeks from the first login through the last logout
+        shiftHours: hours worked per shift of the calendar
+        hoursPerWeek: hours worked per week, starting from firstWeek; shape
+            (nChars, maxWeeks)
+    """
+    chars = list(characters.values())
+    nChars = len(chars)
+    if any(char.sessionTotals is not None for char in chars):
+        raise ValueError('Sessions carried over from an incremental run '
+                         'can\'t be binned in a shift calendar')
+    sessions = session_table(characters)
+    charIdx = sessions['char'].to_numpy()
+    start = calendar.toEpoch(sessions['start'].to_numpy())
+    end = calendar.toEpoch(sessions['end'].to_numpy())
+
+    # characters without timesheet data don't get analyzed
+    nLogins = np.array([len(char.logins) for char in chars], dtype=np.int64)
+    nLogouts = np.array([len(char.logouts) for char in chars], dtype=np.int64)
+    analyzed = nLogins > 0
+    hasWeeks = (nLogins > 0) & (nLogouts > 0)
+    firstWeek = np.zeros(nChars, dtype=np.int64)
+    lastWeek = np.zeros(nChars, dtype=np.int64)
+    firstWeek[analyzed] = calendar.weekOf(calendar.toEpoch(
+        [chars[i].logins.epochs[0] for i in np.flatnonzero(analyzed)]))
+    lastWeek[hasWeeks] = calendar.weekOf(calendar.toEpoch(
+        [chars[i].logouts.epochs[-1] for i in np.flatnonzero(hasWeeks)]))
+    nWeeks = np.where(hasWeeks, np.maximum(lastWeek - firstWeek + 1, 0), 0)
+
+    shiftHours = calendar.shiftHours(start, end, charIdx, nChars)
+    # shift the calendar weeks of every character to start at their first
+    # week
+    weekHours = calendar.weekHours(start, end, charIdx, nChars)
+    maxWeeks = max(int(nWeeks.max(initial=0)), 1)
+    weeks = firstWeek[:, None] + np.arange(maxWeeks)[None, :]
+    valid = ((np.arange(maxWeeks)[None, :] < nWeeks[:, None])
+             & (weeks < weekHours.shape[1]))
+    hoursPerWeek = np.zeros((nChars, maxWeeks))
+    rows = np.broadcast_to(np.arange(nChars)[:, None], weeks.shape)
+    hoursPerWeek[valid] = weekHours[rows[valid], weeks[valid]]
+
+    # the hours logged while parsing, corrected by what a DST change adds
+    # to or takes from the sessions
+    naive = np.maximum(sessions['end'].to_numpy()
+                       - sessions['start'].to_numpy(), 0)
+    correction = np.bincount(charIdx, weights=np.maximum(end - start, 0)
+                             - naive, minlength=nChars) / HOUR
+    hours = np.array([char.loggedTime for char in chars],
+                     dtype=float) + correction
+
+    return {'analyzed': analyzed, 'firstWeek': firstWeek, 'nWeeks': nWeeks,
+            'hours': hours, 'shiftHours': shiftHours,
+            'hoursPerWeek': hoursPerWeek}
+
+def _count_incidents(incidents: pd.DataFrame, worked: dict, maxWeeks: int,
+                     nShifts: int, calendar=None, tz=None):
+    """ Incidents per week, shape (nChars, maxWeeks), and incidents started
+    per shift, shape (nChars, nShifts), of the incident_table() incidents;
+    in the EST weeks and shift windows of time_worked(), with the weeks in
+    its timezone tz, or with a calendar in its weeks and shifts (worked from
+    calendar_worked())
+    """
+    nChars = len(worked['analyzed'])
+    analyzed, nWeeks = worked['analyzed'], worked['nWeeks']
+    incChar = incidents['char'].to_numpy()
+    incTime = incidents['time'].to_numpy()
+    if calendar is None:
+        # EST weeks and shift windows
+        weekTime = incTime if tz is None else local_epoch(incTime, tz)
+        week = (weekTime - worked['firstMonday'][incChar]) // WEEK
+        window = np.searchsorted(SHIFT_EDGES, incTime - floor_day(incTime),
+                                 side='right') - 1
+        shift = SHIFT_OF_WINDOW[np.clip(window, 0, len(SHIFT_OF_WINDOW) - 1)]
+        counted = (analyzed[incChar] & (window >= 0)
+                   & (window < len(SHIFT_OF_WINDOW)))
+    else:
+        incTime = calendar.toEpoch(incTime)
+        week = calendar.weekOf(incTime) - worked['firstWeek'][incChar]
+        shift = calendar.shiftOf(incTime)
+        counted = analyzed[incChar] & (shift >= 0)
+    inWeek = (week >= 0) & (week < nWeeks[incChar])
+    incidentsPerWeek = np.bincount(
+        incChar[inWeek] * maxWeeks + week[inWeek],
+        minlength=nChars * maxWeeks).reshape(nChars, maxWeeks).astype(float)
+    shiftIncidents = np.bincount(incChar[counted] * nShifts + shift[counted],
+                                 minlength=nChars * nShifts
+                                 ).reshape(nChars, nShifts)
+    return incidentsPerWeek, shiftIncidents
+
+def _week_seconds(charIdx, start, end, firstMonday, nWeeks, maxWeeks):
+    """ Seconds worked per character and week, shape (nChars, maxWeeks).
+    Sessions spanning several weeks are split at the week boundaries.
+    """
+    nChars = len(nWeeks)
+    week = WEEK // SECOND
+    # sessions ending before they start never contribute any time
+    keep = end >= start
+    charIdx, start, end = charIdx[keep], start[keep], end[keep]
+    origin = firstMonday[charIdx]
+    firstWeek = (start - origin) // week
+    lastWeek = (end - origin) // week
+    # one piece per (session, week) the session overlaps
+    nPieces = lastWeek - firstWeek + 1
+    piece = np.repeat(np.arange(len(start)), nPieces)
+    pieceWeek = (firstWeek[piece] + np.arange(len(piece))
+                 - np.repeat(np.cumsum(nPieces) - nPieces, nPieces))
+    weekStart = origin[piece] + pieceWeek * week
+    seconds = (np.minimum(end[piece], weekStart + week)
+               - np.maximum(start[piece], weekStart))
+    inRange = (pieceWeek >= 0) & (pieceWeek < nWeeks[charIdx[piece]])
+    return np.bincount(charIdx[piece][inRange] * maxWeeks + pieceWeek[inRange],
+                       weights=seconds[inRange],
+                       minlength=nChars * maxWeeks).reshape(nChars, maxWeeks)
+
+def _inner_week_stats(perWeek: np.ndarray, nWeeks: np.ndarray):
+    """ Mean and standard deviation of each row of perWeek over its weeks
+    [1:nWeeks-1]. Rows with the same number of weeks are stacked and reduced
+    together so the results are identical to np.mean/np.std of each row.
+    """
+    mean = np.full(len(nWeeks), np.nan)
+    std = np.full(len(nWeeks), np.nan)
+    nInner = np.maximum(nWeeks - 2, 0)
+    for n in np.unique(nInner[nInner > 0]):
+        rows = np.flatnonzero(nInner == n)
+        inner = perWeek[rows, 1:n+1]
+        mean[rows] = np.mean(inner, axis=1)
+        std[rows] = np.std(inner, axis=1)
+    return mean, std
@@ -0,0 +1,217 @@
+import numpy as np
+import pandas as pd
+
+from analysis import HOUR, to_epoch
+from department import session_table
+
+class DutyIndex():
+    """ Index of the sessions (login -> logout) of all characters for
+    point-in-time and range queries: who was on duty at a time, who was on
+    duty during a time range, how many were on duty over time and who was on
+    duty when incidents happened.
+        names: character names; sessions refer to them by position
+        char, start, end: the sessions, as character position and epoch (ns)
+            times, sorted by start
+
+    Sessions are split into classes of similar duration (powers of 2), each
+    sorted by start time. A session of a class can only overlap a time range
+    if it starts less than the longest session of its class before the
+    range, so a query is a binary search per class plus the sessions found.
+    Headcounts only need the sorted start and end times of all sessions.
+    Sessions are half open: on duty from the login up to the logout.
+    """
+    def __init__(self, characters: dict, openEnd=None):
+        """ characters: the character dict
+        openEnd: time the sessions still open at the end of the timesheet
+            (logged in without a logout) are taken to end; they are left out
+            if not given
+        """
+        sessions = session_table(characters)
+        char = sessions['char'].to_numpy()
+        start = sessions['start'].to_numpy()
+        end = sessions['end'].to_numpy()
+        if openEnd is not None:
+            openEnd = int(to_epoch([pd.Timestamp(openEnd)])[0])
+            chars = list(characters.values())
+            open_ = [i for i, c in enumerate(chars)
+                     if c.loggedIn and len(c.logins) > len(c.logouts)]
+            char = np.concatenate([char, np.array(open_, dtype=np.int64)])
+            start = np.concatenate([start, np.array(
+                [chars[i].logins.epochs[-1] for i in open_], dtype=np.int64)])
+            end = np.concatenate([end, np.full(len(open_), openEnd)])
+        self._index(list(characters), char, start, end)
+
+    def _index(self, names: list, char, start, end):
+        """ Build the index of the sessions (char, start, end) of the
+        characters names
+        """
+        self.names: list = names
+        self._nameArray = np.array(self.names, dtype=object)
+        # sessions ending before they start are never on duty
+        keep = end > start
+        order = np.argsort(start[keep], kind='stable')
+        self.char: np.ndarray = char[keep][order]
+        self.start: np.ndarray = start[keep][order]
+        self.end: np.ndarray = end[keep][order]
+        self._sortedEnds = np.sort(self.end)
+
+        # duration classes; each keeps the positions of its sessions (sorted
+        # by start) and its longest duration
+        duration = self.end - self.start
+        durationClass = np.floor(np.log2(np.maximum(duration, 1))).astype(int)
+        self._classes = []
+        for c in np.unique(durationClass):
+            sessions = np.flatnonzero(durationClass == c)
+            self._classes.append((sessions, self.start[sessions],
+                                  int(duration[sessions].max())))
+
+    @classmethod
+    def fromTimesheet(cls, timesheet):
+        """ Index of the sessions of a parsed Timesheet; sessions still open
+        at the end of the timesheet end at its last time
+        """
+        return cls(timesheet.characters, timesheet.lasttime)
+
+    @classmethod
+    def fromResults(cls, store):
+        """ Index of the sessions of a results.ResultsStore, without
+        rebuilding its characters; sessions still open at the end of the
+        timesheet end at its last time
+        """
+        sessions = store.table('sessions')
+        start = to_epoch(sessions['start'].to_numpy())
+        end = sessions['end']
+        lasttime = store.meta.get('lasttime')
+        if lasttime is not None:
+            end = end.fillna(pd.Timestamp(lasttime))
+        # sessions without an end are left out otherwise
+        keep = end.notna().to_numpy()
+        index = cls.__new__(cls)
+        index._index(store.names(), sessions['char'].to_numpy()[keep],
+                     start[keep], to_epoch(end[keep].to_numpy()))
+        return index
+
+    def __len__(self):
+        return len(self.start)
+
+    def __str__(self):
+        """
+        """
+        return f'Duty index of {len(self)} sessions of {len(self.names)} characters'
+
+    def overlaps(self, lo, hi):
+        """ All (query, session) pairs of the sessions overlapping the time
+        ranges [lo[q], hi[q]), given as epoch (ns) arrays. Returns the query
+        and session positions, sorted by query then session start.
+        """
+        lo = np.asarray(lo, dtype=np.int64)
+        hi = np.asarray(hi, dtype=np.int64)
+        queries, found = [], []
+        for sessions, starts, longest in self._classes:
+            # candidates start before hi and less than longest before lo
+            first = np.searchsorted(starts, lo - longest, side='right')
+            last = np.searchsorted(starts, hi, side='left')
+            n = np.maximum(last - first, 0)
+            query = np.repeat(np.arange(len(lo)), n)
+            pos = (np.repeat(first - np.cumsum(n) + n, n)
+                   + np.arange(n.sum()))
+            candidates = sessions[pos]
+            hit = self.end[candidates] > lo[query]
+            queries.append(query[hit])
+            found.append(candidates[hit])
+        query = np.concatenate(queries + [np.zeros(0, dtype=np.int64)])
+        session = np.concatenate(found + [np.zeros(0, dtype=np.int64)])
+        order = np.lexsort((session, query))
+        return query[order], session[order]
+
+    def onDutyAt(self, time) -> list:
+        """ Names of the characters on duty at time
+        """
+        t = _epochs(time)
+        query, session = self.overlaps(t, t + 1)
+        return self._nameArray[self.char[session]].tolist()
+
+    def onDuty(self, times) -> pd.DataFrame:
+        """ Characters on duty at each of times, as a long table with
+        columns:
+            query: position of the time in times
+            time: the time
+            name: name of a character on duty at that time
+        """
+        t = _epochs(times)
+        query, session = self.overlaps(t, t + 1)
+        return pd.DataFrame({'query': query,
+                             'time': t[query].view('datetime64[ns]'),
+                             'name': self._nameArray[self.char[session]]})
+
+    def sessionsBetween(self, start, end) -> pd.DataFrame:
+        """ Sessions overlapping the time range [start, end), with columns
+        name, start and end
+        """
+        query, session = self.overlaps(_epochs(start), _epochs(end))
+        return pd.DataFrame({
+            'name': self._nameArray[self.char[session]],
+            'start': self.start[session].view('datetime64[ns]'),
+            'end': self.end[session].view('datetime64[ns]')})
+
+    def coverage(self, start, end) -> pd.Series:
+        """ Hours on duty per character within the time range [start, end),
+        most hours first; .sum() gives the total coverage
+        """
+        lo, hi = _epochs(start), _epochs(end)
+        query, session = self.overlaps(lo, hi)
+        covered = (np.minimum(self.end[session], hi[0])
+                   - np.maximum(self.start[session], lo[0])) / HOUR
+        hours = np.bincount(self.char[session], weights=covered,
+                            minlength=len(self.names))
+        onDuty = np.flatnonzero(np.bincount(self.char[session],
+                                            minlength=len(self.names)))
+        hours = pd.Series(hours[onDuty], index=[self.names[i] for i in onDuty],
+                          name='hours')
+        return hours.sort_values(ascending=False, kind='stable')
+
+    def headcount(self, times) -> np.ndarray:
+        """ Number of sessions on duty at each of times
+        """
+        t = _epochs(times)
+        return (np.searchsorted(self.start, t, side='right')
+                - np.searchsorted(self._sortedEnds, t, side='right'))
+
+    def headcountChanges(self) -> pd.DataFrame:
+        """ Concurrent headcount over time as a step function: the headcount
+        from each time on, for every time it changes
+        """
+        times = np.concatenate([self.start, self.end])
+        steps = np.concatenate([np.ones(len(self.start), dtype=np.int64),
+                                -np.ones(len(self.end), dtype=np.int64)])
+        order = np.argsort(times, kind='stable')
+        times, count = times[order], np.cumsum(steps[order])
+        # keep the count after the last change at each time
+        last = np.ones(len(times), dtype=bool)
+        last[:-1] = times[1:] != times[:-1]
+        return pd.DataFrame({'time': times[last].view('datetime64[ns]'),
+                             'headcount': count[last]})
+
+    def incidentsOnDuty(self, incidents) -> pd.DataFrame:
+        """ Cross-reference the incidents of an IncidentReport (or a
+        DataFrame with IncidentNr and Date columns) with the characters on
+        duty when they started. Returns a long table with columns
+        IncidentNr, time and name; group by IncidentNr for units per
+        incident.
+        """
+        df = getattr(incidents, 'incidents', incidents)
+        times = pd.to_datetime(df['Date'], format='%Y-%m-%d %H:%M:%S')
+        onDuty = self.onDuty(times)
+        return pd.DataFrame({
+            'IncidentNr': df['IncidentNr'].to_numpy()[onDuty['query']],
+            'time': onDuty['time'],
+            'name': onDuty['name']})
+
+
+def _epochs(times) -> np.ndarray:
+    """ int64 epoch (ns) array of a time or sequence of times
+    """
+    # a single time skips to_datetime's format guessing
+    if np.ndim(times) == 0:
+        return np.array([pd.Timestamp(times).value], dtype=np.int64)
+    return to_epoch(np.atleast_1d(pd.to_datetime(times)))
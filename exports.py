@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import profiling
+
+# pyarrow is optional; it is only needed for the parquet export
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+EXPORT_FORMATS = ('csv', 'parquet', 'xlsx')
+# rows of an excel sheet, header included; longer tables go on more sheets
+XLSX_MAX_ROWS = 2**20
+# number of characters allowed in an excel sheet name
+XLSX_MAX_NAME = 31
+# rows turned into python values at a time when writing a sheet
+XLSX_CHUNK_ROWS = 10000
+
+def named_tables(tables: dict, names) -> dict:
+    """ The tables with the name of the character inserted next to every char
+    column (a position in names), so the files can be read on their own
+    """
+    names = np.asarray(names, dtype=object)
+    named = {}
+    for table, df in tables.items():
+        if 'char' in df.columns:
+            df = df.copy(deep=False)
+            df.insert(df.columns.get_loc('char') + 1, 'name',
+                      names[df['char'].to_numpy()])
+        named[table] = df
+    return named
+
+def store_tables(store, tables: list = None) -> dict:
+    """ The tables (all by default) of a results.ResultsStore, named like
+    named_tables does
+    """
+    return named_tables({table: store.table(table)
+                         for table in tables or store.tables},
+                        store.column('characters', 'name'))
+
+@profiling.staged()
+def export_tables(tables: dict, path, fmt: str = 'csv') -> list:
+    """ Write the tables (name -> DataFrame, e.g. of results.result_tables
+    after named_tables) in a format of EXPORT_FORMATS:
+        csv: one <table>.csv per table in the directory path
+        parquet: one <table>.parquet per table in the directory path; needs
+            pyarrow
+        xlsx: a sheet per table in the workbook path (.xlsx added if
+            missing)
+    Returns the paths of the written files.
+    """
+    if fmt == 'csv':
+        return write_csv(tables, path)
+    if fmt == 'parquet':
+        return write_parquet(tables, path)
+    if fmt == 'xlsx':
+        if not str(path).endswith('.xlsx'):
+            path = f'{path}.xlsx'
+        return write_xlsx(tables, path)
+    raise ValueError(f'Unknown export format {fmt}; use one of '
+                     f'{", ".join(EXPORT_FORMATS)}')
+
+def write_csv(tables: dict, directory) -> list:
+    """ One CSV file per table; fields with commas or quotes are quoted
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for table, df in tables.items():
+        path = os.path.join(directory, f'{table}.csv')
+        df.to_csv(path, index=False, na_rep='nan')
+        profiling.count('rows exported', len(df))
+        paths.append(path)
+    return paths
+
+def write_parquet(tables: dict, directory) -> list:
+    """ One parquet file per table, with the column types kept
+    """
+    if pyarrow is None:
+        raise ImportError('The parquet export needs pyarrow')
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for table, df in tables.items():
+        path = os.path.join(directory, f'{table}.parquet')
+        _uniform(df).to_parquet(path, index=False)
+        profiling.count('rows exported', len(df))
+        paths.append(path)
+    return paths
+
+def write_xlsx(tables: dict, path) -> list:
+    """ A workbook with a sheet per table, written row by row in openpyxl's
+    write-only mode so a large table never sits in memory as cells. A table
+    longer than an excel sheet continues on sheets '<table> 2', ...
+    """
+    from openpyxl import Workbook
+
+    book = Workbook(write_only=True)
+    for table, df in tables.items():
+        header = [str(col) for col in df.columns]
+        perSheet = XLSX_MAX_ROWS - 1
+        for part in range(max(-(-len(df) // perSheet), 1)):
+            name = table if part == 0 else f'{table} {part + 1}'
+            sheet = book.create_sheet(name[:XLSX_MAX_NAME])
+            sheet.append(header)
+            for row in _rows(df.iloc[part * perSheet:(part + 1) * perSheet]):
+                sheet.append(row)
+        profiling.count('rows exported', len(df))
+    book.save(path)
+    return [path]
+
+def _rows(df: pd.DataFrame, chunksize: int = XLSX_CHUNK_ROWS):
+    """ The rows of df as tuples of plain python values, missing ones as None
+    (empty cells); converted chunksize rows at a time, so only a chunk of
+    the table is ever held as python objects
+    """
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        yield from chunk.astype(object).where(chunk.notna(), None) \
+                        .itertuples(index=False, name=None)
+
+def _uniform(df: pd.DataFrame) -> pd.DataFrame:
+    """ df with its mixed type object columns (e.g. callsigns read as numbers
+    and as text) turned into strings, since parquet columns have one type
+    """
+    mixed = [col for col in df.columns if df[col].dtype == object
+             and df[col].dropna().map(type).nunique() > 1]
+    if not mixed:
+        return df
+    df = df.copy(deep=False)
+    for col in mixed:
+        df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
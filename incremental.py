@@ -0,0 +1,159 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+from analysis import SessionTotals, to_epoch, week_zone
+from character import Character
+from department import time_worked
+
+class Checkpoint():
+    """ State of a timesheet ingestion saved after a run, so the next run on a
+    cumulative export of the same timesheet only has to process the rows that
+    were added since:
+        watermark: epoch (ns) of the last processed timesheet row
+        nAtWatermark: number of rows processed at exactly the watermark time
+        characters: list of per character state; name, stateID, loggedIn,
+            openLogin (epoch ns of the open session, if logged in),
+            loggedTime and the SessionTotals of all analyzed sessions
+        tz: name of the timezone the weeks of the SessionTotals are binned
+            in, or None for the wall clock times; later runs have to bin
+            their weeks in it too
+    """
+    version: int = 1
+
+    def __init__(self, watermark=None, nAtWatermark: int = 0,
+                 characters: list = None, tz: str = None):
+        self.watermark = watermark
+        self.nAtWatermark: int = nAtWatermark
+        self.characters: list = characters or []
+        self.tz: str = tz
+
+    def __str__(self):
+        """
+        """
+        return (f'Checkpoint of {len(self.characters)} characters at '
+                f'{pd.Timestamp(self.watermark) if self.watermark else None}')
+
+    @classmethod
+    def fromTimesheet(cls, timesheet, tz='local'):
+        """ Build the checkpoint after timesheet has been parsed, with the
+        weeks binned in timezone tz (see analysis.week_zone()). Characters
+        without timesheet rows (e.g. roster or incident only) are left out.
+        """
+        characters = timesheet.characters
+        worked = time_worked(characters, tz)
+        zone = None if worked['tz'] is None else str(worked['tz'])
+        states = []
+        for i, char in enumerate(characters.values()):
+            # characters with only anomalous rows are kept too, their rows
+            # stay in the results store
+            anomalous = any(char.strangeness.count(kind)
+                            for kind in char.strangeness)
+            if not (worked['analyzed'][i] or char.loggedIn or anomalous):
+                continue
+            state = {'name': char.name,
+                     'stateID': int(char.stateID),
+                     'loggedIn': bool(char.loggedIn),
+                     'openLogin': None,
+                     'loggedTime': float(char.loggedTime),
+                     'totals': None}
+            if char.loggedIn:
+                state['openLogin'] = int(char.logins.epochs[-1])
+            # totals exist once a session has been closed
+            if len(char.logouts) > 0 or char.sessionTotals is not None:
+                nWeeks = worked['nWeeksWorked'][i]
+                if char.sessionTotals is not None:
+                    firstLogin = char.sessionTotals.firstLogin
+                else:
+                    firstLogin = int(char.logins.epochs[0])
+                if len(char.logouts) > 0:
+                    lastLogout = int(char.logouts.epochs[-1])
+                else:
+                    lastLogout = char.sessionTotals.lastLogout
+                state['totals'] = {
+                    'firstLogin': firstLogin,
+                    'lastLogout': lastLogout,
+                    'shiftHours': worked['shiftHours'][i].tolist(),
+                    'weekSeconds':
+                        worked['weekSeconds'][i, :nWeeks].astype(int).tolist()}
+            states.append(state)
+
+        if timesheet.lasttime is None or pd.isna(timesheet.lasttime):
+            return cls(None, 0, states, zone)
+        return cls(int(to_epoch([timesheet.lasttime])[0]),
+                   timesheet.nAtLasttime, states, zone)
+
+    @classmethod
+    def load(cls, path):
+        """ Read a checkpoint saved with save()
+        """
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('version') != cls.version:
+            raise ValueError(f'Unsupported checkpoint version in {path}')
+        # checkpoints without a timezone were binned on the wall clock
+        return cls(data['watermark'], data['nAtWatermark'],
+                   data['characters'], data.get('tz'))
+
+    def save(self, path):
+        """ Write the checkpoint as json
+        """
+        tmp = str(path) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.version,
+                       'watermark': self.watermark,
+                       'nAtWatermark': self.nAtWatermark,
+                       'characters': self.characters,
+                       'tz': self.tz}, f)
+        os.replace(tmp, path)
+
+    def checkZone(self, tz='local'):
+        """ Raise a ValueError unless the weeks of the checkpoint are binned
+        in timezone tz (see analysis.week_zone())
+        """
+        tz = week_zone(tz)
+        zone = None if tz is None else str(tz)
+        if zone != self.tz:
+            raise ValueError(f'The checkpoint has its weeks binned in '
+                             f'{self.tz or "wall clock time"}, not in '
+                             f'{zone or "wall clock time"}')
+
+    def restore(self, characters: dict):
+        """ Put the saved character state into the character dict, creating
+        Character objects where needed
+        """
+        for state in self.characters:
+            char = characters.get(state['name'])
+            if char is None:
+                char = Character(state['name'], state['stateID'])
+                characters[state['name']] = char
+            char.loggedIn = state['loggedIn']
+            char.loggedTime = state['loggedTime']
+            # an open session gets closed by the first check out of the next
+            # run
+            if state['openLogin'] is not None:
+                char.logins.append(state['openLogin'])
+            if state['totals'] is not None:
+                char.sessionTotals = SessionTotals(**state['totals'])
+
+    def newRows(self, df: pd.DataFrame, nSeen: int = 0) -> pd.DataFrame:
+        """ Rows of the timesheet df that were not processed yet: rows after
+        the watermark, plus rows at the watermark beyond the nAtWatermark
+        already processed (in sheet order). When df is a chunk of the sheet,
+        nSeen is the number of rows at the watermark in the chunks before it.
+        """
+        if self.watermark is None:
+            return df
+        times = to_epoch(df['Time'].to_numpy())
+        new = times > self.watermark
+        atWatermark = np.flatnonzero(times == self.watermark)
+        new[atWatermark[max(self.nAtWatermark - nSeen, 0):]] = True
+        return df[new]
+
+    def countAtWatermark(self, df: pd.DataFrame) -> int:
+        """ Number of rows of df at exactly the watermark
+        """
+        if self.watermark is None:
+            return 0
+        return int((to_epoch(df['Time'].to_numpy()) == self.watermark).sum())
@@ -0,0 +1,273 @@
+import difflib
+import functools
+import itertools
+import json
+import os
+import re
+from collections import defaultdict
+
+import profiling
+
+@functools.lru_cache(maxsize=2**16)
+def normalize_name(raw: str) -> str:
+    """ Strip the non-alphanumeric characters the parsers used might not
+    catch from a name in a sheet, e.g. 'Daniel O'Shea' -> 'Daniel O Shea'.
+    Memoized, since the same names show up on row after row.
+    """
+    return ' '.join(re.findall(r'(\w+)', raw))
+
+
+class AliasTable():
+    """ Persistent map of (normalized) sheet names to the character name they
+    resolve to, so later runs don't have to redo the fuzzy matching:
+        learned: name -> character name, as decided by a NameResolver
+        pinned: name -> character name, confirmed by hand; always used, e.g.
+            for the 'Does this look right?' and 'Not mapping' cases
+        blocked: name -> set of character names it must never be mapped to,
+            e.g. for a wrong 'Does this look right?' mapping
+
+    Names are looked up after normalize_name(), so all raw strings that
+    normalize to the same name share an alias. Saved as JSON.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.learned: dict = {}
+        self.pinned: dict = {}
+        self.blocked = defaultdict(set)
+
+    def __str__(self):
+        """
+        """
+        return (f'Alias table of {len(self.learned)} learned, '
+                f'{len(self.pinned)} pinned and {len(self.blocked)} blocked '
+                f'names')
+
+    def __len__(self):
+        return len(self.learned.keys() | self.pinned.keys())
+
+    @classmethod
+    def load(cls, path):
+        """ Alias table saved at path; an empty one if there is no file yet,
+        which is saved to path by save()
+        """
+        table = cls(path)
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            table.learned = state['learned']
+            table.pinned = state['pinned']
+            for name, targets in state['blocked'].items():
+                table.blocked[name] = set(targets)
+        return table
+
+    def save(self, path=None):
+        """ Save the table as JSON to path, by default where it was loaded
+        from
+        """
+        path = path or self.path
+        state = {'version': 1, 'pinned': self.pinned, 'learned': self.learned,
+                 'blocked': {name: sorted(targets)
+                             for name, targets in self.blocked.items()}}
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def get(self, name: str):
+        """ Character name an (already normalized) name resolves to, None if
+        it isn't known
+        """
+        alias = self.pinned.get(name, self.learned.get(name))
+        # an alias of a pinned name follows the pin
+        seen = {name}
+        while alias in self.pinned and alias not in seen:
+            seen.add(alias)
+            alias = self.pinned[alias]
+        return alias
+
+    def learn(self, name: str, charName: str):
+        """ Remember the character name a name was resolved to
+        """
+        if charName not in self.blocked.get(name, ()):
+            self.learned[name] = charName
+
+    def pin(self, name: str, charName: str):
+        """ Always resolve name (a sheet name, normalized here) to charName
+        """
+        name, charName = normalize_name(name), normalize_name(charName)
+        self.pinned[name] = charName
+        self.blocked.get(name, set()).discard(charName)
+
+    def block(self, name: str, charName: str):
+        """ Never resolve name (a sheet name, normalized here) to charName,
+        forgetting any alias of name to it
+        """
+        name, charName = normalize_name(name), normalize_name(charName)
+        self.blocked[name].add(charName)
+        for aliases in (self.learned, self.pinned):
+            if aliases.get(name) == charName:
+                del aliases[name]
+
+    def isBlocked(self, name: str, charName: str) -> bool:
+        """ Whether name may not be resolved to charName
+        """
+        return charName in self.blocked.get(name, ())
+
+
+class NameResolver():
+    """ Fuzzy name lookup against the keys of a character dict. Gives the same
+    answers as parsers.check_names (map when the difflib ratio is > 0.9, warn
+    when it is > 0.75, first match in dict order wins) but only runs difflib
+    against a handful of candidates per lookup:
+        bigram index: names sharing too few character bigrams with the
+            looked up name can not reach a ratio of 0.75 and are never
+            compared
+        length/quick_ratio prefilters: cheap upper bounds on the ratio are
+            checked before the full SequenceMatcher.ratio()
+        memo: past decisions are remembered; a name that did not map is only
+            checked against characters added to the dict since
+
+    The resolver follows the character dict it was given, so a single resolver
+    should be shared by the Roster, Timesheet and IncidentReport objects that
+    fill the same dict. Keys are assumed to only ever be added to that dict.
+
+    With an AliasTable, known names are resolved from the table without any
+    matching, names are never mapped to a blocked character name, and every
+    new decision is learned by the table.
+    """
+    def __init__(self, charactersDict: dict, verbose: bool = True,
+                 aliases: AliasTable = None):
+        self.characters: dict = charactersDict
+        self.verbose: bool = verbose
+        self.aliases: AliasTable = aliases
+
+        # indexed character names, in dict insertion order; the position in
+        # this list is the id used throughout the index
+        self._names: list = []
+        # bigram -> list of (id, number of times the bigram shows up in name)
+        self._grams = defaultdict(list)
+        # name length -> list of ids, used for very short names that can match
+        # without sharing any bigram
+        self._lengths = defaultdict(list)
+        # name -> (mapped name or None, number of indexed names checked)
+        self._memo: dict = {}
+
+    def __str__(self):
+        """
+        """
+        return f'NameResolver over {len(self.characters)} characters'
+
+    def resolveRaw(self, raw: str) -> str:
+        """ resolve() a name as it is written in a sheet
+        """
+        return self.resolve(normalize_name(raw))
+
+    def resolve(self, name: str) -> str:
+        """ Return the character dict key that name should be stored under;
+        name itself if it is already a key or nothing similar enough exists.
+        """
+        if self.aliases is not None:
+            alias = self.aliases.get(name)
+            if alias is not None:
+                profiling.count('names alias')
+                return alias
+            charName = self._resolve(name)
+            self.aliases.learn(name, charName)
+            return charName
+        return self._resolve(name)
+
+    def _resolve(self, name: str) -> str:
+        """ resolve() without the alias table
+        """
+        # no need to do any checks if dict is empty or name is present
+        if name in self.characters:
+            profiling.count('names exact')
+            return name
+        if len(self.characters) == 0:
+            profiling.count('names new')
+            return name
+
+        self._sync()
+        mapped, checked = self._memo.get(name, (None, 0))
+        # mapped names are final since new keys are only appended to the dict
+        # and the first match in dict order wins
+        if mapped is None and checked < len(self._names):
+            mapped = self._search(name, checked)
+            self._memo[name] = (mapped, len(self._names))
+
+        if mapped is None:
+            # a new character, unless the caller throws the name away
+            profiling.count('names new')
+            return name
+        profiling.count('names fuzzy')
+        return mapped
+
+    def _sync(self):
+        """ Index any keys added to the character dict since the last lookup
+        """
+        nIndexed = len(self._names)
+        if nIndexed == len(self.characters):
+            return
+        for char_name in itertools.islice(self.characters, nIndexed, None):
+            self._add(char_name)
+
+    def _add(self, char_name: str):
+        """ Add a single name to the bigram and length indices
+        """
+        idx = len(self._names)
+        self._names.append(char_name)
+        for gram, count in _bigrams(char_name).items():
+            self._grams[gram].append((idx, count))
+        self._lengths[len(char_name)].append(idx)
+
+    def _search(self, name: str, start: int = 0):
+        """ Compare name against indexed names with id >= start. Returns the
+        first name (in dict order) with a ratio > 0.9, None otherwise.
+        """
+        la = len(name)
+        # count shared bigrams (multiset intersection) per candidate
+        shared = defaultdict(int)
+        for gram, count in _bigrams(name).items():
+            for idx, char_count in self._grams.get(gram, ()):
+                if idx >= start:
+                    shared[idx] += min(count, char_count)
+        # a ratio of 2M/T > 0.75 (M matched characters, T total length) needs
+        # M > 0.375*T; matched characters come in runs separated by at most
+        # T - 2M gaps, so at least 3M - T - 1 > 0.125*T - 1 bigrams are shared
+        candidates = [idx for idx, s in shared.items()
+                      if s > 0.125*(la + len(self._names[idx])) - 1]
+        # names with 0.125*T - 1 < 0 can match without sharing a bigram
+        for lb in range(1, 8 - la):
+            candidates.extend(idx for idx in self._lengths.get(lb, ())
+                              if idx >= start and idx not in shared)
+
+        blocked = () if self.aliases is None else \
+                  self.aliases.blocked.get(name, ())
+        for idx in sorted(candidates):
+            char_name = self._names[idx]
+            # ratio can be no larger than 2*min(la,lb)/(la+lb)
+            lb = len(char_name)
+            if 2*min(la, lb) <= 0.75*(la + lb) or char_name in blocked:
+                continue
+            matcher = difflib.SequenceMatcher(None, name, char_name)
+            if matcher.quick_ratio() <= 0.75:
+                continue
+            ratio = matcher.ratio()
+            if ratio > 0.9:
+                if self.verbose:
+                    print(f'Mapped to {name} -> {char_name}. Does this look right?')
+                return char_name
+            elif ratio > 0.75:
+                if self.verbose:
+                    print(f'Not mapping {name} -> {char_name}. Maybe I should be though?')
+
+        return None
+
+
+def _bigrams(name: str) -> dict:
+    """ Count the character bigrams of a name
+    """
+    counts = defaultdict(int)
+    for i in range(len(name) - 1):
+        counts[name[i:i+2]] += 1
+    return counts
@@ -1,44 +1,491 @@
-
+import argparse
+import os
 import sys
-import numpy as np
-import pickle
-import parsers, character
 
-# MAIN
-if __name__ == '__main__':
-    timesheet_file = sys.argv[1]
-    roster_file = sys.argv[2]
-    incidents_file = sys.argv[3]
-    
-    timesheet = parsers.Timesheet({}, 'PD_Data/PDHoursMar1Apr20.xlsx')
-    timesheet.parseTimesheet()
-
-    characters = timesheet.characters
-
-    roster = parsers.Roster(characters, 'PD_Data/PDRoster.xlsx')
-    roster.parseRoster()
-
-    incidents = parsers.IncidentReport(characters, 'PD_Data/Incidents.xlsx')
-    incidents.parseIncidents()
-
-    with open(timesheet_file.split('.')[0] + '_overview.csv','w') as outcsv:
-        outcsv.write('Name,CID,Department,Rank,Time Worked (hrs),Shift 1 (hrs),Shift 2 (hrs),Shift 3 (hrs),Worked per Week (hrs),Stdev (hrs),Total Incidents,Shift 1 Inc,Shift 2 Inc,Shift 3 Inc,Average per Week (Inc),Stdev (Inc)\n')
-        
-        # sort the characters by max time
-        charList = [[characters[char].name,characters[char].loggedTime] for char in characters.keys()]
-        charList.sort(key = lambda x: x[1], reverse=True)
-        for (name,loggedtime) in charList:
-            char = characters[name]
-            char.analyzeTimeEvents()
-            outcsv.write(f"{char.name},{char.stateID},{char.department},{char.rank},{char.loggedTime},{char.shift1Time},{char.shift2Time},{char.shift3Time},{np.mean(char.hoursPerWeek[1:-1])},{np.std(char.hoursPerWeek[1:-1])},{len(char.incidents)},{char.shift1Incidents},{char.shift2Incidents},{char.shift3Incidents},{np.mean(char.incidentsPerWeek[1:-1])},{np.std(char.incidentsPerWeek[1:-1])}\n")
-    
-    #timesheet.createGanttChart(fig_name = timesheet_file.split('.')[0] 
-    #                                            + '_ganttchart.png',
-    #                           ylim = (-0.1,50.1)) 
-#   #                            ylim = (-0.1, len(timesheet.characters)+0.1))
-
-
-    with open(timesheet_file.split('.')[0] + '_analysis_results.pkl','wb') as outpkl:
-        pickle.dump([timesheet,roster,incidents,characters], outpkl)
+# the commands import what they need when they run, so starting up (e.g.
+# for a quick query) doesn't pay for pandas' excel engines or matplotlib
+COMMANDS = ('overview', 'gantt', 'query', 'export', 'serve')
+# formats of the export command (see exports.EXPORT_FORMATS)
+EXPORT_FORMATS = ('csv', 'parquet', 'xlsx')
+
+def output_stem(timesheet_file: str) -> str:
+    """ Path the output files of a timesheet are named after, i.e. the
+    timesheet path without its extension
+    """
+    return os.path.splitext(timesheet_file)[0]
+
+def overview(args):
+    """ Parse the exports and write the overview table and results store
+    (or, with --period, the period-over-period table)
+    """
+    from cache import WorkbookCache
+    from department import analyze_department
+    from incremental import Checkpoint
+    from names import AliasTable, NameResolver
+    from pipeline import ingest, ingest_periods
+    import profiling
+    from results import (ResultsStore, merge_results, result_tables,
+                         save_results)
+
+    timesheet_file = args.timesheet_file
+    roster_file = args.roster_file
+    incidents_file = args.incidents_file
+    stem = output_stem(timesheet_file)
+    # the EST weeks are binned in the local timezone unless told otherwise
+    week_tz = None if args.week_tz.lower() == 'none' else args.week_tz
+
+    # parsed workbooks are cached between runs unless --no-cache is given
+    cache = None if args.no_cache else WorkbookCache()
+
+    # incremental runs continue from the checkpoint of the previous run,
+    # and add to its results store, which has the sessions and anomalies
+    # the checkpoint doesn't keep
+    checkpoint = previous = None
+    checkpoint_file = stem + '_checkpoint.json'
+    results_path = stem + '_analysis_results'
+    if args.incremental and os.path.exists(checkpoint_file):
+        checkpoint = Checkpoint.load(checkpoint_file)
+        try:
+            checkpoint.checkZone(week_tz)
+        except ValueError as e:
+            sys.exit(f'{checkpoint_file}: {e}; run without --incremental or '
+                     f'with the same --week-tz')
+        if not os.path.exists(os.path.join(results_path, 'manifest.json')):
+            sys.exit(f'{checkpoint_file}: the results of the earlier runs '
+                     f'are missing from {results_path}; run without '
+                     f'--incremental')
+        # read into memory, the store gets overwritten
+        previous = ResultsStore(results_path, mmap=False)
+
+    # confirmed and learned name aliases of earlier runs
+    aliases = None
+    if args.aliases is not None or args.pin or args.block:
+        aliases = AliasTable.load(args.aliases or stem + '_aliases.json')
+        for pair in args.pin:
+            aliases.pin(*pair.split('=', 1))
+        for pair in args.block:
+            aliases.block(*pair.split('=', 1))
+
+    # rosters of other departments are merged after the main one, with
+    # their own column names added to the roster schema
+    rosters = roster_file
+    if args.roster:
+        rosters = [roster_file] + [tuple(roster.split(',', 1))
+                                   if ',' in roster else roster
+                                   for roster in args.roster]
+    schema = None
+    if args.roster_columns is not None:
+        from parsers import ROSTER_SCHEMA
+
+        schema = dict(ROSTER_SCHEMA)
+        for column in args.roster_columns.split(','):
+            name, attr = column.split('=')
+            schema[name.strip()] = attr.strip()
+
+    # one character dict and one name resolver shared by all parsers
+    characters = {}
+    resolver = NameResolver(characters, aliases=aliases)
+
+    # batch mode: every period into the one character dict, the roster
+    # parsed once, then a period-over-period table
+    if args.period:
+        from periods import compare_periods
+
+        periods = [(timesheet_file, incidents_file)]
+        for period in args.period:
+            paths = period.split(',')
+            periods.append((paths[0], paths[1] if len(paths) > 1 else None))
+        timesheets, roster, reports = ingest_periods(
+            characters, periods, rosters, resolver, cache, args.jobs,
+            schema)
+        periodTable = compare_periods(characters, timesheets)
+        with profiling.stage('write periods'):
+            periodTable.to_csv(stem + '_periods.csv', index=False,
+                               na_rep='nan')
+    else:
+        # decode the workbooks in parallel, then merge them in order:
+        # timesheet(s) -> roster -> incidents
+        timesheets, roster, incidents = ingest(
+            characters, [timesheet_file] + args.later_timesheet,
+            rosters, incidents_file, resolver, cache, checkpoint,
+            args.jobs, args.chunksize, schema)
+        timesheet = timesheets[-1]
+
+        # a custom shift layout or timezone bins the time in a shift calendar
+        calendar = None
+        if args.tz is not None or args.shifts is not None:
+            from shiftcalendar import ShiftCalendar
+
+            shifts = None
+            if args.shifts is not None:
+                shifts = {name.strip(): float(hour) for name, hour in
+                          (shift.split('=')
+                           for shift in args.shifts.split(','))}
+            calendar = ShiftCalendar.fromTimesheet(timesheet, shifts, args.tz)
+
+        # analyze all characters at once and write the overview table, sorted
+        # by max time
+        overview = analyze_department(characters, update_characters=True,
+                                      calendar=calendar,
+                                      calendar_weeks=args.calendar_weeks,
+                                      tz=week_tz)
+        with profiling.stage('write overview'):
+            overview.to_csv(stem + '_overview.csv', index=False,
+                            na_rep='nan')
+
+        if args.incremental:
+            Checkpoint.fromTimesheet(timesheet, week_tz).save(
+                checkpoint_file)
+
+        # store the results as memory-mappable tables, load them again with
+        # results.ResultsStore
+        tables = result_tables(characters, timesheet, overview)
+        if previous is not None:
+            tables = merge_results(tables, previous)
+        save_results(results_path, characters, timesheet, overview, tables)
+        # and in the formats asked for, with the character names filled in
+        if args.export:
+            from exports import export_tables, named_tables
+
+            tables = named_tables(tables, list(characters))
+            for fmt in args.export:
+                export_tables(tables, stem + '_export', fmt)
+
+    if aliases is not None:
+        aliases.save()
 
+def gantt(args):
+    """ Parse a timesheet and draw its sessions as a gantt chart
+    """
+    from cache import WorkbookCache
+    from parsers import Timesheet
 
+    cache = None if args.no_cache else WorkbookCache()
+    timesheet = Timesheet({}, args.timesheet_file, cache=cache)
+    if args.chunksize:
+        timesheet.streamTimesheet(chunksize=args.chunksize)
+    else:
+        timesheet.parseTimesheet()
+    nRows = args.rows or len(timesheet.characters)
+    window = None
+    if args.start is not None or args.end is not None:
+        window = (args.start or timesheet.firsttime,
+                  args.end or timesheet.lasttime)
+    timesheet.createGanttChart(
+        fig_name=args.out or output_stem(args.timesheet_file)
+                             + '_ganttchart.png',
+        ylim=(-0.1, nRows + 0.1), names=args.names, window=window,
+        merge_gaps=args.merge_gaps, dpi=args.dpi)
+
+def query(args):
+    """ Answer duty and character questions from a results store
+    """
+    import pandas as pd
+    from duty import DutyIndex
+    from results import ResultsStore
+
+    store = ResultsStore(args.results)
+    answers = []
+    if args.character:
+        overview = store.table('characters')
+        for name in args.character:
+            if name not in store.characters:
+                answers.append((f'{name}: no such character', None))
+                continue
+            char = store.characters[name]
+            sessions = pd.DataFrame({'in': list(char.logins)[:len(
+                char.logouts)], 'out': list(char.logouts)})
+            row = overview[overview['name'] == name].iloc[0]
+            answers.append((f'{name}: {row["loggedTime"]:.2f} hours in '
+                            f'{len(sessions)} sessions, '
+                            f'{len(char.incidents)} incidents', sessions))
+
+    # everything else needs the session index
+    if args.on_duty or args.between or args.coverage or args.headcount \
+       or args.incident:
+        index = DutyIndex.fromResults(store)
+        for time in args.on_duty:
+            answers.append((f'On duty at {time}:',
+                            pd.Series(index.onDutyAt(time), name='name')))
+        for start, end in args.between:
+            answers.append((f'Sessions between {start} and {end}:',
+                            index.sessionsBetween(start, end)))
+        for start, end in args.coverage:
+            hours = index.coverage(start, end)
+            # the names are the index, which isn't printed
+            answers.append((f'Hours on duty between {start} and {end} '
+                            f'({hours.sum():.2f} total):',
+                            hours.rename_axis('name')
+                            .reset_index(name='hours')))
+        for time in args.headcount:
+            answers.append((f'Headcount at {time}: '
+                            f'{int(index.headcount(time)[0])}', None))
+        if args.incident:
+            incidents = store.table('incidents')
+            for number in args.incident:
+                times = incidents.loc[incidents['incident'] == number, 'time']
+                if len(times) == 0:
+                    answers.append((f'Incident {number}: not found', None))
+                    continue
+                time = times.iloc[0]
+                answers.append((f'On duty at incident {number} ({time}):',
+                                pd.Series(index.onDutyAt(time),
+                                          name='name')))
+
+    for title, table in answers:
+        print(title)
+        if table is not None:
+            print(table.to_csv(index=False) if args.csv
+                  else table.to_string(index=False))
+            print()
+
+def export(args):
+    """ Write the tables of a results store as CSV, parquet or excel files
+    """
+    from exports import export_tables, store_tables
+    from results import ResultsStore
+
+    store = ResultsStore(args.results)
+    out = args.out or args.results.rstrip('/\\') + '_export'
+    export_tables(store_tables(store, args.tables), out, args.format)
+
+def serve(args):
+    """ Keep the parsed exports in memory and answer queries over a local
+    socket, reloading when the exports change
+    """
+    import asyncio
+    from cache import WorkbookCache
+    from daemon import AnalysisDaemon
+    from names import AliasTable
+
+    cache = None if args.no_cache else WorkbookCache()
+    aliases = None
+    if args.aliases is not None:
+        aliases = AliasTable.load(args.aliases
+                                  or output_stem(args.timesheet_file)
+                                  + '_aliases.json')
+    daemon = AnalysisDaemon(args.timesheet_file, args.roster_file,
+                            args.incidents_file, cache, aliases, args.poll)
+    try:
+        asyncio.run(daemon.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+def build_parser() -> argparse.ArgumentParser:
+    """ The argument parser with a subparser per command
+    """
+    parser = argparse.ArgumentParser(
+        description='Aggregate PD timesheet, roster and incident exports')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # options of every command
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--profile', default=None, metavar='PATH',
+                        help='time the stages of the run, count rows, names '
+                             'and events, and write the trace to PATH (Trace '
+                             'Event JSON, or collapsed stacks for a .folded '
+                             'PATH)')
+    common.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also trace the peak memory of '
+                             'every stage (slows the run down)')
+    # options of the commands reading workbooks
+    workbooks = argparse.ArgumentParser(add_help=False)
+    workbooks.add_argument('--no-cache', action='store_true',
+                           help='always decode the excel workbooks')
+    workbooks.add_argument('--chunksize', type=int, default=None,
+                           help='stream the timesheet(s) this many rows at a '
+                                'time instead of loading them whole')
+
+    sub = commands.add_parser(
+        'overview', parents=[common, workbooks],
+        help='write the overview table and results store (the default)')
+    sub.add_argument('timesheet_file')
+    sub.add_argument('roster_file')
+    sub.add_argument('incidents_file')
+    sub.add_argument('--incremental', action='store_true',
+                     help='only process timesheet rows added since the last '
+                          '--incremental run, adding to its results store')
+    sub.add_argument('--roster', action='append', default=[],
+                     metavar='PATH[,DEPARTMENT]',
+                     help='roster of another department (e.g. EMS or DOJ), '
+                          'merged after roster_file; DEPARTMENT is filled in '
+                          'for rows without one. Can be given more than '
+                          'once')
+    sub.add_argument('--roster-columns', default=None,
+                     metavar='COLUMN=ATTRIBUTE,...',
+                     help='roster columns to read besides the PD roster '
+                          'ones, e.g. "Full Name=name,Grade=rank,'
+                          'Division=department"; attributes are name, '
+                          'stateID, rank, position, callsign, department '
+                          'and shift')
+    sub.add_argument('--later-timesheet', action='append', default=[],
+                     metavar='PATH',
+                     help='timesheet export of a later period; can be given '
+                          'more than once, in chronological order')
+    sub.add_argument('--jobs', type=int, default=None,
+                     help='number of processes decoding the workbooks '
+                          '(default: number of CPUs)')
+    sub.add_argument('--tz', default=None,
+                     help='timezone of the sheet times, e.g. '
+                          'America/New_York; shifts and weeks then follow DST '
+                          'changes')
+    sub.add_argument('--week-tz', default='local', metavar='TZ',
+                     help='timezone the EST weeks are binned in, e.g. '
+                          'America/New_York, or "none" to bin the sheet '
+                          'times as they are (default: the local timezone)')
+    sub.add_argument('--shifts', default=None, metavar='NAME=HOUR,...',
+                     help='shift names and start hours, e.g. '
+                          '"Day=7,Night=19" (default: the three EST shifts)')
+    sub.add_argument('--calendar-weeks', action='store_true',
+                     help='with --tz or --shifts, bin the overview\'s shift '
+                          'and week figures in the calendar instead of '
+                          'adding calendar columns next to the EST ones')
+    sub.add_argument('--period', action='append', default=[],
+                     metavar='TIMESHEET[,INCIDENTS]',
+                     help='exports of a later reporting period; the periods '
+                          'are compared in <timesheet>_periods.csv instead of '
+                          'writing the overview. Can be given more than '
+                          'once, in chronological order')
+    sub.add_argument('--aliases', nargs='?', default=None, const='',
+                     metavar='PATH',
+                     help='keep the name resolutions in an alias table '
+                          '(default <timesheet>_aliases.json) that later runs '
+                          'reuse instead of redoing the fuzzy matching')
+    sub.add_argument('--pin', action='append', default=[],
+                     metavar='NAME=CHARACTER',
+                     help='always map the sheet name NAME to CHARACTER; '
+                          'stored in the alias table')
+    sub.add_argument('--block', action='append', default=[],
+                     metavar='NAME=CHARACTER',
+                     help='never map the sheet name NAME to CHARACTER; '
+                          'stored in the alias table')
+    sub.add_argument('--export', action='append', default=[],
+                     choices=EXPORT_FORMATS,
+                     help='also write the overview, character, session, '
+                          'incident, anomaly and week tables as '
+                          '<timesheet>_export in this format; can be given '
+                          'more than once')
+    sub.set_defaults(run=overview)
+
+    sub = commands.add_parser('gantt', parents=[common, workbooks],
+                              help='draw the sessions of a timesheet as a '
+                                   'gantt chart')
+    sub.add_argument('timesheet_file')
+    sub.add_argument('--out', default=None, metavar='PNG',
+                     help='default <timesheet>_ganttchart.png')
+    sub.add_argument('--rows', type=int, default=None,
+                     help='number of characters shown (default: all)')
+    sub.add_argument('--names', nargs='+', default=None,
+                     help='only draw these characters')
+    sub.add_argument('--start', default=None, help='start of the time window')
+    sub.add_argument('--end', default=None, help='end of the time window')
+    sub.add_argument('--merge-gaps', action='store_true',
+                     help='merge sessions less than a pixel apart')
+    sub.add_argument('--dpi', type=int, default=300)
+    sub.set_defaults(run=gantt)
+
+    sub = commands.add_parser('query', parents=[common],
+                              help='answer questions from a results store')
+    sub.add_argument('results',
+                     help='<timesheet>_analysis_results directory')
+    sub.add_argument('--character', action='append', default=[],
+                     metavar='NAME', help='sessions and totals of NAME')
+    sub.add_argument('--on-duty', action='append', default=[],
+                     metavar='TIME', help='who was on duty at TIME')
+    sub.add_argument('--between', action='append', default=[], nargs=2,
+                     metavar=('START', 'END'),
+                     help='sessions overlapping START to END')
+    sub.add_argument('--coverage', action='append', default=[], nargs=2,
+                     metavar=('START', 'END'),
+                     help='hours on duty per character from START to END')
+    sub.add_argument('--headcount', action='append', default=[],
+                     metavar='TIME', help='number on duty at TIME')
+    sub.add_argument('--incident', action='append', default=[], type=int,
+                     metavar='NR', help='who was on duty at incident NR')
+    sub.add_argument('--csv', action='store_true',
+                     help='print tables as CSV')
+    sub.set_defaults(run=query)
+
+    sub = commands.add_parser('export', parents=[common],
+                              help='write the tables of a results store as '
+                                   'CSV or Parquet files or an Excel '
+                                   'workbook')
+    sub.add_argument('results',
+                     help='<timesheet>_analysis_results directory')
+    sub.add_argument('--out', default=None, metavar='PATH',
+                     help='default <results>_export (.xlsx)')
+    sub.add_argument('--tables', nargs='+', default=None,
+                     help='tables to export (default: all)')
+    sub.add_argument('--format', default='csv', choices=EXPORT_FORMATS,
+                     help='csv or parquet files in a directory, or a '
+                          'workbook with a sheet per table (default csv)')
+    sub.set_defaults(run=export)
+
+    sub = commands.add_parser('serve', parents=[common],
+                              help='answer queries about the exports over a '
+                                   'local socket, reloading them when they '
+                                   'change')
+    sub.add_argument('timesheet_file')
+    sub.add_argument('--no-cache', action='store_true',
+                     help='decode every export again on each reload')
+    sub.add_argument('roster_file', nargs='?', default=None)
+    sub.add_argument('incidents_file', nargs='?', default=None)
+    where = sub.add_mutually_exclusive_group(required=True)
+    where.add_argument('--socket', default=None, metavar='PATH',
+                       help='unix socket to listen on')
+    where.add_argument('--port', type=int, default=None,
+                       help='localhost port to listen on')
+    sub.add_argument('--host', default='127.0.0.1',
+                     help='address to listen on with --port')
+    sub.add_argument('--poll', type=float, default=5.0,
+                     help='seconds between checks of the exports for '
+                          'changes')
+    sub.add_argument('--aliases', nargs='?', default=None, const='',
+                     metavar='PATH',
+                     help='resolve names with the alias table of overview '
+                          '--aliases (default <timesheet>_aliases.json)')
+    sub.set_defaults(run=serve)
+    return parser
+
+def main(argv: list = None):
+    """ Run the command given on the command line
+    """
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # without a command, the three exports are for an overview
+    if argv and argv[0] not in COMMANDS and not argv[0].startswith('-'):
+        argv.insert(0, 'overview')
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'overview':
+        if args.incremental and args.later_timesheet:
+            parser.error('--incremental takes a single timesheet export')
+        # the shift calendar needs the sessions of the whole export, which
+        # the checkpoint of an incremental run doesn't keep
+        if args.incremental and (args.tz is not None
+                                 or args.shifts is not None):
+            parser.error('--incremental can\'t be combined with --tz or '
+                         '--shifts')
+        if args.calendar_weeks and args.tz is None and args.shifts is None:
+            parser.error('--calendar-weeks needs --tz or --shifts')
+        if args.period and (args.incremental or args.later_timesheet
+                            or args.chunksize):
+            parser.error('--period can\'t be combined with --incremental, '
+                         '--later-timesheet or --chunksize')
+
+    # profiling is off unless asked for
+    if args.profile is None:
+        args.run(args)
+        return
+    import profiling
+    profiler = profiling.enable(memory=args.profile_memory)
+    try:
+        args.run(args)
+    finally:
+        profiling.disable()
+        profiler.save(args.profile)
+        print(profiler.summary())
+
+
+# MAIN
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,13 @@ import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 import difflib
-import re
-
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-from matplotlib.patches import Rectangle
-from matplotlib.collections import PatchCollection
 
+from analysis import SECOND, to_epoch
+from cache import read_workbook
 from character import Character
+from names import NameResolver
+import profiling
+from streaming import iter_sheet
 
 ####
 # Functions
@@ -18,6 +17,9 @@ from character import Character
 
 def check_names(name,characters_dict,verbose=True):
     """do a check for name within the character dict
+
+    NOTE: this compares name against every key in the dict; the parsers use a
+    shared names.NameResolver which gives the same answers using an index.
     """
     # no need to do any checks if dict is empty
     if len(characters_dict.keys()) == 0:
@@ -48,90 +50,250 @@ def check_names(name,characters_dict,verbose=True):
     return name
 
 
+# columns of the PD roster and the Character attributes they fill
+ROSTER_SCHEMA = {'Name': 'name', 'StateID': 'stateID', 'Rank': 'rank',
+                 'Position': 'position', 'Callsign': 'callsign',
+                 'Department': 'department', 'Shift': 'shift'}
+# Character attributes a roster can fill in
+ROSTER_ATTRIBUTES = ['rank', 'position', 'callsign', 'department', 'shift']
+
+# timesheet event classes
+LOGIN, LOGOUT, CRASH, PRE, OTHER, SKIPPED = range(6)
+
+def classify_events(keys, actions, loggedIn):
+    """run the check in/out state machine over all timesheet rows at once
+
+    keys: character index of each row; rows with a negative key are SKIPPED
+    actions: the Action of each row
+    loggedIn: logged in state of each character before the first row
+
+    returns the event class of each row and the logged in state of each
+    character after the last row:
+        LOGIN: check in while logged out
+        LOGOUT: check out while logged in
+        CRASH: check in while already checked in; likely happening when a
+            crash happens
+        PRE: check out while logged out; the player checked in _before_ the
+            time period of the sheet
+        OTHER: any other action
+    """
+    keys = np.asarray(keys)
+    actions = np.asarray(actions, dtype=object)
+    isIn = actions == 'Check In'
+    isOut = actions == 'Check Out'
+
+    events = np.full(len(keys), OTHER, dtype=np.int8)
+    events[keys < 0] = SKIPPED
+
+    # only check in/out rows change the state: a check in always leaves the
+    # character logged in and a check out always leaves them logged out. so
+    # the state before a row is set by the previous check in/out row of that
+    # character (in sheet order), or by the initial state for the first one
+    toggles = np.flatnonzero((keys >= 0) & (isIn | isOut))
+    toggles = toggles[np.argsort(keys[toggles], kind='stable')]
+    toggleKeys = keys[toggles]
+    after = isIn[toggles]
+    first = np.ones(len(toggles), dtype=bool)
+    first[1:] = toggleKeys[1:] != toggleKeys[:-1]
+    before = np.empty(len(toggles), dtype=bool)
+    before[1:] = after[:-1]
+    before[first] = loggedIn[toggleKeys[first]]
+    events[toggles] = np.where(after,
+                               np.where(before, CRASH, LOGIN),
+                               np.where(before, LOGOUT, PRE))
+
+    # state after the last check in/out row of each character
+    loggedIn = np.array(loggedIn, dtype=bool)
+    last = np.ones(len(toggles), dtype=bool)
+    last[:-1] = first[1:]
+    loggedIn[toggleKeys[last]] = after[last]
+    return events, loggedIn
+
+
 ####
 # Classes
 ####
 class Roster():
-    def __init__(self, charactersDict, rosterPath):
+    """ A roster export merged into the character dict:
+        schema: roster column -> Character attribute (name, stateID or one
+            of ROSTER_ATTRIBUTES); rosters of other departments (EMS, DOJ,
+            ...) map their own column names, columns missing from a sheet
+            are skipped
+        department: department of everyone without one in the sheet, e.g.
+            for a roster without a Department column
+    """
+    # arguments the workbook is parsed with
+    sheetKwargs: dict = {}
+
+    def __init__(self, charactersDict, rosterPath, resolver=None, cache=None,
+                 schema: dict = None, department: str = None):
         self.rosterPath: str = str(rosterPath)
         self.characters: dict = charactersDict
+        # fuzzy name matching against the character dict; share one resolver
+        # between parsers filling the same dict
+        self.resolver: NameResolver = resolver or NameResolver(charactersDict)
+        # optional cache.WorkbookCache of parsed sheets
+        self.cache = cache
+        self.schema: dict = dict(ROSTER_SCHEMA if schema is None else schema)
+        self.department: str = department
+        unknown = set(self.schema.values()) - {'name', 'stateID'} \
+                  - set(ROSTER_ATTRIBUTES)
+        if unknown:
+            raise ValueError(f'Unknown roster attributes {sorted(unknown)}')
 
     def __str__(self):
         """
         """
         return f'Roster pulled from {self.rosterPath}'
 
-    def parseRoster(self):
-        # load excel file
-        xls = pd.ExcelFile(self.rosterPath)
-        # then parse it
-        df = xls.parse()
-        # fill in values that are empty
-        df['StateID'] = df['StateID'].fillna(-9999)
-        # loop over entries in df
-        for i in range(len(df.Name)):
-            # there's possible weirdness in the sheet
-            if not df.Name[i] or type(df.Name[i]) != str:
-                continue
-            
-            # grab the essential information
-            name = df.Name[i]
-            stateID = int(df.StateID[i])
-            
-            # remove non-alphanumeric characters that might not be caught by 
-            # the various parsers being used
-            name = ' '.join(re.findall(r'(\w+)',name))
-            name = check_names(name, self.characters)
-            # grab the character's object from the character dict or make a 
-            # new one
-            char = self.characters.get(name,Character(name,stateID))
-
-            # possible information in a roster file
-            # NOTE: currently developed for the PD Roster only
-            if df.Rank[i]:
-                char.rank = df.Rank[i]
-            if df.Position[i]:
-                char.position = df.Position[i]
-            if df.Callsign[i]:
-                char.callsign = df.Callsign[i]
-            if df.Department[i]:
-                char.department = df.Department[i]
-            if df.Shift[i]:
-                char.shift = df.Shift[i]
-            #if df.Status[i]:
-            #    char.status = df.Status[i]
-
-            self.characters[name] = char
+    @profiling.staged('read roster')
+    def readSheet(self) -> pd.DataFrame:
+        # load and parse the excel file (or its cached copy)
+        return read_workbook(self.rosterPath, self.cache, **self.sheetKwargs)
+
+    def records(self, df: pd.DataFrame) -> pd.DataFrame:
+        """ The rows of the roster sheet df with a usable name, as columns
+        name, stateID (-9999 if missing) and ROSTER_ATTRIBUTES, renamed per
+        the schema. Missing values (NaN or blank text) are NaN.
+        """
+        columns = {attr: df[col] for col, attr in self.schema.items()
+                   if col in df.columns}
+        if 'name' not in columns:
+            raise ValueError(f'{self.rosterPath} has none of the name '
+                             f'columns of the roster schema')
+        records = pd.DataFrame(columns)
+        # there's possible weirdness in the sheet
+        usable = records['name'].map(lambda name: type(name) == str
+                                     and name != '')
+        records = records[usable.to_numpy(dtype=bool)]
+
+        stateIDs = records.get('stateID', pd.Series(np.nan, records.index))
+        records['stateID'] = stateIDs.fillna(-9999)
+        for attr in ROSTER_ATTRIBUTES:
+            values = records.get(attr, pd.Series(np.nan, records.index,
+                                                 dtype=object))
+            blank = values.notna() & (values.astype(str).str.strip() == '')
+            records[attr] = values.mask(blank)
+        if self.department is not None:
+            records['department'] = records['department'].fillna(
+                self.department)
+        return records[['name', 'stateID'] + ROSTER_ATTRIBUTES]
+
+    @profiling.staged()
+    def parseRoster(self, df=None):
+        """ Merge the roster into the character dict. df is the already
+        decoded sheet (see pipeline.py); it is read from the workbook if not
+        given.
+        """
+        if df is None:
+            df = self.readSheet()
+        profiling.count('roster rows', len(df))
+        merge_roster(self.characters, self.resolver, self.records(df))
+
+
+@profiling.staged()
+def parse_rosters(rosters: list, frames: list = None):
+    """ Merge several rosters sharing a character dict and resolver (e.g. one
+    per department) in one go. Gives the same result as parsing them one
+    after the other, in order. frames are the already decoded sheets, read
+    from the workbooks if not given.
+    """
+    if frames is None:
+        frames = [roster.readSheet() for roster in rosters]
+    profiling.count('roster rows', sum(len(df) for df in frames))
+    records = pd.concat([roster.records(df)
+                         for roster, df in zip(rosters, frames)],
+                        ignore_index=True)
+    merge_roster(rosters[0].characters, rosters[0].resolver, records)
+
+def merge_roster(characters: dict, resolver, records: pd.DataFrame):
+    """ Merge roster records (see Roster.records) into the character dict.
+    Every distinct sheet name is resolved once, in the order the names show
+    up, and the characters that don't exist yet are created along the way
+    (with the state id of their first row), so a later name can resolve to
+    a character added by an earlier one. Per attribute, the last value
+    given for a character wins; missing values never overwrite anything.
+    """
+    codes, sheetNames = pd.factorize(records['name'].to_numpy(dtype=object))
+    firstRow = np.full(len(sheetNames), len(codes))
+    np.minimum.at(firstRow, codes, np.arange(len(codes)))
+    stateIDs = records['stateID'].to_numpy()
+    resolved = []
+    for sheetName, row in zip(sheetNames, firstRow):
+        # remove non-alphanumeric characters that might not be caught by
+        # the various parsers being used
+        name = resolver.resolveRaw(sheetName)
+        if name not in characters:
+            characters[name] = Character(name, int(stateIDs[row]))
+        resolved.append(name)
+    names = np.array(resolved, dtype=object)[codes]
+
+    for attr in ROSTER_ATTRIBUTES:
+        values = records[attr]
+        given = values.notna().to_numpy()
+        last = pd.Series(values.to_numpy()[given], index=names[given])
+        last = last[~last.index.duplicated(keep='last')]
+        for name, value in last.items():
+            setattr(characters[name], attr, value)
 
 
 class Timesheet():
     """ The timesheet object within which login/out events are gathered per 
     character and stashed. Total time logged is calculated.  
     """
-    def __init__(self, characters_dict: dict, timesheet_path):
+    # arguments the workbook is parsed with:
+    # Data headers happen on row 3
+    # column 1 is Time data from unknown timezones, so skip it
+    sheetKwargs: dict = {'skiprows': 3, 'skipcolumns': 1}
+
+    def __init__(self, characters_dict: dict, timesheet_path, resolver=None,
+                 cache=None):
         self.timesheetPath: str = str(timesheet_path)
         self.timesheetString: str = ''
         self.characters: dict = characters_dict
+        self.resolver: NameResolver = resolver or NameResolver(characters_dict)
+        self.cache = cache
         self.displayedCharacters = []
         self.firsttime = 0
         self.lasttime  = 0
+        # number of rows at exactly lasttime, for incremental checkpoints
+        self.nAtLasttime: int = 0
+        # column names of the sheet, i.e. of the rows stashed in strangeness
+        self.columns: list = []
 
     def __str__(self):
         return f'Timesheet pulled from {self.timesheetPath}'
 
-    def parseTimesheet(self):
-        # load excel file
-        xls = pd.ExcelFile(self.timesheetPath)
-        # then parse it:
-        # Data headers happen on row 3
-        # column 1 is Time data from unknown timezones, so skip it
-        df = xls.parse(skiprows=3, skipcolumns=1)
+    @profiling.staged('read timesheet')
+    def readSheet(self) -> pd.DataFrame:
+        # load and parse the excel file (or its cached copy)
+        return read_workbook(self.timesheetPath, self.cache,
+                             **self.sheetKwargs)
+
+    @profiling.staged()
+    def parseTimesheet(self, checkpoint=None, df=None):
+        """ Gather the login/out events of the timesheet. With an
+        incremental.Checkpoint of an earlier run on the same (cumulative)
+        export, the saved character state is restored and only rows added
+        since that run are processed. df is the already decoded sheet (see
+        pipeline.py); it is read from the workbook if not given.
+        """
+        if df is None:
+            df = self.readSheet()
+        profiling.count('timesheet rows', len(df))
         # there may be instances where a state id is not recorded in the 
         # timesheet document
         df['State ID'] = df['State ID'].fillna(-9999)
+        self.columns = list(df.columns)
         # get first and last times
         self.firsttime = df['Time'].min()
         self.lasttime = df['Time'].max()
+        self.nAtLasttime = int((df['Time'] == self.lasttime).sum())
+
+        # pick up where the last run left off
+        if checkpoint is not None:
+            checkpoint.restore(self.characters)
+            df = checkpoint.newRows(df)
 
         # get character names and stateIDs dataframe
         chars = df[['State ID', 'Name']].drop_duplicates()
@@ -139,6 +301,98 @@ class Timesheet():
         # and
         # gather name mapping from sheet names to dict names
         mapping = {}
+        self.mapNames(chars, mapping)
+
+        # pair up all check in/out events
+        self.pairEvents(df, mapping)
+
+        # check if anyone was still logged on at the end of the time period
+        # and add the last row of their sheet name to the log of strangeness
+        rows = pd.Series(np.arange(len(df)), index=df['Name'].to_numpy())
+        lastRow = rows[~rows.index.duplicated(keep='last')].to_dict()
+        for orig, name in mapping.items():
+            if self.characters[name].loggedIn:
+                self.characters[name].strangeness.add('post', df,
+                                                      [lastRow[orig]])
+                profiling.count('post')
+
+        self.summarize()
+
+    @profiling.staged()
+    def streamTimesheet(self, checkpoint=None, chunksize: int = 100000):
+        """ Same as parseTimesheet, but the sheet is read and processed
+        chunksize rows at a time (see streaming.iter_sheet), so memory use
+        doesn't grow with the length of the export. The workbook cache isn't
+        used.
+
+        NOTE: the State ID column is read as floats, like the in-memory path
+        does for sheets with missing state ids.
+        """
+        mapping = {}
+        seenPairs = set()
+        # last row of every sheet name so far, for the post-pass
+        lastRows = {}
+        nAtWatermark = 0
+        self.firsttime = self.lasttime = None
+
+        # pick up where the last run left off
+        if checkpoint is not None:
+            checkpoint.restore(self.characters)
+
+        for df in iter_sheet(self.timesheetPath, chunksize,
+                             **self.sheetKwargs):
+            profiling.count('timesheet rows', len(df))
+            # there may be instances where a state id is not recorded in the
+            # timesheet document
+            df['State ID'] = df['State ID'].astype(float).fillna(-9999)
+            if not self.columns:
+                self.columns = list(df.columns)
+            # running first and last times
+            first, last = df['Time'].min(), df['Time'].max()
+            if self.firsttime is None or first < self.firsttime:
+                self.firsttime = first
+            if self.lasttime is None or last > self.lasttime:
+                self.lasttime, self.nAtLasttime = last, 0
+            self.nAtLasttime += int((df['Time'] == self.lasttime).sum())
+
+            # only rows added since the last run
+            if checkpoint is not None:
+                nSeen = nAtWatermark
+                nAtWatermark += checkpoint.countAtWatermark(df)
+                df = checkpoint.newRows(df, nSeen)
+
+            # only names not seen in earlier chunks need mapping
+            chars = df[['State ID', 'Name']].drop_duplicates()
+            pairs = list(zip(chars['State ID'], chars['Name']))
+            self.mapNames(chars[[pair not in seenPairs for pair in pairs]],
+                          mapping)
+            seenPairs.update(pairs)
+
+            # the chunk itself can be freed after pairing
+            self.pairEvents(df, mapping, compact=True)
+            last = df.drop_duplicates('Name', keep='last')
+            lastRows.update(zip(last['Name'],
+                                last.itertuples(index=False, name=None)))
+
+        # the post-pass over the last row of every sheet name
+        post = pd.DataFrame([lastRows[orig] for orig in mapping
+                             if self.characters[mapping[orig]].loggedIn],
+                            columns=self.columns)
+        i = 0
+        for orig, name in mapping.items():
+            if self.characters[name].loggedIn:
+                self.characters[name].strangeness.add('post', post, [i])
+                i += 1
+        profiling.count('post', i)
+
+        self.summarize()
+
+    @profiling.staged()
+    def mapNames(self, chars, mapping: dict):
+        """ Resolve the (State ID, Name) pairs of chars to character dict
+        names, creating the character objects within the character dict.
+        The name each sheet name resolved to is stored in mapping.
+        """
         for char in chars.values:
             # there's possible weirdness in the sheet
             if not char[1] or type(char[1]) != str:
@@ -150,126 +404,225 @@ class Timesheet():
 
             # remove non-alphanumeric characters that might not be caught by 
             # the various parsers being used
-            abbrev_name = ' '.join(re.findall(r'(\w+)',name))
-            mapping[name] = abbrev_name
-            name = check_names(abbrev_name, self.characters) #, verbose=False
+            name = self.resolver.resolveRaw(name)
+            # map the sheet name to the dict name it resolved to
+            mapping[char[1]] = name
             # if not already present, create a new character and assign it to 
             # the character dict
             if not self.characters.get(name):
                 self.characters[name] = Character(name,stateID)
 
-        # loop over all events
-        for i in range(len(df.Action)):
-            # if the name is non-existant or weirdly formatted, SKIP
-            if not df.Name[i] or type(df.Name[i]) != str:
-                continue
-            # otherwise, the mapping of sheet name and dict name is in mapping
-            name = mapping[df.Name[i]]
-            
-            # grab the character object
-            char = self.characters[name]
-
-            # check for normal check in event
-            if df.Action[i] == 'Check In' and not char.loggedIn:
-                char.logins.append(df.Time[i])
-                char.loggedIn = True
-            # check for normal check out event
-            elif df.Action[i] == 'Check Out' and char.loggedIn:
-                char.logouts.append(df.Time[i])
-                char.loggedIn = False
-                # this logout event is paired with the latest observed login 
-                # event so we can calculate time without re-looping.
-                # .timestamp() outputs epoch time, 
-                # divide by 3600 to get difference in units of hours
-                char.loggedTime += (char.logouts[-1].timestamp() - char.logins[-1].timestamp())/3600
-            # capture instance where the player checks in while already
-            # checked in; likely happening when a crash happens
-            elif df.Action[i] == 'Check In' and char.loggedIn:
-                char.strangeness['crashes'].append(list(df.iloc[i]))
-            # capture instances where the player checked in _before_ the 
-            # time period of the CSV
-            elif df.Action[i] == 'Check Out' and not char.loggedIn:
-                char.strangeness['pre'].append(list(df.iloc[i]))
-            # other instances. 
-            else:
-                char.strangeness['other'].append(list(df.iloc[i]))
-
-        # check if anyone was still logged on at the end of the time period
-        for orig, name in mapping.items():
-            # get their Character object
-            char = self.characters[name]
-            # having looped over all events, check if they remain logged in; if
-            # so, then add to the log of strangeness
-            if char.loggedIn:
-                chardf = df[df.Name == orig]
-                char.strangeness['post'].append(chardf.iloc[-1])
-
+    def summarize(self):
+        """ Build the overview string of time logged per character
+        """
         # sort the characters by max time
         charList = [[self.characters[char].name,self.characters[char].loggedTime] for char in self.characters.keys()]
         charList.sort(key = lambda x: x[1], reverse=True)
-        # loop over all characters
+        # loop over all characters, joining the lines once at the end
+        lines = []
         for name, timelogged in charList:
             # get their Character object
             char = self.characters[name]
             if char.loggedTime > 0:
-                self.timesheetString +=  f"{char.loggedTime:17.2f}     {char.name}\n"
+                lines.append(f"{char.loggedTime:17.2f}     {char.name}\n")
                 self.displayedCharacters.append(char.name)
+        self.timesheetString += ''.join(lines)
 
         self.displayedCharacters.sort()
         self.displayedCharacters.insert(0, "Overview")
 
+    @profiling.staged()
+    def pairEvents(self, df, mapping, compact=False):
+        """ Pair the check in/out events in the timesheet rows of df and stash
+        them with the characters: logins, logouts, loggedTime, strangeness
+        (crashes, pre and other) and the loggedIn state at the end of df.
+        mapping gives the character dict name of each sheet name; rows with a
+        name that is not in mapping are skipped. With compact, strangeness
+        points into a copy of just the rows that don't match nicely instead of
+        into df, so df can be freed afterwards.
+        """
+        # characters in the order they are first mapped to
+        names = list(dict.fromkeys(mapping.values()))
+        chars = [self.characters[name] for name in names]
+        charIdx = {name: i for i, name in enumerate(names)}
+        # character index of every row, -1 for rows without a usable name
+        codes, sheetNames = pd.factorize(df['Name'])
+        lookup = np.array([charIdx.get(mapping.get(name), -1)
+                           if isinstance(name, str) else -1
+                           for name in sheetNames] + [-1], dtype=np.int64)
+        keys = lookup[codes]
+
+        # run the state machine over all rows at once
+        loggedIn = np.array([char.loggedIn for char in chars], dtype=bool)
+        events, loggedIn = classify_events(keys, df['Action'].to_numpy(),
+                                           loggedIn)
+        if profiling.active() is not None:
+            for event, kind in ((CRASH, 'crashes'), (PRE, 'pre'),
+                                (OTHER, 'other')):
+                profiling.count(kind, int((events == event).sum()))
+
+        # group rows per character, keeping the sheet order within a group
+        order = np.argsort(keys, kind='stable')
+        order = order[keys[order] >= 0]
+        groupKeys = keys[order]
+
+        # login/logout events strictly alternate per character, so each
+        # logout is paired with the event right before it, or with the still
+        # open login of a character that was logged in before df
+        # .timestamp() outputs epoch time, so use epoch seconds here as well
+        times = to_epoch(df['Time'].to_numpy())
+        seconds = times / SECOND
+        paired = np.isin(events[order], (LOGIN, LOGOUT))
+        pairRows, pairKeys = order[paired], groupKeys[paired]
+        isLogout = events[pairRows] == LOGOUT
+        loginSeconds = np.empty(len(pairRows))
+        loginSeconds[1:] = seconds[pairRows[:-1]]
+        firstOfChar = np.ones(len(pairRows), dtype=bool)
+        firstOfChar[1:] = pairKeys[1:] != pairKeys[:-1]
+        for j in np.flatnonzero(firstOfChar & isLogout):
+            loginSeconds[j] = chars[pairKeys[j]].logins[-1].timestamp()
+        # divide by 3600 to get difference in units of hours; np.add.at adds
+        # logout by logout so the sums are the same as a running total
+        loggedTime = np.array([char.loggedTime for char in chars], dtype=float)
+        np.add.at(loggedTime, pairKeys[isLogout],
+                  (seconds[pairRows[isLogout]] - loginSeconds[isLogout])/3600)
+        profiling.count('sessions paired', int(isLogout.sum()))
+
+        # hand the events over to the Character objects; rows that don't
+        # match nicely are stashed as row positions into df
+        source, position = df, np.arange(len(df))
+        if compact:
+            anomalies = np.flatnonzero(np.isin(events, (CRASH, PRE, OTHER)))
+            source = df.iloc[anomalies].reset_index(drop=True)
+            position[anomalies] = np.arange(len(anomalies))
+        bounds = np.searchsorted(groupKeys, np.arange(len(chars) + 1))
+        for k, char in enumerate(chars):
+            rows = order[bounds[k]:bounds[k+1]]
+            if len(rows) == 0:
+                continue
+            rowEvents = events[rows]
+            char.logins.extend(times[rows[rowEvents == LOGIN]])
+            char.logouts.extend(times[rows[rowEvents == LOGOUT]])
+            for event, kind in ((CRASH, 'crashes'), (PRE, 'pre'),
+                                (OTHER, 'other')):
+                char.strangeness.add(kind, source,
+                                     position[rows[rowEvents == event]])
+            if (rowEvents == LOGOUT).any():
+                char.loggedTime = float(loggedTime[k])
+            char.loggedIn = bool(loggedIn[k])
+
     def getCharacterData(self, characterSelection):
+        """ Text of the clocked time and sessions of the characters whose name
+        is in characterSelection (a name or a list of names), or the overview
+        string for 'Overview'
+        """
         if characterSelection == 'Overview':
             return self.timesheetString
-        else:
-            output = ""
-            for name in self.characters.keys():
-                # get their Character object
-                char = self.characters[name]
-                if char.name in characterSelection:
-                    output += "{} - clocked time: {}".format(char.name, str(char.loggedTime).rjust(17)) + '\n\n'
-                    for i in range(0, min(len(char.logins),len(char.logouts))):
-                        output +=  "in: {}  -  out: {}".format(str(char.logins[i]),str(char.logouts[i])) + '\n'
-            return output
+        # join the texts once instead of growing a string
+        return ''.join(char.sessionText()
+                       for char in self.characters.values()
+                       if char.name in characterSelection)
 
+    @profiling.staged()
     def createGanttChart(self, 
                          fig_name = 'gantt_chart.png', 
-                         ylim = (-0.1,10.1)):
+                         ylim = (-0.1,10.1),
+                         names = None,
+                         window = None,
+                         merge_gaps = False,
+                         dpi = 300):
+        """ Draw the paired login/out sessions of the characters as a gantt
+        chart, one row per character sorted by time logged:
+            fig_name: file the chart is saved to
+            ylim: range of rows shown
+            names: only draw these characters (default: all)
+            window: (start, end) datetimes; only draw this time range
+                (default: the time period of the timesheet)
+            merge_gaps: merge sessions of a character that are less than a
+                pixel apart, which keeps charts of long time periods light
+            dpi: resolution of the saved figure
+
+        All sessions are drawn as a single PolyCollection.
         """
-        """
-        figure = plt.figure(figsize=(16,8))
+        # matplotlib takes long to import, so it's only loaded for charts
+        import matplotlib.pyplot as plt
+        import matplotlib as mpl
+        from matplotlib.collections import PolyCollection
+
+        figsize = (16,8)
+        figure = plt.figure(figsize=figsize)
         ax = plt.gca()
         begTime = self.firsttime.timestamp()
         endTime = self.lasttime.timestamp() - begTime
-
-        ax.plot([0,0],[-1,len(self.characters)+1], 'r-', zorder=3)
-        ax.plot([endTime,endTime],[-1,len(self.characters)+1], 'r-', zorder=3)
+        if window is not None:
+            xmin = pd.Timestamp(window[0]).timestamp() - begTime
+            xmax = pd.Timestamp(window[1]).timestamp() - begTime
+        else:
+            xmin, xmax = 0, endTime
 
         # sort the characters by max time
         charList = [[self.characters[char].name,self.characters[char].loggedTime] for char in self.characters.keys()]
         charList.sort(key = lambda x: x[1], reverse=True)
-        # loop over all characters
-        for i, (name, timelogged) in enumerate(charList):
-            char = self.characters[name]
-            # get the name
-            name = char.name
-            # get the facecolor to draw the rectangles with
-            drawColor = list(mpl.colors.XKCD_COLORS.keys())[2**i % 949]
-            # loop over all paired events
-            for j in range(0,min(len(char.logins),len(char.logouts))):
-                # get epoch times for the log in/out event
-                st = char.logins[j].timestamp()
-                et = char.logouts[j].timestamp()
-                # create the rectangle drawing object
-                rect = Rectangle((st - begTime, i + 0.1), # (x,y)
-                                 (et - st),               # width
-                                 0.8,                     # height
-                                 facecolor=drawColor,
-                                 alpha=0.75,
-                                 edgecolor='xkcd:black',
-                                 zorder=3)
-                # add rectangle object to the canvas
-                ax.add_patch(rect)
+        if names is not None:
+            names = set(names)
+            charList = [char for char in charList if char[0] in names]
+
+        ax.plot([0,0],[-1,len(charList)+1], 'r-', zorder=3)
+        ax.plot([endTime,endTime],[-1,len(charList)+1], 'r-', zorder=3)
+
+        # paired events of the drawn characters, as epoch seconds relative to
+        # the start of the timesheet; row is the position in charList
+        chars = [self.characters[name] for name, timelogged in charList]
+        nPairs = np.array([min(len(char.logins), len(char.logouts))
+                           for char in chars], dtype=np.int64)
+        row = np.repeat(np.arange(len(chars)), nPairs)
+        st = np.concatenate([char.logins.epochs[:n] / SECOND
+                             for char, n in zip(chars, nPairs)]
+                            + [np.zeros(0)]) - begTime
+        et = np.concatenate([char.logouts.epochs[:n] / SECOND
+                             for char, n in zip(chars, nPairs)]
+                            + [np.zeros(0)]) - begTime
+
+        # only keep (the part of) sessions in the time window
+        if window is not None:
+            keep = (et > xmin) & (st < xmax)
+            row, st, et = row[keep], st[keep], et[keep]
+            st, et = np.maximum(st, xmin), np.minimum(et, xmax)
+
+        # sessions less than a pixel apart can't be told apart anyway
+        if merge_gaps and len(st):
+            pixel = (xmax - xmin) / (figsize[0] * dpi)
+            order = np.lexsort((st, row))
+            row, st, et = row[order], st[order], et[order]
+            # latest end time so far of each character; offsetting the rows
+            # keeps the running max from leaking into the next row
+            offset = row * (et.max() - et.min() + 1)
+            latest = np.maximum.accumulate(et - et.min() + offset) \
+                     - offset + et.min()
+            newBar = np.ones(len(st), dtype=bool)
+            newBar[1:] = ((row[1:] != row[:-1])
+                          | (st[1:] - latest[:-1] > pixel))
+            bars = np.flatnonzero(newBar)
+            et = np.maximum.reduceat(et, bars)
+            row, st = row[bars], st[bars]
+
+        # one rectangle (x,y) -> (x+width,y+height) per session
+        y0 = row + 0.1
+        y1 = y0 + 0.8
+        verts = np.stack([np.stack([st, y0], axis=1),
+                          np.stack([st, y1], axis=1),
+                          np.stack([et, y1], axis=1),
+                          np.stack([et, y0], axis=1)], axis=1)
+        # get the facecolor to draw the rectangles with, per character
+        colorNames = list(mpl.colors.XKCD_COLORS.keys())
+        colors = [colorNames[2**i % 949] for i in range(len(chars))]
+        bars = PolyCollection(verts,
+                              facecolors=[colors[i] for i in row],
+                              alpha=0.75,
+                              edgecolors='xkcd:black',
+                              zorder=3)
+        # add all rectangles to the canvas at once
+        ax.add_collection(bars)
 
         # setting y-axis ticks and labels
         ax.set_yticks(np.arange(len(charList))+0.5,
@@ -277,8 +630,8 @@ class Timesheet():
         ax.set_ylim(ylim)
 
         # process to get x-axis ticks and labels
-        startDate = self.firsttime.date()
-        endDate =   self.lasttime.date()
+        startDate = pd.Timestamp((xmin + begTime) * SECOND).date()
+        endDate =   pd.Timestamp((xmax + begTime) * SECOND).date()
         delta = endDate - startDate
         days = [startDate+timedelta(days=i) for i in range(delta.days + 1)]
         midnights = [int(datetime.combine(day, datetime.min.time()).strftime('%s')) - begTime for day in days]
@@ -287,7 +640,8 @@ class Timesheet():
         ax.tick_params(axis='x',pad = -1.)
         for label in ax.get_xticklabels(which='major'):
             label.set(rotation=-45,horizontalalignment='left',size='small')
-        ax.set_xlim((-endTime*0.01, endTime*1.01))
+        span = xmax - xmin
+        ax.set_xlim((xmin - span*0.01, xmax + span*0.01))
 
         # add grid lines for aiding the eye
         plt.grid(axis='y',visible=True,which='major',
@@ -296,53 +650,82 @@ class Timesheet():
                  color='#808080',linestyle='--',alpha=0.75,zorder=1)
 
         plt.tight_layout()
-        plt.savefig(fig_name, dpi = 300, transparent = True)
+        plt.savefig(fig_name, dpi = dpi, transparent = True)
 
 
 class IncidentReport():
     """
     """
-    def __init__(self, charactersDict, incidentPath):
+    # arguments the workbook is parsed with
+    sheetKwargs: dict = {'sheet_name': '_Incidents'}
+
+    def __init__(self, charactersDict, incidentPath, resolver=None, cache=None):
         self.incidentPath: str = str(incidentPath)
         self.characters: dict = charactersDict
+        self.resolver: NameResolver = resolver or NameResolver(charactersDict)
+        self.cache = cache
 
     def __str__(self):
         """
         """
         return f'Incidents pulled from {self.incidentPath}'
 
-    def parseIncidents(self):
-        # load excel file
-        xls = pd.ExcelFile(self.incidentPath)
-        # then parse it
-        df = xls.parse('_Incidents')
+    @profiling.staged('read incidents')
+    def readSheet(self) -> pd.DataFrame:
+        # load and parse the excel file (or its cached copy)
+        return read_workbook(self.incidentPath, self.cache,
+                             **self.sheetKwargs)
+
+    @profiling.staged()
+    def parseIncidents(self, df=None):
+        """ Attach the incidents to the characters involved. df is the
+        already decoded sheet (see pipeline.py); it is read from the workbook
+        if not given.
+        """
+        if df is None:
+            df = self.readSheet()
+        profiling.count('incident rows', len(df))
         self.incidents = df
 
-        # create the character objects within the character dict
-        # and
-        # gather name mapping from sheet names to dict names
-        # loop over all incidents using indices
-        for i in range(len(df.Involved)):
-            # grab all names listed in the incident row
-            try:
-                involved_names = df.Involved[i].split(',')
-            except:
-                involved_names = []
-            names = list(set([df.StartedBy[i]] + involved_names))
-
-            # loop over all character names associated with the incident
-            for name in names:
-                # remove non-alphanumeric characters that might not be caught
-                # by the various parsers being used
-                abbrev_name = ' '.join(re.findall(r'(\w+)',name))
-                name = check_names(abbrev_name, self.characters)
-                # if not already present, create a new character and assign it
-                # to the character dict
-                if not self.characters.get(name):
-                    self.characters[name] = Character(name,0)
-
-                incidentDate = datetime.strptime(df.Date[i],'%Y-%m-%d %H:%M:%S')
-                self.characters[name].incidents.append([df.IncidentNr[i],
-                                                        incidentDate])
-
+        # parse all incident dates at once
+        dates = to_epoch(pd.to_datetime(df['Date'],
+                                        format='%Y-%m-%d %H:%M:%S'))
+        # one (incident row, sheet name) pair per name listed in an incident
+        # row; the one who started it and everyone involved, listed once
+        rowIdx = np.arange(len(df))
+        involved = pd.Series(df['Involved'].to_numpy(dtype=object),
+                             index=rowIdx)
+        involved = involved[involved.map(type) == str].str.split(',').explode()
+        pairs = pd.DataFrame({
+            'row': np.concatenate([rowIdx, involved.index.to_numpy()]),
+            'name': np.concatenate([df['StartedBy'].to_numpy(dtype=object),
+                                    involved.to_numpy(dtype=object)])})
+        # there's possible weirdness in the sheet
+        pairs = pairs[pairs['name'].map(type) == str]
+        pairs = pairs.sort_values('row', kind='stable').drop_duplicates()
+
+        # resolve every distinct sheet name once, in the order they show up,
+        # and create the character objects within the character dict
+        sheetNames = pd.unique(pairs['name'])
+        resolved = {}
+        for sheetName in sheetNames:
+            # remove non-alphanumeric characters that might not be caught
+            # by the various parsers being used
+            name = self.resolver.resolveRaw(sheetName)
+            # if not already present, create a new character and assign it
+            # to the character dict
+            if not self.characters.get(name):
+                self.characters[name] = Character(name,0)
+            resolved[sheetName] = name
+
+        # attach the incidents to the characters in bulk, in incident order
+        charIdx, names = pd.factorize(pairs['name'].map(resolved))
+        order = np.argsort(charIdx, kind='stable')
+        rows = pairs['row'].to_numpy()[order]
+        bounds = np.searchsorted(charIdx[order], np.arange(len(names) + 1))
+        numbers = df['IncidentNr'].to_numpy()
+        for k, name in enumerate(names):
+            group = rows[bounds[k]:bounds[k+1]]
+            self.characters[name].incidents.extend(numbers[group],
+                                                   dates[group])
 
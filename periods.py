@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from analysis import WEEK, to_epoch
+from department import session_table, incident_table
+import profiling
+from shiftcalendar import interval_seconds
+
+# per period metrics of the comparison table, in column order
+PERIOD_METRICS = ['Hours', 'Hours per Week', 'Sessions', 'Incidents']
+
+def period_bounds(timesheets: list) -> np.ndarray:
+    """ Epoch (ns) bounds of the reporting periods of parsed timesheets, in
+    chronological order: period k runs from the first time of timesheet k
+    up to the first time of timesheet k+1, the last one through the last
+    time of its timesheet. Returns nPeriods + 1 bounds.
+    """
+    starts = to_epoch([t.firsttime for t in timesheets])
+    end = to_epoch([timesheets[-1].lasttime])[0] + 1
+    bounds = np.append(starts, end)
+    if np.any(np.diff(bounds) <= 0):
+        raise ValueError('Period exports have to be given in chronological '
+                         'order and must not start at the same time')
+    return bounds
+
+def period_stats(characters: dict, bounds: np.ndarray) -> dict:
+    """ Per period stats of every character in one pass over the stacked
+    session and incident tables. Returns a dict of metric -> array of shape
+    (nChars, nPeriods):
+        Hours: hours worked within the period; sessions running over a
+            period bound are split
+        Hours per Week: Hours over the length of the period in weeks
+        Sessions: sessions started in the period
+        Incidents: incidents started in the period
+    """
+    nChars, nPeriods = len(characters), len(bounds) - 1
+    sessions = session_table(characters)
+    char = sessions['char'].to_numpy()
+    start = sessions['start'].to_numpy()
+    hours = interval_seconds(start, sessions['end'].to_numpy(), char, nChars,
+                             bounds) / 3600
+    weeks = np.diff(bounds) / WEEK
+
+    def count(keys, times):
+        period = np.searchsorted(bounds, times, side='right') - 1
+        inside = (period >= 0) & (period < nPeriods)
+        return np.bincount(keys[inside] * nPeriods + period[inside],
+                           minlength=nChars * nPeriods
+                           ).reshape(nChars, nPeriods)
+
+    incidents = incident_table(characters)
+    return {'Hours': hours,
+            'Hours per Week': hours / weeks[None, :],
+            'Sessions': count(char, start),
+            'Incidents': count(incidents['char'].to_numpy(),
+                               incidents['time'].to_numpy())}
+
+def period_labels(paths: list) -> list:
+    """ Labels of the periods of the timesheet paths: the file names, with
+    their directory in front where the names alone repeat (e.g. the same
+    export name in a folder per month), and the period number in front
+    where even those repeat
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    labels = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    if len(set(labels)) < len(labels):
+        labels = [os.path.join(os.path.basename(os.path.dirname(path)), label)
+                  for path, label in zip(paths, labels)]
+    if len(set(labels)) < len(labels):
+        labels = [f'{j + 1}:{label}' for j, label in enumerate(labels)]
+    return labels
+
+@profiling.staged()
+def compare_periods(characters: dict, timesheets: list,
+                    labels: list = None) -> pd.DataFrame:
+    """ Period-over-period table of all characters, given the timesheets of
+    the periods (see pipeline.ingest_periods) in chronological order. For
+    every metric of PERIOD_METRICS there is a column per period, labelled
+    '<label> <metric>', followed by the trend columns:
+        <metric> Change: last period minus the one before
+        <metric> Trend: least squares slope over all periods, per period
+    Trends are NaN with a single period. labels default to the timesheet
+    file names (see period_labels()). Sorted by the hours of the last period.
+    """
+    if labels is None:
+        labels = period_labels([t.timesheetPath for t in timesheets])
+    if len(labels) != len(timesheets):
+        raise ValueError('Need one label per period')
+    if len(set(labels)) < len(labels):
+        raise ValueError('The periods need different labels')
+    bounds = period_bounds(timesheets)
+    stats = period_stats(characters, bounds)
+    nPeriods = len(timesheets)
+    chars = list(characters.values())
+
+    # slope of the least squares line through every row at once
+    x = np.arange(nPeriods) - (nPeriods - 1) / 2
+    columns = {'Name': [char.name for char in chars],
+               'CID': [char.stateID for char in chars],
+               'Department': [char.department for char in chars],
+               'Rank': [char.rank for char in chars]}
+    for metric in PERIOD_METRICS:
+        values = stats[metric]
+        for j, label in enumerate(labels):
+            columns[f'{label} {metric}'] = values[:, j]
+        if nPeriods > 1:
+            change = values[:, -1] - values[:, -2]
+            trend = values @ x / (x @ x)
+        else:
+            change = trend = np.full(len(chars), np.nan)
+        columns[f'{metric} Change'] = change
+        columns[f'{metric} Trend'] = trend
+
+    table = pd.DataFrame(columns)
+    return table.sort_values(f'{labels[-1]} Hours', ascending=False,
+                             kind='stable', ignore_index=True)
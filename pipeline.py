@@ -0,0 +1,179 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import read_workbook
+from names import NameResolver
+from parsers import Timesheet, Roster, IncidentReport, parse_rosters
+import profiling
+
+@profiling.staged()
+def decode_workbooks(jobs: list, cache=None, workers: int = None) -> list:
+    """ Decode the workbook sheets of jobs, a list of (path, parseKwargs), in
+    a process pool. Returns the DataFrames in the order of jobs.
+
+    Sheets already in the cache are loaded in this process since that's
+    faster than handing them over from a worker. workers defaults to the
+    number of CPUs; with workers=1 everything is decoded in this process.
+    """
+    frames = [None] * len(jobs)
+    todo = []
+    for i, (path, parseKwargs) in enumerate(jobs):
+        if cache is not None and cache.contains(path, **parseKwargs):
+            frames[i] = read_workbook(path, cache, **parseKwargs)
+        else:
+            todo.append(i)
+    profiling.count('sheets from cache', len(jobs) - len(todo))
+    profiling.count('sheets decoded', len(todo))
+
+    workers = min(workers or os.cpu_count() or 1, len(todo))
+    if workers <= 1:
+        for i in todo:
+            path, parseKwargs = jobs[i]
+            frames[i] = read_workbook(path, cache, **parseKwargs)
+        return frames
+
+    # forked workers don't profile; their stages would be lost anyway
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=profiling.disable) as pool:
+        futures = {i: pool.submit(read_workbook, jobs[i][0], cache,
+                                  **jobs[i][1])
+                   for i in todo}
+        for i, future in futures.items():
+            frames[i] = future.result()
+    return frames
+
+def make_rosters(characters: dict, rosterPath, resolver, cache=None,
+                 schema: dict = None) -> list:
+    """ Roster objects of rosterPath: a single path, or a list of paths and
+    (path, department) pairs, e.g. one roster per department
+    """
+    if rosterPath is None:
+        return []
+    if isinstance(rosterPath, (str, os.PathLike)):
+        rosterPath = [rosterPath]
+    rosters = []
+    for entry in rosterPath:
+        path, department = entry if isinstance(entry, tuple) \
+                           else (entry, None)
+        rosters.append(Roster(characters, path, resolver, cache, schema,
+                              department))
+    return rosters
+
+@profiling.staged()
+def ingest(characters: dict, timesheetPaths: list, rosterPath=None,
+           incidentPath=None, resolver=None, cache=None, checkpoint=None,
+           workers: int = None, chunksize: int = None,
+           rosterSchema: dict = None):
+    """ Parse any number of timesheet exports, a roster and an incident
+    report into the character dict. The workbooks are decoded in parallel
+    (see decode_workbooks), then merged one after the other in a fixed
+    order: the timesheets in the order given, the roster, then the
+    incidents. The merge order decides how names are resolved, so results
+    are the same as parsing the files one by one.
+
+    The timesheets of a multi-period run have to be given in chronological
+    order. An incremental.Checkpoint only works with a single (cumulative)
+    timesheet export. With a chunksize, the timesheets are streamed in chunks
+    of that many rows (see Timesheet.streamTimesheet) instead of being
+    decoded as a whole.
+
+    rosterPath may also be a list of rosters (see make_rosters), which are
+    merged in one go in the order given; rosterSchema maps their columns
+    (see parsers.Roster).
+
+    Returns the Timesheet objects, the Roster (a list of them for a list of
+    rosters) and the IncidentReport (None for a path that isn't given).
+    """
+    timesheetPaths = list(timesheetPaths)
+    if checkpoint is not None and len(timesheetPaths) > 1:
+        raise ValueError('Incremental ingestion takes a single timesheet '
+                         'export')
+    # one name resolver shared by all parsers filling the dict
+    resolver = resolver or NameResolver(characters)
+
+    timesheets = [Timesheet(characters, path, resolver, cache)
+                  for path in timesheetPaths]
+    rosters = make_rosters(characters, rosterPath, resolver, cache,
+                           rosterSchema)
+    incidents = None
+    if incidentPath is not None:
+        incidents = IncidentReport(characters, incidentPath, resolver, cache)
+
+    # decode everything at once, then merge in order
+    jobs = []
+    if chunksize is None:
+        jobs += [(t.timesheetPath, t.sheetKwargs) for t in timesheets]
+    jobs += [(r.rosterPath, r.sheetKwargs) for r in rosters]
+    if incidents is not None:
+        jobs.append((incidents.incidentPath, incidents.sheetKwargs))
+    frames = decode_workbooks(jobs, cache, workers)
+    if chunksize is None:
+        for timesheet, df in zip(timesheets, frames):
+            timesheet.parseTimesheet(checkpoint, df)
+        frames = frames[len(timesheets):]
+    else:
+        for timesheet in timesheets:
+            timesheet.streamTimesheet(checkpoint, chunksize)
+    roster = _merge_rosters(rosterPath, rosters, frames)
+    if incidents is not None:
+        incidents.parseIncidents(frames.pop(0))
+    return timesheets, roster, incidents
+
+@profiling.staged()
+def ingest_periods(characters: dict, periods: list, rosterPath=None,
+                   resolver=None, cache=None, workers: int = None,
+                   rosterSchema: dict = None):
+    """ Parse the timesheet and incident exports of several reporting
+    periods, given as a list of (timesheetPath, incidentPath) in
+    chronological order (incidentPath may be None), into one character
+    dict. Names are resolved once across all periods by a shared resolver
+    and the roster is parsed once. All workbooks are decoded in parallel,
+    then merged in order: the timesheets, the roster, the incidents.
+
+    Returns the Timesheet objects, the Roster (None without a rosterPath,
+    a list for a list of rosters, see ingest) and the IncidentReports (None
+    for a period without incidents). Periods given the same incident export
+    (e.g. a cumulative one) share its IncidentReport, which is parsed once.
+    """
+    resolver = resolver or NameResolver(characters)
+    timesheets = [Timesheet(characters, timesheetPath, resolver, cache)
+                  for timesheetPath, _ in periods]
+    # an export parsed twice would attach each of its incidents twice
+    byPath = {}
+    for _, incidentPath in periods:
+        if incidentPath is not None:
+            key = os.path.abspath(incidentPath)
+            if key not in byPath:
+                byPath[key] = IncidentReport(characters, incidentPath,
+                                             resolver, cache)
+    reports = [None if incidentPath is None
+               else byPath[os.path.abspath(incidentPath)]
+               for _, incidentPath in periods]
+    rosters = make_rosters(characters, rosterPath, resolver, cache,
+                           rosterSchema)
+
+    jobs = [(t.timesheetPath, t.sheetKwargs) for t in timesheets]
+    jobs += [(r.rosterPath, r.sheetKwargs) for r in rosters]
+    jobs += [(r.incidentPath, r.sheetKwargs) for r in byPath.values()]
+    frames = decode_workbooks(jobs, cache, workers)
+    for timesheet in timesheets:
+        timesheet.parseTimesheet(df=frames.pop(0))
+    roster = _merge_rosters(rosterPath, rosters, frames)
+    for report in byPath.values():
+        report.parseIncidents(frames.pop(0))
+    return timesheets, roster, reports
+
+def _merge_rosters(rosterPath, rosters: list, frames: list):
+    """ Merge the rosters with their decoded sheets, the first ones of
+    frames (which are taken off), in one go. Returns what ingest returns
+    for them: None, the Roster, or a list of Rosters.
+    """
+    if not rosters:
+        return None
+    if len(rosters) == 1:
+        rosters[0].parseRoster(frames.pop(0))
+    else:
+        parse_rosters(rosters, [frames.pop(0) for _ in rosters])
+    if isinstance(rosterPath, (str, os.PathLike)):
+        return rosters[0]
+    return rosters
@@ -0,0 +1,231 @@
+import contextlib
+import functools
+import json
+import os
+import time
+import tracemalloc
+from collections import defaultdict
+
+class Profiler():
+    """ Timings, counters and peak memory of the stages of a run:
+        memory: whether peak memory is traced (with tracemalloc, which slows
+            python allocations down noticeably)
+        events: finished stages as dicts of name, stack (names of the
+            enclosing stages), start and duration (ns since the profiler was
+            made), self time (without the nested stages), peak traced memory
+            (bytes) and the counters that changed during the stage
+        counters: totals of the counted things, e.g. rows read
+
+    Stages nest: a stage started within another one shows up below it in the
+    trace. Use the module functions stage(), staged() and count() in the
+    code being profiled; they do nothing unless a profiler is enabled.
+    """
+    def __init__(self, memory: bool = True):
+        self.memory: bool = memory
+        self.events: list = []
+        self.counters = defaultdict(int)
+        self._t0 = time.perf_counter_ns()
+        # names, child time and carried peak memory of the open stages
+        self._stack: list = []
+        self._childTime: list = []
+        self._peaks: list = []
+        self._startedTracing = False
+
+    def __str__(self):
+        """
+        """
+        return f'Profiler of {len(self.events)} stages'
+
+    def start(self):
+        """ Start tracing memory, if asked for
+        """
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracing = True
+
+    def stop(self):
+        """ Stop tracing memory, if this profiler started it
+        """
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+
+    def stage(self, name: str):
+        """ Context manager timing the code in its with block as stage name
+        """
+        return _Stage(self, name)
+
+    def count(self, name: str, n: int = 1):
+        """ Add n to counter name
+        """
+        self.counters[name] += n
+
+    def totals(self) -> dict:
+        """ Per stage name: number of calls, total and self seconds and the
+        highest peak memory (MiB), in order of first call
+        """
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault(event['name'], {
+                'calls': 0, 'seconds': 0., 'self seconds': 0.,
+                'peak MiB': 0.})
+            total['calls'] += 1
+            total['seconds'] += event['duration'] / 1e9
+            total['self seconds'] += event['self'] / 1e9
+            total['peak MiB'] = max(total['peak MiB'], event['peak'] / 2**20)
+        return totals
+
+    def summary(self) -> str:
+        """ Table of the stage totals followed by the counters
+        """
+        lines = [f'{"stage":>24} {"calls":>7} {"seconds":>9} {"self":>9} '
+                 f'{"peak MiB":>9}']
+        for name, total in self.totals().items():
+            lines.append(f'{name:>24} {total["calls"]:>7} '
+                         f'{total["seconds"]:>9.3f} '
+                         f'{total["self seconds"]:>9.3f} '
+                         f'{total["peak MiB"]:>9.1f}')
+        for name, n in self.counters.items():
+            lines.append(f'{name:>24} {n:>7}')
+        return '\n'.join(lines)
+
+    def trace(self) -> dict:
+        """ The stages as a Trace Event Format dict (chrome://tracing,
+        Perfetto and speedscope read it as a flame chart); the counter totals
+        are stored under otherData
+        """
+        pid = os.getpid()
+        events = [{'name': event['name'], 'cat': 'stage', 'ph': 'X',
+                   'ts': event['start'] / 1e3, 'dur': event['duration'] / 1e3,
+                   'pid': pid, 'tid': 0,
+                   'args': {'peak MiB': event['peak'] / 2**20,
+                            **event['counters']}}
+                  for event in self.events]
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': {'counters': dict(self.counters)}}
+
+    def folded(self) -> str:
+        """ The stages as collapsed stacks (one 'outer;inner microseconds'
+        line per stack, self time only), the input format of flamegraph.pl
+        """
+        stacks = defaultdict(int)
+        for event in self.events:
+            stacks[';'.join(event['stack'] + [event['name']])] += event['self']
+        return '\n'.join(f'{stack} {ns // 1000}'
+                         for stack, ns in stacks.items()) + '\n'
+
+    def save(self, path):
+        """ Write the trace to path; as collapsed stacks if path ends in
+        .folded, as Trace Event Format JSON otherwise
+        """
+        with open(path, 'w') as f:
+            if str(path).endswith('.folded'):
+                f.write(self.folded())
+            else:
+                json.dump(self.trace(), f, indent=1)
+
+
+class _Stage():
+    """ A running stage of a Profiler
+    """
+    __slots__ = ('profiler', 'name', 'start', 'counters')
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        p = self.profiler
+        if p.memory and tracemalloc.is_tracing():
+            # the peak so far belongs to the enclosing stage; start counting
+            # this stage's peak from the current memory use
+            if p._peaks:
+                p._peaks[-1] = max(p._peaks[-1],
+                                   tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        p._stack.append(self.name)
+        p._childTime.append(0)
+        p._peaks.append(0)
+        self.counters = dict(p.counters)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        p = self.profiler
+        p._stack.pop()
+        childTime = p._childTime.pop()
+        peak = p._peaks.pop()
+        if p.memory and tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+        duration = end - self.start
+        if p._childTime:
+            p._childTime[-1] += duration
+            p._peaks[-1] = max(p._peaks[-1], peak)
+        p.events.append({
+            'name': self.name, 'stack': list(p._stack),
+            'start': self.start - p._t0, 'duration': duration,
+            'self': duration - childTime, 'peak': peak,
+            'counters': {name: n - self.counters.get(name, 0)
+                         for name, n in p.counters.items()
+                         if n != self.counters.get(name, 0)}})
+        return False
+
+
+# the profiler of the current run; None while profiling is off
+_active = None
+# handed out by stage() while profiling is off
+_NULL = contextlib.nullcontext()
+
+def enable(memory: bool = True) -> Profiler:
+    """ Start profiling the stages and counters of the code below into a new
+    Profiler, which is returned
+    """
+    global _active
+    disable()
+    _active = Profiler(memory)
+    _active.start()
+    return _active
+
+def disable() -> Profiler:
+    """ Stop profiling; returns the profiler that was active, if any
+    """
+    global _active
+    profiler, _active = _active, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def active() -> Profiler:
+    """ The enabled profiler, None while profiling is off
+    """
+    return _active
+
+def stage(name: str):
+    """ Time the code in a with block as stage name of the enabled profiler.
+    Does nothing (but hand out a shared null context) while profiling is off.
+    """
+    if _active is None:
+        return _NULL
+    return _active.stage(name)
+
+def staged(name: str = None):
+    """ Decorator profiling every call of a function as stage name (the
+    function name by default)
+    """
+    def decorate(func):
+        stageName = name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.stage(stageName):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count(name: str, n: int = 1):
+    """ Add n to counter name of the enabled profiler, if any
+    """
+    if _active is not None:
+        _active.counters[name] += n
@@ -0,0 +1,348 @@
+import json
+import os
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+
+from analysis import to_epoch
+from character import ANOMALY_KINDS, Character, EpochArray
+import profiling
+
+# Character attributes stored as columns of the characters table
+CHARACTER_COLUMNS = ['name', 'stateID', 'rank', 'position', 'callsign',
+                     'department', 'shift', 'loggedIn', 'loggedTime',
+                     'shift1Time', 'shift2Time', 'shift3Time',
+                     'shift1Incidents', 'shift2Incidents', 'shift3Incidents']
+
+@profiling.staged()
+def result_tables(characters: dict, timesheet=None, overview=None) -> dict:
+    """ The results of a run as a dict of DataFrames, built in one pass over
+    the characters (char columns are positions in the character dict):
+        characters: one row per character with its roster data and analysis
+            results, plus offsets into the tables below
+        sessions: char, start, end (NaT for a session still open)
+        incidents: char, incident, time
+        anomalies: char, kind and the values of the timesheet row
+        weeks: hoursPerWeek and incidentsPerWeek of all characters
+        overview: the overview table, if given
+    """
+    chars = list(characters.values())
+    tables = {}
+
+    # sessions; the logins and logouts of a character alternate, so a login
+    # without a matching logout can only be the last one
+    nLogins = np.array([len(char.logins) for char in chars], dtype=np.int64)
+    start = _stack([char.logins.epochs for char in chars])
+    end = np.full(len(start), np.datetime64('NaT'), dtype='datetime64[ns]')
+    for char, offset, n in zip(chars, np.cumsum(nLogins) - nLogins, nLogins):
+        logouts = char.logouts.epochs[:n]
+        end[offset:offset + len(logouts)] = logouts.view('datetime64[ns]')
+    tables['sessions'] = pd.DataFrame({
+        'char': np.repeat(np.arange(len(chars)), nLogins),
+        'start': start,
+        'end': end})
+
+    # incidents
+    nIncidents = np.array([len(char.incidents) for char in chars],
+                          dtype=np.int64)
+    tables['incidents'] = pd.DataFrame({
+        'char': np.repeat(np.arange(len(chars)), nIncidents),
+        'incident': np.concatenate([char.incidents.numbers.values
+                                    for char in chars]
+                                   + [np.zeros(0, dtype=np.int64)]),
+        'time': _stack([char.incidents.times.epochs for char in chars])})
+
+    # anomalies, sorted by character then kind
+    rows, charIdx, kinds = [], [], []
+    nAnomalies = np.zeros(len(chars), dtype=np.int64)
+    for i, char in enumerate(chars):
+        for kind in ANOMALY_KINDS:
+            if char.strangeness.count(kind) == 0:
+                continue
+            stashed = char.strangeness[kind]
+            rows.extend(stashed)
+            charIdx.extend([i] * len(stashed))
+            kinds.extend([kind] * len(stashed))
+            nAnomalies[i] += len(stashed)
+    columns = list(getattr(timesheet, 'columns', None) or [])
+    nValues = max([len(row) for row in rows], default=0)
+    columns = (columns + [f'column {j}' for j in range(nValues)])[:nValues]
+    anomalies = pd.DataFrame({'char': np.array(charIdx, dtype=np.int64),
+                              'kind': kinds})
+    for j, col in enumerate(columns):
+        anomalies[col] = [row[j] if j < len(row) else None for row in rows]
+    tables['anomalies'] = anomalies
+
+    # per week results, flattened
+    hoursPerWeek = [np.asarray(char.hoursPerWeek, dtype=float)
+                    for char in chars]
+    incidentsPerWeek = [np.asarray(char.incidentsPerWeek, dtype=float)
+                        for char in chars]
+    nWeeks = np.array([max(len(h), len(i)) for h, i in
+                       zip(hoursPerWeek, incidentsPerWeek)], dtype=np.int64)
+    tables['weeks'] = pd.DataFrame({
+        'char': np.repeat(np.arange(len(chars)), nWeeks),
+        'hours': np.concatenate([np.pad(h, (0, n - len(h)))
+                                 for h, n in zip(hoursPerWeek, nWeeks)]
+                                + [np.zeros(0)]),
+        'incidents': np.concatenate([np.pad(i, (0, n - len(i)))
+                                     for i, n in zip(incidentsPerWeek, nWeeks)]
+                                    + [np.zeros(0)])})
+
+    # characters, with the row ranges of each table
+    table = pd.DataFrame({col: [getattr(char, col) for char in chars]
+                          for col in CHARACTER_COLUMNS})
+    for name, counts in (('sessions', nLogins), ('incidents', nIncidents),
+                         ('anomalies', nAnomalies), ('weeks', nWeeks)):
+        table[name + 'Start'] = np.cumsum(counts) - counts
+        table[name + 'Count'] = counts
+    tables['characters'] = table
+
+    if overview is not None:
+        tables['overview'] = overview
+    return tables
+
+@profiling.staged()
+def merge_results(tables: dict, previous) -> dict:
+    """ The result_tables of an --incremental run with the sessions and
+    anomalies of the earlier runs put back in from previous, the ResultsStore
+    of the last run (read without mmap, as it is about to be overwritten).
+    The incremental run only parses the rows added since, while the other
+    tables (characters, incidents, weeks, overview) are complete already.
+
+    Open sessions of the previous store are dropped, the incremental run
+    starts with their login. So are its 'post' anomalies of characters that
+    logged out since or have a new one.
+    """
+    characters = tables['characters']
+    position = {name: i for i, name in enumerate(characters['name'])}
+    # positions of the earlier characters in this run, -1 if gone
+    names = previous.names()
+    oldChar = np.array([position.get(name, -1) for name in names],
+                       dtype=np.int64)
+
+    sessions = previous.table('sessions')
+    anomalies = previous.table('anomalies')
+    for table in (sessions, anomalies):
+        gone = oldChar[table['char'].to_numpy()] < 0
+        if gone.any():
+            name = names[table['char'].to_numpy()[gone][0]]
+            raise ValueError(f'{name} of the earlier runs is missing')
+        table['char'] = oldChar[table['char'].to_numpy()]
+    sessions = sessions[sessions['end'].notna()]
+
+    new = tables['anomalies']
+    stillOpen = characters['loggedIn'].to_numpy(dtype=bool, copy=True)
+    stillOpen[new.loc[new['kind'] == 'post', 'char'].to_numpy()] = False
+    anomalies = anomalies[(anomalies['kind'] != 'post')
+                          | stillOpen[anomalies['char'].to_numpy()]]
+
+    # earlier rows first, grouped by character as result_tables() has them
+    merged = dict(tables)
+    merged['sessions'] = pd.concat(
+        [sessions, tables['sessions']], ignore_index=True
+    ).sort_values('char', kind='stable', ignore_index=True)
+    kindOrder = {kind: j for j, kind in enumerate(ANOMALY_KINDS)}
+    anomalies = pd.concat([anomalies, new], ignore_index=True)
+    order = np.lexsort((anomalies['kind'].map(kindOrder).to_numpy(),
+                        anomalies['char'].to_numpy()))
+    merged['anomalies'] = anomalies.iloc[order].reset_index(drop=True)
+
+    characters = characters.copy()
+    for name in ('sessions', 'anomalies'):
+        counts = np.bincount(merged[name]['char'].to_numpy(),
+                             minlength=len(characters))
+        characters[name + 'Start'] = np.cumsum(counts) - counts
+        characters[name + 'Count'] = counts
+    merged['characters'] = characters
+    return merged
+
+@profiling.staged()
+def save_results(path, characters: dict, timesheet=None, overview=None,
+                 tables: dict = None):
+    """ Write the results of a run (see result_tables) as a ResultsStore
+    directory at path. Every column is a separate .npy file so it can be
+    memory-mapped. tables are the result_tables, if already built.
+    """
+    if tables is None:
+        tables = result_tables(characters, timesheet, overview)
+    os.makedirs(path, exist_ok=True)
+    manifest = {'version': ResultsStore.version, 'tables': {}, 'meta': {}}
+    if timesheet is not None:
+        manifest['meta'] = {'timesheetPath': timesheet.timesheetPath,
+                            'firsttime': str(timesheet.firsttime),
+                            'lasttime': str(timesheet.lasttime),
+                            'columns': list(tables['anomalies'].columns[2:])}
+    for name, df in tables.items():
+        manifest['tables'][name] = _write_table(os.path.join(path, name), df)
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+class ResultsStore():
+    """ Read access to results written by save_results(). Columns are
+    memory-mapped and only read when used, so single tables or characters can
+    be loaded without reading the whole run:
+        tables: names of the stored tables
+        meta: timesheet information of the run
+        characters: mapping of character name -> Character, built on access
+    """
+    version: int = 1
+
+    def __init__(self, path, mmap: bool = True):
+        self.path: str = str(path)
+        self.mmap: bool = mmap
+        with open(os.path.join(self.path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest.get('version') != self.version:
+            raise ValueError(f'Unsupported results store version in {path}')
+        self._tables: dict = manifest['tables']
+        self.meta: dict = manifest['meta']
+        self._columns: dict = {}
+        self._names = None
+        self._positions = None
+        self.characters = LazyCharacters(self)
+
+    def __str__(self):
+        """
+        """
+        return f'Results stored in {self.path}'
+
+    @property
+    def tables(self) -> list:
+        return list(self._tables)
+
+    def column(self, table: str, column: str) -> np.ndarray:
+        """ A single column of a table
+        """
+        key = (table, column)
+        if key not in self._columns:
+            info = self._tables[table]
+            j = info['columns'].index(column)
+            values = np.load(os.path.join(self.path, table, f'{j}.npy'),
+                             mmap_mode='r' if self.mmap else None)
+            if info['kinds'][j] == 'datetime':
+                values = values.view('datetime64[ns]')
+            elif info['kinds'][j] == 'json':
+                decoded = np.empty(len(values), dtype=object)
+                decoded[:] = [json.loads(v) for v in values.tolist()]
+                values = decoded
+            self._columns[key] = values
+        return self._columns[key]
+
+    def table(self, table: str, rows: slice = slice(None)) -> pd.DataFrame:
+        """ A table (or a slice of its rows) as a DataFrame
+        """
+        return pd.DataFrame({col: np.asarray(self.column(table, col)[rows])
+                             for col in self._tables[table]['columns']})
+
+    def names(self) -> list:
+        """ Names of all stored characters, in the order they were stored
+        """
+        if self._names is None:
+            self._names = self.column('characters', 'name').tolist()
+        return self._names
+
+    def character(self, name: str) -> Character:
+        """ Rebuild a single Character object from the stored tables
+        """
+        if self._positions is None:
+            self._positions = {n: i for i, n in enumerate(self.names())}
+        i = self._positions[name]
+        row = {col: _scalar(self.column('characters', col)[i])
+               for col in self._tables['characters']['columns']}
+        char = Character(row['name'], row['stateID'])
+        for col in CHARACTER_COLUMNS[2:]:
+            setattr(char, col, row[col])
+
+        def rows(table):
+            start = row[table + 'Start']
+            return slice(start, start + row[table + 'Count'])
+
+        sessions = self.table('sessions', rows('sessions'))
+        char.logins = EpochArray(sessions['start'].to_numpy())
+        char.logouts = EpochArray(sessions['end'].dropna().to_numpy())
+        incidents = self.table('incidents', rows('incidents'))
+        char.incidents.extend(incidents['incident'].to_numpy(),
+                              incidents['time'].to_numpy())
+        # the anomalies point into the stored rows of this character
+        anomalies = self.table('anomalies', rows('anomalies'))
+        values = anomalies.iloc[:, 2:]
+        for kind in ANOMALY_KINDS:
+            char.strangeness.add(
+                kind, values, np.flatnonzero(anomalies['kind'] == kind))
+        weeks = self.table('weeks', rows('weeks'))
+        char.hoursPerWeek = weeks['hours'].to_numpy()
+        char.incidentsPerWeek = weeks['incidents'].to_numpy()
+        return char
+
+
+class LazyCharacters(Mapping):
+    """ Read-only character dict of a ResultsStore; Character objects are
+    only rebuilt when they are looked up
+    """
+    def __init__(self, store: ResultsStore):
+        self.store: ResultsStore = store
+        self._loaded: dict = {}
+        self._names = None
+
+    def __getitem__(self, name):
+        if name not in self._loaded:
+            if self._names is None:
+                self._names = set(self.store.names())
+            if name not in self._names:
+                raise KeyError(name)
+            self._loaded[name] = self.store.character(name)
+        return self._loaded[name]
+
+    def __iter__(self):
+        return iter(self.store.names())
+
+    def __len__(self):
+        return len(self.store.names())
+
+
+def _write_table(directory: str, df: pd.DataFrame) -> dict:
+    """ Save each column of df as .npy in directory; returns its manifest
+    entry
+    """
+    os.makedirs(directory, exist_ok=True)
+    kinds = []
+    for j, col in enumerate(df.columns):
+        values, kind = _column_array(df[col])
+        np.save(os.path.join(directory, f'{j}.npy'), values)
+        kinds.append(kind)
+    return {'columns': [str(col) for col in df.columns], 'kinds': kinds,
+            'rows': len(df)}
+
+def _stack(epochs: list) -> np.ndarray:
+    """ Concatenate int64 epoch (ns) arrays into a datetime64 column
+    """
+    return np.concatenate(epochs + [np.zeros(0, dtype=np.int64)]
+                          ).view('datetime64[ns]')
+
+def _scalar(value):
+    """ Plain python value of a numpy scalar
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
+def _column_array(series: pd.Series):
+    """ Convert a column to a plain (memory-mappable) numpy array: datetimes
+    as int64 epoch (ns), numbers as they are, text as unicode strings with
+    missing values stored as '' and columns mixing text with other values
+    (e.g. callsigns read as numbers and as text) as the JSON of every value,
+    so each one comes back with its type
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return to_epoch(series.to_numpy()), 'datetime'
+    if pd.api.types.is_bool_dtype(series) or \
+            pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(), 'number'
+    values = series.dropna()
+    if len(values) and all(isinstance(v, pd.Timestamp) for v in values):
+        return to_epoch(series.to_numpy()), 'datetime'
+    if not all(isinstance(v, str) for v in values):
+        encoded = [json.dumps(_scalar(v), default=str) for v in series]
+        return np.array(encoded, dtype=str), 'json'
+    strings = series.astype(object).where(series.notna(), '').astype(str)
+    return strings.to_numpy(dtype=str), 'str'
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+
+from analysis import SECOND, HOUR, DAY, local_epoch, to_epoch
+
+# the EST shift layout the overview has always used; name and the hour of
+# the day each shift starts at, lasting until the next shift starts:
+#   Shift 1 is 9 AM to 5 PM, Shift 2 is 5 PM to 1 AM, Shift 3 is 1 AM to 9 AM
+DEFAULT_SHIFTS = {'Shift 1': 9, 'Shift 2': 17, 'Shift 3': 1}
+
+class ShiftCalendar():
+    """ Shift and week boundaries for a whole time range, computed once and
+    shared by all characters, so sessions and incidents can be binned with
+    searchsorted:
+        shifts: names of the shifts
+        tz: timezone the wall clock times of the sheets are in, or None to
+            use the wall clock times as they are
+        boundaries: epoch (ns) of every shift start in the range
+        shiftOfBin: shift of each bin [boundaries[j], boundaries[j+1])
+        weekBoundaries: epoch (ns) of every Monday midnight in the range
+
+    With a timezone, boundaries fall on the local wall clock time of every
+    day and all epochs are UTC, so days and weeks around a DST change have
+    their real length. Times from the sheets (naive wall clock) have to go
+    through toEpoch() first, which reads them the way the EST weeks of the
+    analysis do (see analysis.local_epoch()).
+    """
+    def __init__(self, start, end, shifts: dict = None, tz=None):
+        """ start, end: time range the calendar has to cover
+        shifts: dict of shift name -> start hour (may be fractional),
+            DEFAULT_SHIFTS if not given
+        """
+        shifts = dict(DEFAULT_SHIFTS if shifts is None else shifts)
+        if len(shifts) == 0:
+            raise ValueError('A shift calendar needs at least one shift')
+        self.shifts: list = list(shifts)
+        self.tz = tz
+
+        # wall clock days covering the range, from the Monday before it to
+        # the Monday after it, so every time falls in a shift and a week
+        first = pd.Timestamp(start).tz_localize(None).normalize() \
+                - pd.Timedelta(1, 'D')
+        first -= pd.Timedelta(first.weekday(), 'D')
+        last = pd.Timestamp(end).tz_localize(None).normalize() \
+               + pd.Timedelta(8, 'D')
+        days = to_epoch(pd.date_range(first, last, freq='D'))
+
+        # every shift start of every day, in time order
+        offsets = np.round(np.array(list(shifts.values()), dtype=float)
+                           * HOUR).astype(np.int64) % DAY
+        order = np.argsort(offsets, kind='stable')
+        starts = (days[:, None] + offsets[order][None, :]).ravel()
+        # a shift starting in a DST gap is moved forward by the gap, which
+        # can take it past the next start; that shift is then empty that day
+        self.boundaries: np.ndarray = np.maximum.accumulate(
+            self._localize(starts))
+        self.shiftOfBin: np.ndarray = np.tile(order, len(days))[:-1]
+
+        # Monday midnights; the epoch was a Thursday
+        mondays = days[(days // DAY + 3) % 7 == 0]
+        self.weekBoundaries: np.ndarray = self._localize(mondays)
+
+    @classmethod
+    def fromTimesheet(cls, timesheet, shifts: dict = None, tz=None):
+        """ Calendar covering the time range of a parsed Timesheet
+        """
+        return cls(timesheet.firsttime, timesheet.lasttime, shifts, tz)
+
+    def __str__(self):
+        """
+        """
+        return (f'Calendar of {len(self.shifts)} shifts over '
+                f'{len(self.weekBoundaries)} weeks')
+
+    def toEpoch(self, times) -> np.ndarray:
+        """ Epochs (ns) on the calendar's time line of wall clock times from
+        the sheets; either datetimes or int64 epochs of naive times
+        """
+        times = np.asarray(times)
+        if times.dtype.kind not in 'iu':
+            times = to_epoch(times)
+        return self._localize(times.astype(np.int64))
+
+    def shiftOf(self, times) -> np.ndarray:
+        """ Shift of each of times (calendar epochs), -1 outside the calendar
+        """
+        bins = np.searchsorted(self.boundaries, np.atleast_1d(times),
+                               side='right') - 1
+        inside = (bins >= 0) & (bins < len(self.shiftOfBin))
+        shift = np.full(len(bins), -1, dtype=np.int64)
+        shift[inside] = self.shiftOfBin[bins[inside]]
+        return shift
+
+    def weekOf(self, times) -> np.ndarray:
+        """ Week of each of times (calendar epochs), counted from the first
+        Monday of the calendar; -1 before it
+        """
+        return np.searchsorted(self.weekBoundaries, times, side='right') - 1
+
+    def shiftHours(self, starts, ends, keys, nKeys: int) -> np.ndarray:
+        """ Hours of the sessions [starts, ends) (calendar epochs) worked in
+        each shift, summed per key (e.g. character); shape (nKeys, nShifts)
+        """
+        seconds = interval_seconds(starts, ends, keys, nKeys, self.boundaries)
+        hours = np.zeros((nKeys, len(self.shifts)))
+        for shift in range(len(self.shifts)):
+            hours[:, shift] = seconds[:, self.shiftOfBin == shift].sum(axis=1)
+        return hours / 3600
+
+    def weekHours(self, starts, ends, keys, nKeys: int) -> np.ndarray:
+        """ Hours of the sessions [starts, ends) (calendar epochs) worked in
+        each week of the calendar, per key; shape (nKeys, nWeeks)
+        """
+        return interval_seconds(starts, ends, keys, nKeys,
+                                self.weekBoundaries) / 3600
+
+    def _localize(self, wallclock: np.ndarray) -> np.ndarray:
+        """ UTC epochs of naive wall clock epochs in the calendar's timezone,
+        by the same rules as the EST weeks (see analysis.local_epoch()): times
+        repeated when clocks go back are taken as daylight saving time and
+        times skipped when clocks go forward are moved forward by the gap
+        """
+        if self.tz is None:
+            return wallclock
+        return local_epoch(wallclock, self.tz)
+
+
+def interval_seconds(starts, ends, keys, nKeys: int,
+                     boundaries) -> np.ndarray:
+    """ Seconds of the intervals [starts, ends) within each bin
+    [boundaries[j], boundaries[j+1]), summed per key; shape (nKeys, nBins).
+    Intervals spanning several bins are split at the boundaries.
+    """
+    nBins = max(len(boundaries) - 1, 0)
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    keys = np.asarray(keys, dtype=np.int64)
+    # intervals ending before they start never contribute any time
+    keep = ends > starts
+    starts, ends, keys = starts[keep], ends[keep], keys[keep]
+    firstBin = np.searchsorted(boundaries, starts, side='right') - 1
+    lastBin = np.searchsorted(boundaries, ends, side='left') - 1
+    # one piece per (interval, bin) the interval overlaps
+    nPieces = np.maximum(lastBin - firstBin + 1, 0)
+    piece = np.repeat(np.arange(len(starts)), nPieces)
+    pieceBin = (firstBin[piece] + np.arange(len(piece))
+                - np.repeat(np.cumsum(nPieces) - nPieces, nPieces))
+    inRange = (pieceBin >= 0) & (pieceBin < nBins)
+    piece, pieceBin = piece[inRange], pieceBin[inRange]
+    seconds = (np.minimum(ends[piece], boundaries[pieceBin + 1])
+               - np.maximum(starts[piece], boundaries[pieceBin])) / SECOND
+    return np.bincount(keys[piece] * nBins + pieceBin, weights=seconds,
+                       minlength=nKeys * nBins).reshape(nKeys, nBins)
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+def iter_sheet(path, chunksize: int = 100000, skiprows: int = 0,
+               sheet_name=0, parse_dates=('Time',), **ignored):
+    """ Read a sheet chunksize rows at a time, yielding a DataFrame per chunk
+    so a sheet never has to be held in memory as a whole. .csv files are
+    read with pandas, excel workbooks row by row with openpyxl in read_only
+    mode.
+        skiprows: rows before the header row
+        sheet_name: name or index of the workbook sheet
+        parse_dates: columns converted to datetime64, if present
+    Other read_workbook() arguments are ignored.
+    """
+    if str(path).lower().endswith('.csv'):
+        chunks = pd.read_csv(path, skiprows=skiprows, chunksize=chunksize)
+    else:
+        chunks = _iter_workbook(path, chunksize, skiprows, sheet_name)
+    for df in chunks:
+        for col in parse_dates:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col])
+        yield df
+
+def _iter_workbook(path, chunksize: int, skiprows: int, sheet_name):
+    """ Chunks of the rows of a workbook sheet, read with openpyxl
+    """
+    # openpyxl is only needed for streaming workbooks
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        if isinstance(sheet_name, str):
+            sheet = workbook[sheet_name]
+        else:
+            sheet = workbook.worksheets[sheet_name]
+        rows = sheet.iter_rows(min_row=skiprows + 1, values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        # name the columns like pandas does
+        columns = [f'Unnamed: {j}' if col is None else col
+                   for j, col in enumerate(header)]
+        chunk = []
+        for row in rows:
+            # rows without any values are left out, as pandas does
+            if all(value is None for value in row):
+                continue
+            chunk.append(row)
+            if len(chunk) == chunksize:
+                yield _frame(chunk, columns)
+                chunk = []
+        if chunk:
+            yield _frame(chunk, columns)
+    finally:
+        workbook.close()
+
+def _frame(rows: list, columns: list) -> pd.DataFrame:
+    """ DataFrame of the rows of a chunk, with empty cells as NaN
+    """
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notna(), np.nan)
+    return df
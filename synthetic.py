@@ -0,0 +1,198 @@
+import os
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from analysis import HOUR, DAY
+
+# name parts to draw officers from; multi word last names, initials,
+# accents and suffixes are what trips up the name matching in real exports
+FIRST_NAMES = ['Sally', 'William', 'Xena', 'Daniel', 'Lana', 'Marlene',
+               'Léo', 'Jasper', 'Robin', 'Sean', 'Ty', 'Vinnie', 'Dante',
+               'Grace', 'Hugh', 'Jack', 'Elena', 'Blake', 'Candice', 'Saul',
+               'Tori', 'Salvatore', 'Benjamin', 'Alex', 'J R', 'D Jasper']
+LAST_NAMES = ['Avvocata', 'Cole', 'Duke', 'O Shea', 'Gray Quinn', 'Pearl',
+              'Moira Keller', 'Probencrux', 'Steele', 'Tinker', 'Slaughter',
+              'Mac', 'DeFitt', 'Nixon', 'Greco', 'Marone', 'Littman',
+              'Stiffington', 'Raptor', 'Johnson', 'Frost', 'Cain']
+SUFFIXES = ['', '', '', '', '', '', ' Jr', ' X', ' XV']
+# syllables of made up last names, once the names above run out
+SYLLABLES = ['ab', 'bel', 'cor', 'dan', 'el', 'fitz', 'gar', 'hol', 'ing',
+             'jor', 'kem', 'lo', 'mar', 'nor', 'ost', 'per', 'quin', 'ros',
+             'sten', 'tal', 'ur', 'vos', 'wick', 'yar', 'zen']
+RANKS = ['Cadet', 'Officer', 'Senior Officer', 'Corporal', 'Sergeant',
+         'Lieutenant', 'Captain']
+DEPARTMENTS = ['LSPD', 'BCSO', 'SASP']
+
+def typo(name: str, rng) -> str:
+    """ A misspelling of name like the ones found in real exports (see
+    unique_mapping_issues.dat):
+        Daniel O Shea -> Daniel OShea (space dropped)
+        William Cole -> Wiliam Cole (letter dropped)
+        Sally Avvocata -> Sally Avwocata (neighbouring key)
+        Xena Duke -> Xena Dukes (letter added)
+        Léo Moira Keller -> Leo Moira Keller (accent dropped)
+        D Jasper Probencrux XV -> D Jasper Probencrux X (suffix cut)
+    """
+    kind = rng.integers(6)
+    spaces = [i for i, c in enumerate(name) if c == ' ']
+    if kind == 0 and len(spaces) > 1:
+        i = spaces[rng.integers(1, len(spaces))]
+        return name[:i] + name[i + 1:]
+    if kind == 1 and len(name) > 4:
+        i = int(rng.integers(1, len(name) - 1))
+        if name[i] != ' ':
+            return name[:i] + name[i + 1:]
+    if kind == 2 and ('v' in name or 'm' in name):
+        return name.replace('v', 'w', 1) if 'v' in name \
+               else name.replace('m', 'n', 1)
+    if kind == 4 and not name.isascii():
+        return (unicodedata.normalize('NFKD', name)
+                .encode('ascii', 'ignore').decode())
+    if kind == 5 and name[-1] == 'V':
+        return name[:-1]
+    return name + 's'
+
+def officer_names(nOfficers: int, rng) -> list:
+    """ nOfficers unique officer names
+    """
+    names = []
+    seen = set()
+    while len(names) < nOfficers:
+        name = (f'{FIRST_NAMES[rng.integers(len(FIRST_NAMES))]} '
+                f'{LAST_NAMES[rng.integers(len(LAST_NAMES))]}'
+                f'{SUFFIXES[rng.integers(len(SUFFIXES))]}')
+        while name in seen:
+            # big rosters need more last names than the list has
+            syllables = rng.choice(SYLLABLES, rng.integers(2, 4))
+            name = (f'{FIRST_NAMES[rng.integers(len(FIRST_NAMES))]} '
+                    f'{"".join(syllables).capitalize()}')
+        seen.add(name)
+        names.append(name)
+    return names
+
+def generate(outDir, nOfficers: int = 50, nDays: int = 30,
+             sessionsPerDay: float = 0.8, incidentsPerDay: float = 10,
+             crashRate: float = 0.02, duplicateRate: float = 0.01,
+             typoRate: float = 0.003, start='2023-03-01',
+             formats=('xlsx',), seed: int = 0) -> dict:
+    """ Write a synthetic roster, timesheet and incident report to outDir,
+    laid out like the PD exports the parsers read:
+        nOfficers: officers on the roster; about 5% never log in and a few
+            K9 units are added on top
+        nDays: length of the time period
+        sessionsPerDay: average sessions per officer per day
+        incidentsPerDay: incidents over the whole department per day
+        crashRate: sessions without a check out, i.e. the next check in is
+            a crash
+        duplicateRate: check ins written twice
+        typoRate: rows (and roster/incident entries) with a misspelled name
+        formats: any of 'xlsx' and 'csv'
+    Returns a dict of (format, 'roster'|'timesheet'|'incidents') -> path and
+    'rows' and 'incidents' -> their number.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(outDir, exist_ok=True)
+    names = officer_names(nOfficers, rng)
+    stateIDs = rng.choice(np.arange(10000, 99999), nOfficers, replace=False)
+    typos = [typo(name, rng) for name in names]
+    begin = pd.Timestamp(start).value
+    end = begin + nDays * DAY
+
+    # sessions: alternating gaps and shifts per officer, laid end to end
+    active = rng.random(nOfficers) > 0.05
+    nSessions = rng.poisson(sessionsPerDay * nDays, nOfficers) * active
+    officer = np.repeat(np.arange(nOfficers), nSessions)
+    length = rng.gamma(2, 1.5, len(officer)) * HOUR
+    gap = rng.exponential(DAY / sessionsPerDay, len(officer))
+    elapsed = np.cumsum(length + gap)
+    # restart the running sum for every officer
+    first = np.cumsum(nSessions) - nSessions
+    elapsed -= np.repeat(np.r_[0, elapsed][first], nSessions)
+    login = (begin + elapsed - length).astype(np.int64)
+    logout = (begin + elapsed).astype(np.int64)
+    keep = logout < end
+
+    # the check in/out rows with crashes (missing check outs), duplicated
+    # check ins and officers checked in before the time period
+    crashed = rng.random(len(login)) < crashRate
+    duplicate = rng.random(len(login)) < duplicateRate
+    preIn = rng.random(nOfficers) < 0.05
+    times = np.concatenate([login[keep], logout[keep & ~crashed],
+                            login[keep & duplicate],
+                            np.full(preIn.sum(), begin + HOUR // 2)])
+    who = np.concatenate([officer[keep], officer[keep & ~crashed],
+                          officer[keep & duplicate], np.flatnonzero(preIn)])
+    action = np.repeat(['Check In', 'Check Out', 'Check In', 'Check Out'],
+                       [keep.sum(), (keep & ~crashed).sum(),
+                        (keep & duplicate).sum(), preIn.sum()])
+    order = np.lexsort((action == 'Check In', times))
+    times, who, action = times[order], who[order], action[order]
+    rowNames = np.where(rng.random(len(who)) < typoRate,
+                        np.array(typos, dtype=object)[who],
+                        np.array(names, dtype=object)[who])
+    # a State ID isn't always recorded
+    rowIDs = stateIDs[who].astype(float)
+    rowIDs[rng.random(len(who)) < 0.01] = np.nan
+    time = pd.to_datetime(times).floor('s')
+    timesheet = pd.DataFrame({
+        'Local': time.strftime('%m/%d/%Y %I:%M %p'),
+        'Time': time, 'State ID': rowIDs, 'Name': rowNames,
+        'Action': action})
+
+    # roster with some misspelled names and K9 units that never log in
+    nK9 = max(nOfficers // 50, 1)
+    rosterNames = [typos[i] if rng.random() < typoRate else names[i]
+                   for i in range(nOfficers)]
+    roster = pd.DataFrame({
+        'Name': rosterNames + [f'K9 {LAST_NAMES[i % len(LAST_NAMES)]}'
+                               for i in range(nK9)],
+        'StateID': np.r_[stateIDs, np.full(nK9, np.nan)],
+        'Rank': list(rng.choice(RANKS, nOfficers)) + ['K9'] * nK9,
+        'Position': ['Patrol'] * nOfficers + ['K9 Unit'] * nK9,
+        'Callsign': [f'{100 + i}' for i in range(nOfficers + nK9)],
+        'Department': list(rng.choice(DEPARTMENTS, nOfficers))
+                      + ['LSPD'] * nK9,
+        'Shift': list(rng.choice(['1', '2', '3'], nOfficers + nK9))})
+
+    # incidents started by one officer with up to 3 others involved
+    nIncidents = rng.poisson(incidentsPerDay * nDays)
+    incTimes = pd.to_datetime(np.sort(rng.integers(begin, end, nIncidents)))
+    startedBy = np.flatnonzero(active)[
+        rng.integers(active.sum(), size=nIncidents)]
+    involved = []
+    for n in rng.integers(0, 4, nIncidents):
+        others = [typos[i] if rng.random() < typoRate else names[i]
+                  for i in rng.integers(nOfficers, size=n)]
+        involved.append(','.join(others) if others else np.nan)
+    incidents = pd.DataFrame({
+        'IncidentNr': np.arange(1000, 1000 + nIncidents),
+        'Date': incTimes.strftime('%Y-%m-%d %H:%M:%S'),
+        'StartedBy': np.array(names, dtype=object)[startedBy],
+        'Involved': involved})
+
+    paths = {'rows': len(timesheet), 'incidents': nIncidents}
+    # the timesheet export has its header on row 3
+    preamble = pd.DataFrame([['PD Hours'], [''], ['']])
+    for fmt in formats:
+        path = {kind: os.path.join(outDir, f'{kind}.{fmt}')
+                for kind in ('roster', 'timesheet', 'incidents')}
+        if fmt == 'xlsx':
+            with pd.ExcelWriter(path['timesheet']) as writer:
+                preamble.to_excel(writer, index=False, header=False)
+                timesheet.to_excel(writer, index=False, startrow=3)
+            roster.to_excel(path['roster'], index=False)
+            incidents.to_excel(path['incidents'], sheet_name='_Incidents',
+                               index=False)
+        elif fmt == 'csv':
+            with open(path['timesheet'], 'w') as f:
+                f.write('PD Hours\n\n\n')
+                timesheet.to_csv(f, index=False)
+            roster.to_csv(path['roster'], index=False)
+            incidents.to_csv(path['incidents'], index=False)
+        else:
+            raise ValueError(f'Unknown format {fmt}')
+        for kind, p in path.items():
+            paths[fmt, kind] = p
+    return paths
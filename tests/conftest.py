@@ -0,0 +1,33 @@
+import contextlib
+import io
+import os
+import sys
+
+import pytest
+
+# the modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parsers
+import synthetic
+
+@pytest.fixture(scope='session')
+def exports(tmp_path_factory):
+    """ Synthetic roster, timesheet and incident exports (xlsx and csv) of a
+    month with the 2023 spring DST change in it, see synthetic.generate
+    """
+    return synthetic.generate(tmp_path_factory.mktemp('exports'),
+                              nOfficers=40, nDays=30, start='2023-03-01',
+                              typoRate=0.02, formats=('xlsx', 'csv'))
+
+@pytest.fixture(scope='session')
+def characters(exports):
+    """ Character dict of the parsed synthetic timesheet and incidents
+    """
+    characters = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        parsers.Timesheet(characters,
+                          exports['xlsx', 'timesheet']).parseTimesheet()
+        parsers.IncidentReport(characters,
+                               exports['xlsx', 'incidents']).parseIncidents()
+    return characters
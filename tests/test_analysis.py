@@ -0,0 +1,192 @@
+""" analysis.TimeEvents against the per event loop of the first versions of
+Character.analyzeTimeEvents, which it replaced
+"""
+import contextlib
+import copy
+import io
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import TimeEvents
+from character import Character
+from department import analyze_department
+
+def legacy_analysis(char) -> dict:
+    """ The per event loop of Character.analyzeTimeEvents before TimeEvents,
+    returning the values it stashed on the character
+    """
+    firsttime = char.logins[0]
+    lasttime = char.logouts[-1]
+    m = firsttime.date() - timedelta(days = firsttime.weekday())
+    firstMonday = int(datetime.combine(m,
+                                       datetime.min.time()).strftime('%s'))
+    m = lasttime.date() + timedelta(days = 7-firsttime.weekday())
+    lastMonday = int(datetime.combine(m,
+                                      datetime.min.time()).strftime('%s'))
+    weekBoundaries = np.arange(firstMonday,lastMonday, 604800)
+    nWeeks = len(weekBoundaries) - 1
+    hoursPerWeek = np.zeros(nWeeks)
+    shiftTime = [0, 0, 0]
+
+    boundaries = [pd.Timedelta(i,'h') for i in [-15,-7,1,9,17,25,33]]
+    nShifts = len(boundaries)-1
+    unit = pd.Timedelta(1,'h')
+    for i in range(0, min(len(char.logins),len(char.logouts))):
+        start_of_day = char.logins[i].normalize()
+        work_time = [0] * nShifts
+        for j, (lb, ub) in enumerate(zip(boundaries[:-1],boundaries[1:])):
+            shift_st = start_of_day + lb
+            shift_et = start_of_day + ub
+            t = (min(char.logouts[i], shift_et)
+                 - max(char.logins[i], shift_st)) / unit
+            work_time[j] = max(0,t)
+        for j in range(nShifts):
+            shiftTime[j % 3] += work_time[j]
+
+        work_time = np.zeros(nWeeks)
+        for j, (lb, ub) in enumerate(zip(weekBoundaries[:-1],
+                                         weekBoundaries[1:])):
+            t = (min(int(char.logouts[i].strftime('%s')),ub)
+                 - max(int(char.logins[i].strftime('%s')),lb))
+            work_time[j] = max(0,t)
+        hoursPerWeek += work_time
+    hoursPerWeek /= 3600
+
+    incidentsPerWeek = np.zeros(nWeeks)
+    shiftIncidents = [0, 0, 0]
+    for i in range(len(char.incidents)):
+        # the incidents were datetimes, whose timestamp() is local time
+        reportTime = char.incidents[i][1].to_pydatetime().timestamp()
+        for j, (lb, ub) in enumerate(zip(weekBoundaries[:-1],
+                                         weekBoundaries[1:])):
+            if reportTime >= lb and reportTime < ub:
+                incidentsPerWeek[j] += 1
+        start_of_day = datetime.combine(char.incidents[i][1].date(),
+                                        datetime.min.time())
+        work_time = [0] * nShifts
+        for j, (lb, ub) in enumerate(zip(boundaries[:-1],boundaries[1:])):
+            shift_st = (start_of_day + lb).timestamp()
+            shift_et = (start_of_day + ub).timestamp()
+            if reportTime >= shift_st and reportTime < shift_et:
+                work_time[j] += 1
+        for j in range(nShifts):
+            shiftIncidents[j % 3] += work_time[j]
+
+    return {'shiftTime': shiftTime, 'hoursPerWeek': hoursPerWeek,
+            'incidentsPerWeek': incidentsPerWeek,
+            'shiftIncidents': shiftIncidents}
+
+def events_of(char, tz=None) -> TimeEvents:
+    """
+    """
+    return TimeEvents(char.logins.epochs, char.logouts.epochs,
+                      char.incidents.times.epochs, tz=tz)
+
+@pytest.fixture
+def local_time(monkeypatch):
+    """ Run the process in a timezone, like the legacy loop's strftime('%s')
+    reads times in
+    """
+    def setTZ(tz):
+        monkeypatch.setenv('TZ', tz)
+        time.tzset()
+    yield setTZ
+    monkeypatch.undo()
+    time.tzset()
+
+def analyzed(characters) -> list:
+    """ Characters the legacy loop can analyze
+    """
+    return [char for char in characters.values()
+            if len(char.logins) > 0 and len(char.logouts) > 0]
+
+def test_same_as_legacy_in_utc(characters, local_time):
+    local_time('UTC')
+    for char in analyzed(characters):
+        legacy = legacy_analysis(char)
+        events = events_of(char)
+        assert events.hoursPerShift().tolist() == legacy['shiftTime']
+        np.testing.assert_array_equal(events.hoursPerWeek(),
+                                      legacy['hoursPerWeek'])
+        np.testing.assert_array_equal(events.incidentsPerWeek(),
+                                      legacy['incidentsPerWeek'])
+        assert (events.incidentsPerShift().tolist()
+                == legacy['shiftIncidents'])
+
+def test_same_as_legacy_in_dst_zone(characters, local_time):
+    local_time('America/New_York')
+    differs = 0
+    for char in analyzed(characters):
+        legacy = legacy_analysis(char)
+        events = events_of(char, 'America/New_York')
+        assert events.hoursPerShift().tolist() == legacy['shiftTime']
+        np.testing.assert_array_equal(events.hoursPerWeek(),
+                                      legacy['hoursPerWeek'])
+        np.testing.assert_array_equal(events.incidentsPerWeek(),
+                                      legacy['incidentsPerWeek'])
+        assert (events.incidentsPerShift().tolist()
+                == legacy['shiftIncidents'])
+        naive = events_of(char).hoursPerWeek()
+        differs += (len(naive) != len(legacy['hoursPerWeek'])
+                    or not np.array_equal(naive, legacy['hoursPerWeek']))
+    # the weeks have to be binned in the timezone to match
+    assert differs > 0
+
+@pytest.mark.parametrize('tz', ['America/New_York', 'UTC'])
+def test_weeks_default_to_local_time(characters, local_time, tz):
+    local_time(tz)
+    department = copy.deepcopy(characters)
+    naive = copy.deepcopy(characters)
+    with contextlib.redirect_stdout(io.StringIO()):
+        analyze_department(department, update_characters=True)
+        analyze_department(naive, update_characters=True, tz=None)
+    for char in analyzed(characters):
+        legacy = legacy_analysis(char)
+        alone = copy.deepcopy(char)
+        alone.analyzeTimeEvents()
+        for binned in (department[char.name], alone):
+            np.testing.assert_array_equal(binned.hoursPerWeek,
+                                          legacy['hoursPerWeek'])
+            np.testing.assert_array_equal(binned.incidentsPerWeek,
+                                          legacy['incidentsPerWeek'])
+        # without a timezone the wall clock times are binned as they are
+        events = events_of(char)
+        np.testing.assert_array_equal(naive[char.name].hoursPerWeek,
+                                      events.hoursPerWeek())
+        np.testing.assert_array_equal(naive[char.name].incidentsPerWeek,
+                                      events.incidentsPerWeek())
+
+@pytest.mark.parametrize('sessions, incidents', [
+    # across the DST gap
+    ([('2023-03-11 23:00', '2023-03-12 04:00')],
+     ['2023-03-12 01:30', '2023-03-12 03:30']),
+    # in the gap itself
+    ([('2023-03-12 02:15', '2023-03-12 02:45')], ['2023-03-12 02:30']),
+    # across Monday midnight right after the change, in an export starting
+    # on a Tuesday so the number of weeks depends on the timezone too
+    ([('2023-03-07 10:00', '2023-03-07 12:00'),
+      ('2023-03-12 23:30', '2023-03-13 00:30'),
+      ('2023-03-20 23:50', '2023-03-21 08:00')],
+     ['2023-03-07 11:00', '2023-03-12 23:45', '2023-03-13 00:15',
+      '2023-03-20 23:55', '2023-03-21 00:30']),
+])
+def test_dst_weeks(sessions, incidents, local_time):
+    local_time('America/New_York')
+    char = Character('Xena Duke', 12345)
+    for login, logout in sessions:
+        char.logins.append(pd.Timestamp(login))
+        char.logouts.append(pd.Timestamp(logout))
+    for number, time in enumerate(incidents):
+        char.incidents.append([number, pd.Timestamp(time)])
+    legacy = legacy_analysis(char)
+    events = events_of(char, 'America/New_York')
+    np.testing.assert_array_equal(events.hoursPerWeek(),
+                                  legacy['hoursPerWeek'])
+    assert events.hoursPerWeek().sum() == legacy['hoursPerWeek'].sum()
+    np.testing.assert_array_equal(events.incidentsPerWeek(),
+                                  legacy['incidentsPerWeek'])
+    assert events.incidentsPerShift().tolist() == legacy['shiftIncidents']
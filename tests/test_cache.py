@@ -0,0 +1,42 @@
+""" Sheets stored by cache.WorkbookCache against the sheets decoded from the
+workbooks
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import cache
+
+@pytest.mark.parametrize('arrow', [True, False])
+def test_same_as_decoded(exports, tmp_path, monkeypatch, arrow):
+    if not arrow:
+        monkeypatch.setattr(cache, 'pyarrow', None)
+    elif cache.pyarrow is None:
+        pytest.skip('pyarrow is not installed')
+    workbooks = cache.WorkbookCache(tmp_path)
+    for kind in ('timesheet', 'roster', 'incidents'):
+        path = exports['xlsx', kind]
+        decoded = cache.read_workbook(path)
+        assert not workbooks.contains(path)
+        pd.testing.assert_frame_equal(workbooks.read(path), decoded)
+        assert workbooks.contains(path)
+        pd.testing.assert_frame_equal(workbooks.read(path), decoded)
+
+def test_mixed_columns_without_pickle(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'pyarrow', None)
+    df = pd.DataFrame({
+        'Time': pd.to_datetime(['2023-03-01 10:00', None]),
+        'Callsign': np.array(['K9-1', 12], dtype=object),
+        'When': np.array([pd.Timestamp('2023-03-01'), datetime.time(3, 4)],
+                         dtype=object),
+        5: [1.5, np.nan]})
+    workbooks = cache.WorkbookCache(tmp_path)
+    workbooks._store('sheet', df, 'digest')
+    # cache._load() reads it without pickle
+    stored = cache._load(str(tmp_path / 'sheet.npz'))
+    pd.testing.assert_frame_equal(stored, df)
+    for column in ('Callsign', 'When'):
+        assert ([type(v) for v in stored[column]]
+                == [type(v) for v in df[column]])
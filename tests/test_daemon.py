@@ -0,0 +1,41 @@
+""" Answers of daemon.AnalysisDaemon, asked without a socket
+"""
+import contextlib
+import io
+import json
+
+import pytest
+
+from daemon import AnalysisDaemon
+
+def ask(daemon, **query) -> dict:
+    """ Answer of the daemon to a query
+    """
+    return json.loads(daemon.answer(json.dumps(query).encode()))
+
+@pytest.fixture(scope='module')
+def daemon(exports):
+    """ A daemon with the exports loaded
+    """
+    daemon = AnalysisDaemon(exports['xlsx', 'timesheet'],
+                            exports['xlsx', 'roster'],
+                            exports['xlsx', 'incidents'])
+    with contextlib.redirect_stdout(io.StringIO()):
+        daemon.snapshot = daemon.build()
+    return daemon
+
+def test_character_text(daemon):
+    timesheet = daemon.snapshot.timesheet
+    for name in list(daemon.snapshot.characters)[:10]:
+        answer = ask(daemon, query='character', name=name)
+        assert answer['text'] == timesheet.getCharacterData([name])
+
+def test_relative_times_are_not_cached(daemon):
+    daemon._answers.clear()
+    ask(daemon, query='on_duty', time='now')
+    ask(daemon, query='on_duty', time='today')
+    assert len(daemon._answers) == 0
+    time = str(daemon.snapshot.timesheet.firsttime)
+    first = ask(daemon, query='on_duty', time=time)
+    assert len(daemon._answers) == 1
+    assert ask(daemon, query='on_duty', time=time) == first
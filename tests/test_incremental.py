@@ -0,0 +1,106 @@
+""" An --incremental run on a cumulative timesheet export against a full run
+on the same export
+"""
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import parsers
+from department import analyze_department
+from incremental import Checkpoint
+from results import ResultsStore, merge_results, result_tables, save_results
+
+def character_results(characters: dict) -> dict:
+    """ What Character.analyzeTimeEvents stashes on every character
+    """
+    results = {}
+    for name, char in characters.items():
+        char.analyzeTimeEvents()
+        results[name] = (char.loggedIn, char.loggedTime, char.shift1Time,
+                         char.shift2Time, char.shift3Time,
+                         list(char.hoursPerWeek))
+    return results
+
+def earlier_export(path, tmp_path, fraction: float):
+    """ The rows of the export so far, preamble and header included
+    """
+    raw = pd.read_excel(path, header=None)
+    earlier = tmp_path / 'timesheet.xlsx'
+    raw.iloc[:int(len(raw) * fraction)].to_excel(earlier, index=False,
+                                                 header=False)
+    return earlier
+
+def stored(path) -> tuple:
+    """ Sessions and anomalies of a results store, by character name
+    """
+    store = ResultsStore(path)
+    names = store.column('characters', 'name')
+    sessions = store.table('sessions')
+    anomalies = store.table('anomalies')
+    sessions['char'] = names[sessions['char']]
+    anomalies['char'] = names[anomalies['char']]
+    return (sessions.sort_values(['char', 'start'], kind='stable',
+                                 ignore_index=True),
+            anomalies.sort_values('char', kind='stable', ignore_index=True))
+
+@pytest.mark.parametrize('fraction', [0.25, 0.5, 0.9])
+def test_same_as_full_run(exports, tmp_path, fraction):
+    path = exports['xlsx', 'timesheet']
+    earlier = earlier_export(path, tmp_path, fraction)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        full = {}
+        parsers.Timesheet(full, path).parseTimesheet()
+        fullOverview = analyze_department(full)
+
+        first = {}
+        timesheet = parsers.Timesheet(first, earlier)
+        timesheet.parseTimesheet()
+        analyze_department(first)
+        Checkpoint.fromTimesheet(timesheet).save(tmp_path / 'checkpoint.json')
+
+        later = {}
+        parsers.Timesheet(later, path).parseTimesheet(
+            Checkpoint.load(tmp_path / 'checkpoint.json'))
+        laterOverview = analyze_department(later)
+
+    pd.testing.assert_frame_equal(
+        laterOverview.set_index('Name').sort_index(),
+        fullOverview.set_index('Name').sort_index())
+    assert character_results(later) == character_results(full)
+
+@pytest.mark.parametrize('fraction', [0.25, 0.9])
+def test_results_keep_earlier_sessions(exports, tmp_path, fraction):
+    path = exports['xlsx', 'timesheet']
+    earlier = earlier_export(path, tmp_path, fraction)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        full = {}
+        timesheet = parsers.Timesheet(full, path)
+        timesheet.parseTimesheet()
+        analyze_department(full, update_characters=True)
+        save_results(tmp_path / 'full', full, timesheet)
+
+        first = {}
+        timesheet = parsers.Timesheet(first, earlier)
+        timesheet.parseTimesheet()
+        analyze_department(first, update_characters=True)
+        save_results(tmp_path / 'results', first, timesheet)
+        checkpoint = Checkpoint.fromTimesheet(timesheet)
+
+        later = {}
+        timesheet = parsers.Timesheet(later, path)
+        timesheet.parseTimesheet(checkpoint)
+        analyze_department(later, update_characters=True)
+        tables = merge_results(result_tables(later, timesheet),
+                               ResultsStore(tmp_path / 'results', mmap=False))
+        save_results(tmp_path / 'results', later, timesheet, tables=tables)
+
+    for merged, whole in zip(stored(tmp_path / 'results'),
+                             stored(tmp_path / 'full')):
+        pd.testing.assert_frame_equal(merged, whole)
+    char = ResultsStore(tmp_path / 'results').characters
+    for name in full:
+        assert list(char[name].logins) == list(full[name].logins)
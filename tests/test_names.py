@@ -0,0 +1,49 @@
+""" names.NameResolver against the linear scan of parsers.check_names it
+replaced
+"""
+import contextlib
+import io
+
+import numpy as np
+
+import synthetic
+from names import NameResolver
+from parsers import check_names
+
+def sheet_names(nOfficers: int, nRows: int, seed: int = 0) -> list:
+    """ Names as they show up in the exports: mostly right, some misspelled
+    """
+    rng = np.random.default_rng(seed)
+    names = synthetic.officer_names(nOfficers, rng)
+    rows = []
+    for i in rng.integers(nOfficers, size=nRows):
+        rows.append(synthetic.typo(names[i], rng) if rng.random() < 0.2
+                    else names[i])
+    return rows
+
+def resolve_all(resolve, names: list):
+    """ Resolve names one after the other into a dict, like the parsers do,
+    returning the answers and the messages printed
+    """
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        answers = [resolve(name) for name in names]
+    return answers, set(out.getvalue().splitlines())
+
+def test_same_as_check_names():
+    names = sheet_names(60, 2000)
+    scanned = {}
+    def scan(name):
+        answer = check_names(name, scanned)
+        scanned.setdefault(answer, True)
+        return answer
+    indexed = {}
+    resolver = NameResolver(indexed)
+    def index(name):
+        answer = resolver.resolve(name)
+        indexed.setdefault(answer, True)
+        return answer
+    # the resolver remembers its fuzzy matches, so it prints each message
+    # once rather than for every row
+    assert resolve_all(index, names) == resolve_all(scan, names)
+    assert list(indexed) == list(scanned)
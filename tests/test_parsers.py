@@ -0,0 +1,103 @@
+""" Timesheet.parseTimesheet, which pairs the events of all rows at once
+with parsers.classify_events, against the row by row loop of the first
+versions of the parser
+"""
+import contextlib
+import io
+
+import pytest
+
+import parsers
+import synthetic
+
+def legacy_pairing(df, mapping: dict) -> dict:
+    """ The loop over the rows of Timesheet.parseTimesheet before
+    classify_events, given the mapping of sheet names to character names.
+    Returns the loggedIn, logins, logouts, loggedTime and strangeness it
+    left on every character
+    """
+    state = {name: {'loggedIn': False, 'logins': [], 'logouts': [],
+                    'loggedTime': 0,
+                    'strangeness': {'crashes': [], 'pre': [], 'post': [],
+                                    'other': []}}
+             for name in mapping.values()}
+    # loop over all events
+    for i in range(len(df.Action)):
+        # if the name is non-existant or weirdly formatted, SKIP
+        if not df.Name[i] or type(df.Name[i]) != str:
+            continue
+        char = state[mapping[df.Name[i]]]
+
+        # check for normal check in event
+        if df.Action[i] == 'Check In' and not char['loggedIn']:
+            char['logins'].append(df.Time[i])
+            char['loggedIn'] = True
+        # check for normal check out event
+        elif df.Action[i] == 'Check Out' and char['loggedIn']:
+            char['logouts'].append(df.Time[i])
+            char['loggedIn'] = False
+            char['loggedTime'] += (char['logouts'][-1].timestamp()
+                                   - char['logins'][-1].timestamp())/3600
+        # checks in while already checked in; likely after a crash
+        elif df.Action[i] == 'Check In' and char['loggedIn']:
+            char['strangeness']['crashes'].append(list(df.iloc[i]))
+        # checked in _before_ the time period of the sheet
+        elif df.Action[i] == 'Check Out' and not char['loggedIn']:
+            char['strangeness']['pre'].append(list(df.iloc[i]))
+        else:
+            char['strangeness']['other'].append(list(df.iloc[i]))
+
+    # check if anyone was still logged on at the end of the time period
+    for orig, name in mapping.items():
+        if state[name]['loggedIn']:
+            chardf = df[df.Name == orig]
+            state[name]['strangeness']['post'].append(list(chardf.iloc[-1]))
+    return state
+
+def as_text(state: dict) -> dict:
+    """ The state of legacy_pairing with every time and row value as text
+    """
+    return {name: {'loggedIn': bool(char['loggedIn']),
+                   'logins': [str(t) for t in char['logins']],
+                   'logouts': [str(t) for t in char['logouts']],
+                   'loggedTime': char['loggedTime'],
+                   'strangeness': {kind: [[str(v) for v in row]
+                                          for row in rows]
+                                   for kind, rows in
+                                   char['strangeness'].items()}}
+            for name, char in state.items()}
+
+@pytest.fixture(scope='module')
+def rough_exports(tmp_path_factory):
+    """ Exports with many crashes, duplicate rows and misspelled names
+    """
+    return synthetic.generate(tmp_path_factory.mktemp('rough'),
+                              nOfficers=60, nDays=20, crashRate=0.15,
+                              duplicateRate=0.1, typoRate=0.05, seed=3)
+
+@pytest.mark.parametrize('which', ['exports', 'rough_exports'])
+def test_same_as_legacy_loop(which, request):
+    path = request.getfixturevalue(which)['xlsx', 'timesheet']
+    characters = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        timesheet = parsers.Timesheet(characters, path)
+        df = timesheet.readSheet()
+        df['State ID'] = df['State ID'].fillna(-9999)
+        timesheet.parseTimesheet(df=df.copy())
+        # the same names as the parser resolved
+        mapping = {}
+        parsers.Timesheet({}, path).mapNames(
+            df[['State ID', 'Name']].drop_duplicates(), mapping)
+    legacy = as_text(legacy_pairing(df, mapping))
+
+    parsed = as_text({name: {'loggedIn': char.loggedIn,
+                             'logins': list(char.logins),
+                             'logouts': list(char.logouts),
+                             'loggedTime': char.loggedTime,
+                             'strangeness': {kind: char.strangeness[kind]
+                                             for kind in char.strangeness}}
+                      for name, char in characters.items()})
+    assert parsed == legacy
+    # the exports have every kind of row the loop tells apart
+    for kind in ('crashes', 'pre', 'post'):
+        assert any(char['strangeness'][kind] for char in legacy.values())
@@ -0,0 +1,60 @@
+""" Reporting periods ingested by pipeline.ingest_periods
+"""
+import contextlib
+import io
+
+import pandas as pd
+import pytest
+
+import parsers
+from periods import compare_periods
+from pipeline import ingest_periods
+
+def split_timesheet(path, paths: list):
+    """ Write the first and second half of the rows of a timesheet export to
+    the two paths, as the exports of two periods
+    """
+    raw = pd.read_excel(path, header=None)
+    header, cut = raw.iloc[:4], 4 + (len(raw) - 4) // 2
+    for out, rows in zip(paths, (raw.iloc[4:cut], raw.iloc[cut:])):
+        pd.concat([header, rows]).to_excel(out, index=False, header=False)
+
+def test_shared_incident_export_is_parsed_once(exports, tmp_path):
+    # two periods of the timesheet, with the incident export of the whole
+    # month given for both
+    paths = [tmp_path / 'first.xlsx', tmp_path / 'second.xlsx']
+    split_timesheet(exports['xlsx', 'timesheet'], paths)
+    incidents = exports['xlsx', 'incidents']
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        characters = {}
+        _, _, reports = ingest_periods(
+            characters, [(paths[0], incidents), (paths[1], incidents)],
+            workers=1)
+        once = {}
+        parsers.Timesheet(once, exports['xlsx', 'timesheet']).parseTimesheet()
+        parsers.IncidentReport(once, incidents).parseIncidents()
+
+    assert reports[0] is reports[1]
+    assert ({name: len(char.incidents) for name, char in characters.items()}
+            == {name: len(char.incidents) for name, char in once.items()})
+
+def test_periods_of_the_same_file_name(exports, tmp_path):
+    # a folder per month with the exports named alike
+    paths = [tmp_path / 'march' / 'timesheet.xlsx',
+             tmp_path / 'april' / 'timesheet.xlsx']
+    for path in paths:
+        path.parent.mkdir()
+    split_timesheet(exports['xlsx', 'timesheet'], paths)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        characters = {}
+        timesheets, _, _ = ingest_periods(
+            characters, [(path, None) for path in paths], workers=1)
+        table = compare_periods(characters, timesheets)
+        with pytest.raises(ValueError):
+            compare_periods(characters, timesheets, ['march', 'march'])
+
+    hours = [table[f'{month}/timesheet Hours'] for month in ('march', 'april')]
+    assert hours[0].sum() > 0 and hours[1].sum() > 0
+    assert (hours[1] - hours[0]).tolist() == table['Hours Change'].tolist()
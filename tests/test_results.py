@@ -0,0 +1,39 @@
+""" Characters saved with results.save_results and rebuilt by ResultsStore
+"""
+import numpy as np
+
+from character import Character
+from results import ResultsStore, save_results
+
+def test_roster_values_keep_their_type(tmp_path):
+    # callsigns and shifts are read as numbers or as text, row by row
+    saved = [('Xena Duke', 12, '2'), ('Saul Cole', 'K9-1', 3),
+             ('Ty Mac', None, 2.5)]
+    characters = {}
+    for stateID, (name, callsign, shift) in enumerate(saved):
+        char = Character(name, stateID)
+        char.callsign, char.shift, char.rank = callsign, shift, 'Officer'
+        characters[name] = char
+    save_results(tmp_path / 'results', characters)
+
+    store = ResultsStore(tmp_path / 'results')
+    for name, callsign, shift in saved:
+        char = store.character(name)
+        assert (char.callsign, char.shift) == (callsign, shift)
+        assert type(char.callsign) is type(callsign)
+        assert type(char.shift) is type(shift)
+        assert char.rank == 'Officer'
+    assert store.column('characters', 'callsign').tolist() == [12, 'K9-1',
+                                                               None]
+    assert store.column('characters', 'rank').dtype.kind == 'U'
+
+def test_characters_of_a_run(characters, tmp_path):
+    save_results(tmp_path / 'results', characters)
+    store = ResultsStore(tmp_path / 'results')
+    assert list(store.characters) == list(characters)
+    for name, char in characters.items():
+        stored = store.characters[name]
+        assert stored.loggedTime == char.loggedTime
+        np.testing.assert_array_equal(stored.logins.epochs,
+                                      char.logins.epochs)
+        assert len(stored.incidents) == len(char.incidents)
@@ -0,0 +1,55 @@
+""" shiftcalendar.ShiftCalendar across DST changes, where it has to read the
+sheet times the way the EST weeks of the analysis do
+"""
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis import local_epoch, to_epoch
+from character import Character
+from department import analyze_department
+from shiftcalendar import ShiftCalendar
+
+TZ = 'America/New_York'
+
+def test_same_times_as_the_weeks():
+    # clocks go back at 2 AM on November 5th and forward at 2 AM on March
+    # 12th, so 1:30 is there twice and 2:30 not at all
+    times = to_epoch(pd.to_datetime(['2023-11-05 00:30', '2023-11-05 01:00',
+                                     '2023-11-05 01:30', '2023-11-05 02:30',
+                                     '2023-03-12 02:30', '2023-03-12 03:00']))
+    calendar = ShiftCalendar('2023-03-01', '2023-11-30', tz=TZ)
+    np.testing.assert_array_equal(calendar.toEpoch(times),
+                                  local_epoch(times, TZ))
+    assert np.all(np.diff(calendar.boundaries) >= 0)
+
+@pytest.mark.parametrize('login, logout, hours, shiftHours', [
+    # the repeated hour is taken as daylight saving time, so is the start
+    # of Shift 3 at 1 AM; the session lasts an hour longer than on the clock
+    ('2023-11-05 00:30', '2023-11-05 02:30', 3, [0, 0.5, 2.5]),
+    ('2023-11-05 01:30', '2023-11-05 09:30', 9, [0.5, 0, 8.5]),
+    # and the skipped one is taken as an hour later
+    ('2023-03-12 00:30', '2023-03-12 04:00', 2.5, [0, 0.5, 2]),
+])
+def test_fall_back_and_spring_forward(login, logout, hours, shiftHours):
+    char = Character('Xena Duke', 12345)
+    char.logins.append(pd.Timestamp(login))
+    char.logouts.append(pd.Timestamp(logout))
+    char.loggedTime = (pd.Timestamp(logout)
+                       - pd.Timestamp(login)) / pd.Timedelta(1, 'h')
+    # an incident in the hour the clocks change, after Shift 3 started
+    char.incidents.append([1, pd.Timestamp(login[:11] + '01:30')])
+    calendar = ShiftCalendar(login, logout, tz=TZ)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        overview = analyze_department({char.name: char}, calendar=calendar,
+                                      calendar_weeks=True)
+    row = overview.iloc[0]
+    assert row['Time Worked (hrs)'] == pytest.approx(hours)
+    assert [row[f'Shift {i} (hrs)']
+            for i in (1, 2, 3)] == pytest.approx(shiftHours)
+    assert sum(shiftHours) == pytest.approx(hours)
+    assert [row[f'Shift {i} Inc'] for i in (1, 2, 3)] == [0, 0, 1]
@@ -0,0 +1,44 @@
+""" Timesheet.streamTimesheet against the in-memory Timesheet.parseTimesheet
+"""
+import contextlib
+import io
+
+import pytest
+
+import parsers
+
+def parsed(path, chunksize: int = None) -> tuple:
+    """ Everything parsing a timesheet leaves on the characters and the
+    Timesheet, and what it printed; streamed if a chunksize is given
+    """
+    characters = {}
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        timesheet = parsers.Timesheet(characters, path)
+        if chunksize is None:
+            timesheet.parseTimesheet()
+        else:
+            timesheet.streamTimesheet(chunksize=chunksize)
+    state = {name: (char.stateID, char.loggedIn, char.loggedTime,
+                    [str(t) for t in char.logins],
+                    [str(t) for t in char.logouts],
+                    {kind: [[str(v) for v in row]
+                            for row in char.strangeness[kind]]
+                     for kind in char.strangeness})
+             for name, char in characters.items()}
+    return (list(characters), state, timesheet.timesheetString,
+            str(timesheet.firsttime), str(timesheet.lasttime),
+            timesheet.nAtLasttime, timesheet.columns, out.getvalue())
+
+@pytest.fixture(scope='module')
+def in_memory(exports):
+    """
+    """
+    return parsed(exports['xlsx', 'timesheet'])
+
+@pytest.mark.parametrize('chunksize', [1, 7, 500, 10**6])
+def test_same_as_in_memory(exports, in_memory, chunksize):
+    assert parsed(exports['xlsx', 'timesheet'], chunksize) == in_memory
+
+def test_csv_same_as_workbook(exports, in_memory):
+    assert parsed(exports['csv', 'timesheet'], 300) == in_memory